@@ -23,9 +23,14 @@ de_species
 $ python3 iobannotate_corpus.py -d ./../../resources/corpora/training_corpora/de/
   -v ./../../resources/gazetteers/de/ -s ./../../resources/gazetteers/lat/ -l de
 
+# Annotate with 4 worker processes:
+$ python3 iobannotate_corpus.py -d ./../../resources/corpora/training_corpora/de/
+  -v ./../../resources/gazetteers/de/ -s ./../../resources/gazetteers/lat/ -l de --workers 4
+
 """
 
 import argparse
+import multiprocessing
 import os
 import sys
 from collections import defaultdict
@@ -73,193 +78,182 @@ def count_longest_name(len_storage, gaz_storage, gaz_name_list):
         len_storage[gaz] = max_len
 
 
-def get_unigram_indices(gaz_storage, sentence, gaz_name):
+def build_gazetteer_trie(gaz_storage, len_storage):
     """
-    Get sentence indices of unigram plant names.
+    Build a token-level trie over the names of all gazetteers.
+
+    Every node is a dictionary mapping the next token of a name to the child node; the node reached
+    by the last token of a name stores the gazetteer name (entity label) under the key None.
+    If a name occurs in several gazetteers, the label is chosen as before: n-gram gazetteers are
+    preferred over unigram gazetteers, then smaller gazetteers over larger ones. As before, unigram
+    gazetteers (maximum n-gram length == 1) only contribute their single-token names.
 
     :param gaz_storage: gazetteer dictionary
-    :param sentence: list
-    :param gaz_name: name of current gazetteer name
-    :return: gaz_name, all_indices (gazetteer name and all found indices of plant names per sentence)
+    :param len_storage: dictionary containing maximum ngram length per gazetteer
+    :return: trie (nested dictionaries)
+    """
+    by_size = sorted(gaz_storage, key=lambda k: len(gaz_storage[k]))
+    ngram_gazetteers = [gaz for gaz in by_size if len_storage[gaz] > 1]
+    unigram_gazetteers = [gaz for gaz in by_size if len_storage[gaz] == 1]
+
+    trie = {}
+    for gaz_name in ngram_gazetteers + unigram_gazetteers:
+        for plant_name in gaz_storage[gaz_name]:
+            plant_name_list = plant_name.split(" ")
+            if len_storage[gaz_name] == 1 and len(plant_name_list) > 1:
+                continue
+            node = trie
+            for token in plant_name_list:
+                node = node.setdefault(token, {})
+            # keep the label of the gazetteer with the higher priority
+            node.setdefault(None, gaz_name)
+
+    return trie
+
+
+def get_longest_match(trie, sentence, start):
     """
-    all_indices = []
-    for plant_name in gaz_storage[gaz_name]:
-        indexes = [index for index, token in enumerate(sentence) if token == plant_name]  # => [1, 3]
-        if indexes:
-            # print("Found name '{}'  with position {}".format(plant_name, indexes), file=sys.stderr, flush=True)
-            all_indices.extend(indexes)
+    Find the longest plant name starting at a sentence index.
 
-    return gaz_name, all_indices
+    :param trie: gazetteer trie (see build_gazetteer_trie)
+    :param sentence: list of tokens
+    :param start: sentence index of the first token
+    :return: (end, gaz_name) with end exclusive, or None if no name starts at this index
+    """
+    match = None
+    node = trie
+    for index in range(start, len(sentence)):
+        node = node.get(sentence[index])
+        if node is None:
+            break
+        if None in node:
+            match = (index + 1, node[None])
+
+    return match
 
 
-def get_multiword_indices(gaz_storage, sentence, gaz_name):
+def get_iob_labels(trie, sentence):
     """
-    Get sentence indices of multiword plant names.
+    Annotate a sentence in IOB-scheme with a single left-to-right longest-match pass.
 
-    :param gaz_storage: gazetteer dictionary
-    :param sentence: list
-    :param gaz_name: name of current gazetteer name
-    :return: gaz_name, all_indices (gazetteer name and all found indices of plant names per sentence)
+    :param trie: gazetteer trie (see build_gazetteer_trie)
+    :param sentence: list of tokens
+    :return: list of IOB labels (one per token)
+    """
+    labels = []
+    index = 0
+    while index < len(sentence):
+        match = get_longest_match(trie, sentence, index)
+        if match is None:
+            labels.append('O')
+            index += 1
+        else:
+            end, gaz_name = match
+            labels.append('B-{}'.format(gaz_name))
+            labels.extend(['I-{}'.format(gaz_name)] * (end - index - 1))
+            index = end
+
+    return labels
+
+
+def iter_sentences(infile):
     """
-    all_indices = []
-    for plant_name in gaz_storage[gaz_name]:
-        plant_name_list = plant_name.split(" ")
-        token_length = len(plant_name_list)
-
-        # unigram cases in species gazetteerrs:
-        if token_length == 1:
-            indices = [index for index, token in enumerate(sentence) if token == plant_name]
-            if indices:
-                # print("Treating unigram name '{}' of multiword gazetteer with position {}".format(plant_name, indexes), file=sys.stderr, flush=True)
-                all_indices.append(indices)
+    Read the sentences of a tokenized and POS-tagged corpus (one token per line, empty line after each sentence).
 
+    :param infile: file-like object with lines "token\tlemma\ttag"
+    :return: generator of sentences (lists of (token, lemma, tag) tuples)
+    """
+    sentence = []
+    for line in infile:
+        if line == "\n":
+            yield sentence
+            sentence = []
         else:
-            indices = []
-            for i, token in enumerate(range(len(sentence))):
-                try:
-                    subsequence = sentence[i:token_length]
-                    if subsequence == plant_name_list:
-                        indices.append((i, token_length))
-                        # print("Found multiword name '{}'  with position {}".format(plant_name, indexes), file=sys.stderr, flush=True)
-                    token_length += 1
+            token, lemma, tag = line.rstrip("\n").split("\t")
+            sentence.append((token, lemma, tag))
 
-                # reached end of sentence
-                except IndexError:
-                    continue
-            if indices:
-                all_indices.extend(indices)
 
-    return gaz_name, all_indices
+def iter_shards(sentences, shard_size):
+    """
+    Group consecutive sentences into shards of at most shard_size sentences.
+
+    :param sentences: iterable of sentences
+    :param shard_size: number of sentences per shard
+    :return: generator of lists of sentences
+    """
+    shard = []
+    for sentence in sentences:
+        shard.append(sentence)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
 
 
-def get_sentence_indices(total_unigram_indices_per_sentence, total_multiword_indices_per_sentence):
+def annotate_sentences(trie, sentences):
     """
-    Get all indices (unigram and multiword indices) per sentence.
+    Annotate sentences in iob-scheme and format them as output lines.
 
-    :param total_unigram_indices_per_sentence: list containing unigram
-    :param total_multiword_indices_per_sentence: list containing ngram indices
-    :return: all_found_indices (list containing all indices per sentence)
+    :param trie: gazetteer trie (see build_gazetteer_trie)
+    :param sentences: list of sentences (lists of (token, lemma, tag) tuples)
+    :return: annotated sentences (str), "token\tlemma\ttag\tIOB" per line, empty line after each sentence
     """
-    all_found_indices = []
+    lines = []
+    for sentence in sentences:
+        labels = get_iob_labels(trie, [token for token, _, _ in sentence])
+        for (token, lemma, tag), label in zip(sentence, labels):
+            lines.append("{}\t{}\t{}\t{}\n".format(token, lemma, tag, label))
+        lines.append("\n")
 
-    for gaz, all_pos in total_unigram_indices_per_sentence:
-        for pos in all_pos:
-            all_found_indices.append(pos)
+    return "".join(lines)
 
-    for gaz, all_pos in total_multiword_indices_per_sentence:
-        for pos in all_pos:
-            if isinstance(pos, tuple):
-                start_index, end_index = pos
-                all_found_indices.extend(range(start_index, end_index + 1))
-            else:
-                all_found_indices.extend(pos)
 
-    return all_found_indices
+# gazetteer trie of a worker process (see init_worker)
+worker_trie = None
 
 
-def annotate_corpora(gaz_storage, len_storage, file, dir):
+def init_worker(trie):
+    """
+    Make the gazetteer trie available to a worker process. With the fork start method the trie of the
+    parent process is shared copy-on-write, otherwise it is serialized once per worker.
+
+    :param trie: gazetteer trie (see build_gazetteer_trie)
+    """
+    global worker_trie
+    worker_trie = trie
+
+
+def annotate_shard(shard):
+    """
+    Annotate a shard of sentences in a worker process.
+
+    :param shard: list of sentences
+    :return: annotated sentences (str)
+    """
+    return annotate_sentences(worker_trie, shard)
+
+
+def annotate_corpora(trie, file, dir, pool=None, shard_size=1000):
     """
     Annotate input file in iob-scheme using gazetteer lookups.
-    
-    :param gaz_storage: gazetteer dictionary
-    :param len_storage: dictionary containing maximum ngram length per gazetteer
+
+    :param trie: gazetteer trie (see build_gazetteer_trie)
     :param file: file-like object, input corpus
+    :param pool: optional multiprocessing pool (initialized with init_worker) to annotate shards in parallel
+    :param shard_size: number of sentences per shard
     """
 
     with open("{}{}".format(dir, file), 'r') as infile, open("{}{}.iob.txt".format(dir, file[:-4]), 'w',
                                                              encoding='utf-8') as outfile:
-        sentence = []
-        lemmas = []
-        tags = []
-        for line in infile:
-            if line == "\n":
-                sentence_string = " ".join(sentence)
-                total_unigram_indices_per_sentence = []
-                total_multiword_indices_per_sentence = []
-
-                for gazetteer in sorted(gaz_storage, key=lambda k: len(gaz_storage[k])):
-                    if any(plantname in sentence_string for plantname in gaz_storage[gazetteer]):
-                        # use this for English
-                        # if any(plantname.lower() in sentence_string for plantname in gaz_storage[gazetteer]):
-                        if len_storage[gazetteer] == 1:
-                            gaz_name, unigram_indices = get_unigram_indices(gaz_storage, sentence, gazetteer)
-                            if unigram_indices:
-                                total_unigram_indices_per_sentence.append((gaz_name, unigram_indices))
-                        else:
-                            gaz_name, multiword_indices = get_multiword_indices(gaz_storage, sentence,
-                                                                                gazetteer)
-                            if multiword_indices:
-                                total_multiword_indices_per_sentence.append((gaz_name, multiword_indices))
-
-                all_indices_of_sentence = get_sentence_indices(total_unigram_indices_per_sentence,
-                                                               total_multiword_indices_per_sentence)
-
-                block_startend_indices = []
-
-                INSIDE_MEMORY = False
-                for index, (token, lemma, tag) in enumerate(zip(sentence, lemmas, tags)):
-                    FOUND = False
-                    if index in all_indices_of_sentence:
-                        for gaz_name_multi, positions in total_multiword_indices_per_sentence:
-                            for pos in positions:
-                                if isinstance(pos, tuple):
-                                    start_index, end_index = pos
-                                    block_startend_indices.extend(range(start_index, end_index + 1))
-                                    if index == start_index:
-                                        outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag,
-                                                                                'B-{}'.format(gaz_name_multi)))
-                                        FOUND = True
-                                        INSIDE_MEMORY = True
-                                    elif INSIDE_MEMORY and start_index < index < end_index:
-                                        FOUND = True
-                                        outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag,
-                                                                                'I-{}'.format(gaz_name_multi)))
-                                    elif INSIDE_MEMORY and index == (end_index - 1):
-                                        outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag,
-                                                                                'I-{}'.format(gaz_name_multi)))
-                                        INSIDE_MEMORY = False
-                                else:
-                                    for single_pos in pos:
-                                        if single_pos in block_startend_indices:
-                                            continue
-                                        else:
-                                            if index == single_pos:
-                                                block_startend_indices.append(single_pos)
-                                                FOUND = True
-                                                outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag,
-                                                                                        'B-{}'.format(
-                                                                                            gaz_name_multi)))
-
-                        # treat unigram lists (de-fam, lat-fam, -genus, -subfam, -phylum, -class, -order)
-                        for gaz_name_uni, positions_uni in total_unigram_indices_per_sentence:
-                            for single_pos in positions_uni:
-                                if single_pos in block_startend_indices:
-                                    continue
-                                else:
-                                    if index == single_pos:
-                                        FOUND = True
-                                        block_startend_indices.append(single_pos)
-                                        outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag,
-                                                                                'B-{}'.format(gaz_name_uni)))
-
-                    else:
-                        if not FOUND:
-                            outfile.write("{}\t{}\t{}\t{}\n".format(token, lemma, tag, 'O'))
-
-                outfile.write("\n")
-                block_startend_indices.clear()
-
-                sentence.clear()
-                lemmas.clear()
-                tags.clear()
-                total_unigram_indices_per_sentence.clear()
-                total_multiword_indices_per_sentence.clear()
-
-            else:
-                token, lemma, tag = line.rstrip("\n").split("\t")
-                sentence.append(token)
-                lemmas.append(lemma)
-                tags.append(tag)
+        shards = iter_shards(iter_sentences(infile), shard_size)
+        if pool is None:
+            annotated_shards = (annotate_sentences(trie, shard) for shard in shards)
+        else:
+            # imap returns the shards in input order
+            annotated_shards = pool.imap(annotate_shard, shards)
+        for annotated in annotated_shards:
+            outfile.write(annotated)
 
 
 def main():
@@ -294,10 +288,22 @@ def main():
         default="de",
         help='Language code {de|en} for input data')
 
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='number of worker processes for annotation')
+
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        default=1000,
+        help='number of sentences per shard that is annotated by a worker')
+
     args = parser.parse_args()
     dir = args.directory
     gaz_dir_v = args.vernaculargazetteer
-    gaz_dir_l = args.latingazetteer
+    gaz_dir_l = args.scientificgazetteer
     language = args.language
 
     gaz_storage = defaultdict(set)
@@ -326,10 +332,22 @@ def main():
             ngram_gazetteers.append(name)
     print(">> NGRAM GAZETTEERS:\n{} ".format(ngram_gazetteers), file=sys.stderr, flush=True)
 
-    for file in sorted(os.listdir(dir)):
-        if file.endswith(".tok.pos.txt"):
-            print(">> processing file {}".format(file), file=sys.stderr, flush=True)
-            annotate_corpora(gaz_storage, len_storage, file, dir)
+    trie = build_gazetteer_trie(gaz_storage, len_storage)
+
+    pool = None
+    if args.workers > 1:
+        # the trie is built once and shared with the workers
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(trie,))
+
+    try:
+        for file in sorted(os.listdir(dir)):
+            if file.endswith(".tok.pos.txt"):
+                print(">> processing file {}".format(file), file=sys.stderr, flush=True)
+                annotate_corpora(trie, file, dir, pool, args.shard_size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     print(">> [DONE]: IOB-annotation is done for input dir {} ".format(dir), file=sys.stderr, flush=True)
 
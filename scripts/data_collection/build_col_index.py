@@ -0,0 +1,165 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+
+"""
+Build a local Catalogue of Life name index (SQLite) from the Darwin core archive.
+source = http://www.catalogueoflife.org/DCA_Export/index.php
+
+The index contains everything the entity linker retrieves from the CoL webservice (see get_col_data in
+entity_linker.py), so that names can be linked without network access (entity_linker.py --backend local):
+
+taxa:   id  col_id  name  rank  status  accepted_id  bib_ref  url
+names:  name (normalized)  taxon_id  priority  vernacular  language
+
+- scientific names (accepted names and synonyms) from the taxa files,
+  synonyms are resolved to their accepted name with acceptedNameUsageID
+- vernacular names (status "common name") from the vernacular files, resolved to the taxon of taxonID
+
+How to run the code:
+$ python3 build_col_index.py -t ./colarchive/taxa/ -v ./colarchive/vernacular/ -o ./col_index.sqlite
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from os import listdir
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "entity_linking"))
+from col_cache import normalize_name
+
+# columns of the taxa files, used if a file has no header line
+TAXA_COLUMNS = ["taxonID", "identifier", "datasetID", "datasetName", "acceptedNameUsageID", "parentNameUsageID",
+                "taxonomicStatus", "taxonRank", "verbatimTaxonRank", "scientificName", "kingdom", "phylum", "class",
+                "order", "superfamily", "family", "genericName", "genus", "subgenus", "specificEpithet",
+                "infraspecificEpithet", "scientificNameAuthorship", "source", "namePublishedIn", "nameAccordingTo",
+                "modified", "description", "taxonConceptID", "scientificNameID", "references", "isExtinct"]
+VERNACULAR_COLUMNS = ["taxonID", "vernacularName", "language", "countryCode", "locality", "transliteration"]
+
+URL_TEMPLATE = "http://www.catalogueoflife.org/col/details/species/id/{}"
+
+# order of the results of a name query (the webservice lists accepted names first)
+PRIORITY = {"accepted name": 0, "provisionally accepted name": 1, "synonym": 2, "ambiguous synonym": 3,
+            "misapplied name": 4, "common name": 5}
+
+SCHEMA = """
+CREATE TABLE taxa (id TEXT PRIMARY KEY, col_id TEXT, name TEXT, rank TEXT, status TEXT, accepted_id TEXT,
+                   bib_ref TEXT, url TEXT);
+CREATE TABLE names (name TEXT NOT NULL, taxon_id TEXT NOT NULL, priority INTEGER NOT NULL,
+                    vernacular TEXT, language TEXT);
+"""
+
+
+def _iter_rows(path, files, default_columns):
+    """
+    Read the tab-separated rows of Darwin core archive files as dictionaries.
+    :param path: (str) directory of the files
+    :param files: (iterable) file names
+    :param default_columns: column names for files without header line
+    :return: generator of dictionaries (column name -> value)
+    """
+    for file in files:
+        print("#### Processing FILE: {}".format(file), file=sys.stderr, flush=True)
+        with open(os.path.join(path, file), "r", encoding="utf-8") as infile:
+            columns = default_columns
+            for i, line in enumerate(infile):
+                data = line.rstrip("\r\n").split("\t")
+                if i == 0 and data[0].lstrip("\ufeff") == "taxonID":
+                    columns = [column.lstrip("\ufeff") for column in data]
+                    continue
+                yield dict(zip(columns, data))
+
+
+def _iter_taxa(rows):
+    """
+    :param rows: rows of the taxa files
+    :return: generator of taxa table rows
+    """
+    for row in rows:
+        taxon_id = row["taxonID"]
+        col_id = row.get("identifier") or taxon_id
+        bib_ref = row.get("bibliographicCitation") or row.get("datasetName", "")
+        url = row.get("references") or URL_TEMPLATE.format(col_id)
+        yield (taxon_id, col_id, row["scientificName"], row.get("taxonRank", ""), row.get("taxonomicStatus", ""),
+               row.get("acceptedNameUsageID") or None, bib_ref, url)
+
+
+def build_index(connection, taxa_rows, vernacular_rows):
+    """
+    Store taxa and names in an empty index database.
+    :param connection: sqlite3 connection
+    :param taxa_rows: rows of the taxa files
+    :param vernacular_rows: rows of the vernacular files
+    :return: number of taxa, number of names
+    """
+    connection.executescript(SCHEMA)
+    connection.executemany("INSERT OR REPLACE INTO taxa VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _iter_taxa(taxa_rows))
+    connection.execute("INSERT INTO names (name, taxon_id, priority) "
+                       "SELECT name, id, CASE status {} ELSE {} END FROM taxa".format(
+                        " ".join("WHEN '{}' THEN {}".format(status, priority)
+                                 for status, priority in PRIORITY.items()), len(PRIORITY)))
+    connection.executemany("INSERT INTO names VALUES (?, ?, ?, ?, ?)",
+                           ((row["vernacularName"], row["taxonID"], PRIORITY["common name"], row["vernacularName"],
+                             row.get("language", "")) for row in vernacular_rows if row.get("vernacularName")))
+
+    # names are looked up in normalized form (see col_cache.normalize_name)
+    connection.create_function("normalize_name", 1, normalize_name)
+    connection.execute("UPDATE names SET name = normalize_name(name)")
+    connection.execute("CREATE INDEX names_name ON names (name, priority)")
+    connection.commit()
+
+    no_taxa = connection.execute("SELECT COUNT(*) FROM taxa").fetchone()[0]
+    no_names = connection.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+    return no_taxa, no_names
+
+
+def main():
+    PATH_TAXA = "./../catalogueofLife_plantae_de-en-lat/taxa/"
+    PATH_VERN = "./../catalogueofLife_plantae_de-en-lat/vernacular/"
+
+    parser = argparse.ArgumentParser(
+        description='Build a local name index (SQLite) from Cat. of Life darwin core archive.')
+
+    parser.add_argument(
+        '-t', '--taxa_dir',
+        type=str,
+        default=PATH_TAXA,
+        help='input directory with tabular taxa files')
+
+    parser.add_argument(
+        '-v', '--vern_dir',
+        type=str,
+        default=PATH_VERN,
+        help='input directory with tabular vernacular name files')
+
+    parser.add_argument(
+        '-o', '--index',
+        type=str,
+        default="./col_index.sqlite",
+        help='SQLite file for the name index (overwritten)')
+
+    args = parser.parse_args()
+    PATH_TAXA = args.taxa_dir
+    PATH_VERN = args.vern_dir
+
+    files_taxa = sorted(f for f in listdir(PATH_TAXA) if f.endswith(".txt"))
+    files_vern = sorted(f for f in listdir(PATH_VERN) if f.endswith(".txt"))
+
+    if os.path.exists(args.index):
+        os.remove(args.index)
+    connection = sqlite3.connect(args.index)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    no_taxa, no_names = build_index(connection,
+                                    _iter_rows(PATH_TAXA, files_taxa, TAXA_COLUMNS),
+                                    _iter_rows(PATH_VERN, files_vern, VERNACULAR_COLUMNS))
+    connection.close()
+
+    print(">> stored {} taxa and {} names in {}".format(no_taxa, no_names, args.index), file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Persistent cache for Catalogue of Life API responses (SQLite).
+
+The JSON response of a name query is stored under the normalized query name, for found names as well as
+for names without results, so that linking the same corpora again (entity_linker.py) or the same plant
+names in the web application (web_application.py) does not query the webservice again.
+
+- ttl: entries older than ttl seconds are queried again
+- max_size: maximum number of entries, the least recently used entries are evicted
+- offline: only read from the cache, names that are not cached are treated as names without results
+
+Usage:
+    cache = ColCache("./col_cache.sqlite", ttl=30 * 24 * 3600, max_size=100000)
+    data = cache.get("Bellis perennis")
+    if data is None:
+        data = requests.get(BASE_URL, params=atts).json()
+        cache.put("Bellis perennis", data)
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+def normalize_name(name):
+    """
+    Normalize a query name for the cache lookup (case and whitespace are ignored).
+    :param name: (str) query name
+    :return: normalized name (str)
+    """
+    return " ".join(name.split()).lower()
+
+
+def empty_response(name):
+    """
+    API response for a name without results.
+    :param name: (str) query name
+    :return: dictionary structure as returned from API
+    """
+    return {"name": name, "total_number_of_results": 0, "results": []}
+
+
+class ColCache:
+    """
+    Catalogue of Life API responses stored in an SQLite database, shared by all threads of a process.
+    """
+
+    def __init__(self, path, ttl=None, max_size=None, offline=False):
+        """
+        :param path: (str) path to the SQLite database, created if it does not exist
+        :param ttl: (float) time to live of an entry in seconds, None for no expiry
+        :param max_size: (int) maximum number of entries, None for no limit
+        :param offline: (bool) if true, the webservice is never queried
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                     "name TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                                     "created REAL NOT NULL, last_used REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, name):
+        """
+        Look up the cached API response of a query name.
+        Expired entries are only returned in offline mode.
+        :param name: (str) query name
+        :return: dictionary structure returned from API, None if the name is not cached
+        """
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE name = ?",
+                                           (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl is not None and now - created > self.ttl and not self.offline:
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_used = ? WHERE name = ?", (now, key))
+        data = json.loads(response)
+        # the cached response may belong to a differently cased or spaced query
+        data["name"] = name
+        return data
+
+    def put(self, name, data):
+        """
+        Store the API response of a query name (also responses without results).
+        :param name: (str) query name
+        :param data: dictionary structure returned from API
+        """
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses (name, response, created, last_used) "
+                                     "VALUES (?, ?, ?, ?)", (key, json.dumps(data), now, now))
+            if self.max_size is not None:
+                # evict the least recently used entries
+                self._connection.execute("DELETE FROM responses WHERE name IN (SELECT name FROM responses "
+                                         "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,143 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Concurrent client for the Catalogue of Life webservice.
+
+- keep-alive connections of one requests.Session (connection pool per host)
+- retries with exponential backoff for connection errors and 429/5xx responses
+- per-host rate limit (requests per second), also for the retries of 429/5xx responses
+- at most `concurrency` requests at the same time
+
+Usage:
+    client = ColClient(concurrency=8, rate=20)
+    data = client.get(BASE_URL, {'format': 'json', 'name': 'Bellis perennis'})
+    results = client.map(link_name, names)  # same order as names
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Minimum interval between the starts of two requests to the same host, shared by all threads.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: (float) maximum number of requests per second and host, None for no limit
+        """
+        self.interval = 1. / rate if rate else 0.
+        self._next_start = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """
+        Block until a request to host may be started.
+        :param host: (str) host name (and port)
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def get_backoff(backoff, retry, resp=None):
+    """
+    :param backoff: (float) backoff factor
+    :param retry: (int) number of the retry (from 1)
+    :param resp: response to retry, its Retry-After header (in seconds) is respected
+    :return: (float) seconds to wait before the retry, backoff * 2 ** (retry - 1) by default
+    """
+    delay = backoff * 2 ** (retry - 1)
+    retry_after = resp.headers.get("Retry-After", "") if resp is not None else ""
+    if retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+def create_session(pool_size, retries, backoff):
+    """
+    Create a session with keep-alive connection pooling and retries of connection errors
+    (429/5xx responses are retried by ColClient.get, which respects the rate limit).
+    :param pool_size: (int) number of connections kept per host
+    :param retries: (int) number of retries of a failed connection
+    :param backoff: (float) backoff factor, retries wait backoff * 2 ** (retry - 1) seconds
+    :return: requests.Session
+    """
+    retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=backoff)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ColClient:
+    """
+    Webservice client that can be shared by several threads (e.g. all requests of the web application).
+    """
+
+    def __init__(self, concurrency=8, rate=None, retries=3, backoff=0.5, timeout=30):
+        """
+        :param concurrency: (int) maximum number of requests at the same time
+        :param rate: (float) maximum number of requests per second and host, None for no limit
+        :param retries: (int) number of retries of a failed request
+        :param backoff: (float) backoff factor between retries in seconds
+        :param timeout: (float) timeout of a request in seconds
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = create_session(concurrency, retries, backoff)
+        self.rate_limiter = RateLimiter(rate)
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def get(self, url, params):
+        """
+        Query the webservice. 429/5xx responses are retried with exponential backoff, every attempt waits
+        for the rate limit of the host.
+        :param url: (str) query URL
+        :param params: dictionary (for query attributes)
+        :return: dictionary structure returned from API
+        """
+        host = urlsplit(url).netloc
+        with self._slots:
+            for retry in range(self.retries + 1):
+                if retry:
+                    time.sleep(get_backoff(self.backoff, retry, resp))
+                self.rate_limiter.wait(host)
+                resp = self.session.get(url, params=params, timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    break
+            resp.raise_for_status()
+            return resp.json()
+
+    def map(self, function, iterable):
+        """
+        Apply function (which queries the webservice with this client) to all items in parallel threads.
+        :param function: function of one item
+        :param iterable: items
+        :return: list of results, in the order of the items
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(function, iterable))
+
+    def close(self):
+        self.session.close()
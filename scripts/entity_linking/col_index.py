@@ -0,0 +1,98 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Local Catalogue of Life name index (built with data_collection/build_col_index.py).
+
+ColIndex answers name queries with the same dictionary structure as the CoL webservice, so that it can be
+used in place of a ColClient (entity_linker.py --backend local):
+- accepted names:  results[0] with id, name, rank, name_status, url
+- synonyms:        results[0] with the synonym and its accepted_name (id, name, rank, url, bibliographic_citation)
+- common names:    results[0] with name_status 'common name' and the accepted_name of the taxon
+
+Usage:
+    index = ColIndex("./col_index.sqlite")
+    data = index.get(BASE_URL, {'format': 'json', 'name': 'Bellis perennis'})
+"""
+
+import sqlite3
+import threading
+
+from col_cache import normalize_name
+
+# number of results returned per query (as the webservice)
+MAX_RESULTS = 10
+
+QUERY = """
+SELECT n.vernacular, t.col_id, t.name, t.rank, t.status, t.url, t.bib_ref, a.col_id, a.name, a.rank, a.url, a.bib_ref
+FROM names n JOIN taxa t ON t.id = n.taxon_id LEFT JOIN taxa a ON a.id = t.accepted_id
+WHERE n.name = ? ORDER BY n.priority LIMIT ?
+"""
+
+
+def _get_result(row):
+    """
+    Convert a row of the name query to a result of the webservice.
+    :param row: tuple (see QUERY)
+    :return: dictionary structure of one result
+    """
+    vernacular, col_id, name, rank, status, url, bib_ref, acc_id, acc_name, acc_rank, acc_url, acc_bib_ref = row
+    if acc_id is None:
+        acc_id, acc_name, acc_rank, acc_url, acc_bib_ref = col_id, name, rank, url, bib_ref
+    accepted_name = {"id": acc_id, "name": acc_name, "rank": acc_rank, "url": acc_url,
+                     "bibliographic_citation": acc_bib_ref}
+
+    if vernacular is not None:
+        return {"name": vernacular, "name_status": "common name", "accepted_name": accepted_name}
+    result = {"id": col_id, "name": name, "rank": rank, "name_status": status, "url": url}
+    if acc_id != col_id:
+        result["accepted_name"] = accepted_name
+    return result
+
+
+class ColIndex:
+    """
+    Read-only name index in an SQLite database, shared by all threads of a process.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (str) path to the SQLite database (see build_col_index.py)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, check_same_thread=False)
+
+    def lookup(self, name):
+        """
+        Look up a name (case and whitespace are ignored).
+        :param name: (str) query name
+        :return: dictionary structure as returned from API
+        """
+        with self._lock:
+            rows = self._connection.execute(QUERY, (normalize_name(name), MAX_RESULTS)).fetchall()
+        return {"name": name, "total_number_of_results": len(rows), "results": [_get_result(row) for row in rows]}
+
+    def get(self, url, params):
+        """
+        Same as ColClient.get, the url is ignored.
+        :param url: (str) query URL
+        :param params: dictionary (for query attributes)
+        :return: dictionary structure as returned from API
+        """
+        return self.lookup(params['name'])
+
+    def map(self, function, iterable):
+        """
+        Same as ColClient.map, the items are processed one after another (the lookups do not wait for a network).
+        :param function: function of one item
+        :param iterable: items
+        :return: list of results, in the order of the items
+        """
+        return [function(item) for item in iterable]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -16,10 +16,22 @@ Input:
   example sentence from output.txt:
   Most__O Angelonia__B-lat_genus species__O can__O be__O found__O in__O Northeastern__O Brazil__O .__O
 - alternatively: IOB-annotated files in CoNLL-2003 format
+- alternatively: json output of tagger.py (--outputFormat json), entities with a confidence below
+  --min_confidence are not linked:
+  $ python3 entity_linker.py -i ./output.json -o ./json_file.json -f json --min_confidence 0.5
 
 # How to run the code:
 $ python3 entity_linker.py -i ./../../resources/corpora/training_corpora/de/botlit_corpus_de.tok.pos.iob.txt
   -o ./json_file.json -f IOB -r ./../../resources/gazetteers/lookup_table/de_lat_lookup.tsv -l True
+
+Entity candidates are linked with up to --workers concurrent API requests (see col_client.py).
+API responses are cached in ./col_cache.sqlite (see col_cache.py). Link without network access:
+$ python3 entity_linker.py -i ./../../resources/corpora/training_corpora/de/botlit_corpus_de.tok.pos.iob.txt
+  -o ./json_file.json --offline
+
+Link with a local name index built from the CoL darwin core archive (see build_col_index.py):
+$ python3 entity_linker.py -i ./../../resources/corpora/training_corpora/de/botlit_corpus_de.tok.pos.iob.txt
+  -o ./json_file.json --backend local --index ./col_index.sqlite
 """
 import argparse
 import json
@@ -27,6 +39,11 @@ import requests
 import sys
 import time
 from collections import defaultdict
+from col_cache import ColCache, empty_response
+from col_client import ColClient
+from col_index import ColIndex
+
+BASE_URL = "http://webservice.catalogueoflife.org/col/webservice?"
 
 
 def get_bibref_information(data):
@@ -117,6 +134,32 @@ def read_tagged_file_chunks(file):
     return list_tagged
 
 
+def read_tagged_file_json(file, min_confidence=0.):
+    """
+    Read in the json output of tagger.py (one sentence per line) and store (token, iob) tuples in list structure.
+
+    :param file: file-like obj (json lines with text, ranges and confidences)
+    :param min_confidence: entities with a lower confidence are tagged O (no lookups for spurious spans)
+    :return: list_tagged containing token, iob-tag pairs
+    """
+    list_tagged = []
+    for line in file:
+        if not line.strip():
+            continue
+        sentence = json.loads(line)
+        tokens = sentence["text"].split(" ")
+        tags = ["O"] * len(tokens)
+        for (begin, end, entity_type), confidence in zip(sentence["ranges"], sentence["confidences"]):
+            if confidence >= min_confidence:
+                tags[begin] = "B-" + entity_type
+                for i in range(begin + 1, end + 1):
+                    tags[i] = "I-" + entity_type
+        list_tagged.extend(zip(tokens, tags))
+        list_tagged.append(("EOS", "EOS"))
+
+    return list_tagged
+
+
 def _store_empty():
     """
     Store empty strings for un-linkable entity candidate
@@ -125,7 +168,34 @@ def _store_empty():
     return "", "", "", "", "", ""
 
 
-def send_api_request(BASE_URL, atts, no_linked_entities, lookup_table, use_lookup):
+def query_col(BASE_URL, atts, cache=None, client=None):
+    """
+    Query API (Catalogue of Life) for the name in atts, unless its response is cached.
+
+    :param BASE_URL: string (query URL)
+    :param atts: dictionary (for query attributes)
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling)
+    :return: data: dictionary structure returned from API
+    """
+    if cache is not None:
+        data = cache.get(atts['name'])
+        if data is not None:
+            return data
+        if cache.offline:
+            return empty_response(atts['name'])
+
+    if client is not None:
+        data = client.get(BASE_URL, atts)
+    else:
+        resp = requests.get(BASE_URL, params=atts)
+        data = resp.json()
+    if cache is not None:
+        cache.put(atts['name'], data)
+    return data
+
+
+def send_api_request(BASE_URL, atts, no_linked_entities, lookup_table, use_lookup, cache=None, client=None):
     """
     Query API (Catalogue of Life) and store relevant information.
     Unless specified otherwise, name lookups are used for higher entity linking coverage.
@@ -135,10 +205,11 @@ def send_api_request(BASE_URL, atts, no_linked_entities, lookup_table, use_looku
     :param no_linked_entities: total number of linked entities
     :param lookup_table: dictionary containing vernacular -> scientific name mappings
     :param use_lookup: boolean, if true vernacular -> scientific name lookups are performed
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling)
     :return: input_name, id, rank, scient_name, status, bib_ref, url, no_linked_entities
     """
-    resp = requests.get(BASE_URL, params=atts)
-    data = resp.json()
+    data = query_col(BASE_URL, atts, cache, client)
 
     if data["total_number_of_results"] == 0:
         input_name = data["name"]
@@ -147,8 +218,7 @@ def send_api_request(BASE_URL, atts, no_linked_entities, lookup_table, use_looku
             if lookup_table.get(input_name.lower()):
                 lookup_query_name = lookup_table[input_name.lower()][0]
                 atts['name'] = lookup_query_name
-                resp = requests.get(BASE_URL, params=atts)
-                data = resp.json()
+                data = query_col(BASE_URL, atts, cache, client)
 
                 if data["total_number_of_results"] == 0:
                     input_name = data["name"]
@@ -270,22 +340,36 @@ def store_reference_db(reference_db):
     return lookup_table
 
 
-def create_json(index_dict, atts, name_occurrence_dict, lookup_table, use_lookup):
+def create_json(index_dict, atts, name_occurrence_dict, lookup_table, use_lookup, cache=None, client=None,
+                base_url=BASE_URL):
     """
     Create json-object from botanical and positional information about all entity candidates.
     :param index_dict: dictionary containing positional information for each entity candidate
     :param atts: query attributes
     :param name_occurrence_dict: dictionary
     :param lookup_table: dictionary containing vernacular -> scientific name mappings
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling),
+                   with a client the entity candidates are linked in parallel threads
+    :param base_url: string (query URL)
     :return: json_data (dict), no_linked_entities (int)
     """
-    BASE_URL = "http://webservice.catalogueoflife.org/col/webservice?"
     json_data = {}
     json_data['plant_names'] = []
     no_linked_entities = 0
 
-    for query_name, indices in index_dict.items():
-        atts['name'] = query_name
+    query_names = list(index_dict)
+
+    def link(query_name):
+        return send_api_request(base_url, dict(atts, name=query_name), 0, lookup_table, use_lookup, cache, client)
+
+    if client is not None:
+        api_results = client.map(link, query_names)
+    else:
+        api_results = [link(query_name) for query_name in query_names]
+
+    for query_name, api_result in zip(query_names, api_results):
+        indices = index_dict[query_name]
         inds = {}
         inds["sentence_ID"] = []
         for sent_index, span_index in indices.items():
@@ -298,11 +382,8 @@ def create_json(index_dict, atts, name_occurrence_dict, lookup_table, use_lookup
                 "sent_ID_{}".format(sent_index): span_index
             })
 
-        input_name, id, rank, scient_name, status, bib_ref, url, no_linked_entities = send_api_request(BASE_URL,
-                                                                                                       atts,
-                                                                                                       no_linked_entities,
-                                                                                                       lookup_table,
-                                                                                                       use_lookup)
+        input_name, id, rank, scient_name, status, bib_ref, url, linked = api_result
+        no_linked_entities += linked
         json_data['plant_names'].append({
             'entity_candidate': name_occurrence_dict[query_name],
             'api_query_name': query_name,
@@ -321,6 +402,8 @@ def create_json(index_dict, atts, name_occurrence_dict, lookup_table, use_lookup
 def main():
     tagged_file_default = "./../../resources/corpora/training_corpora/de/botlit_corpus_de.tok.pos.iob.txt"
     PATH_REFDB = "./../../resources/gazetteers/lookup_table/de_lat_lookup.tsv"
+    PATH_CACHE = "./col_cache.sqlite"
+    PATH_INDEX = "./col_index.sqlite"
 
     json_output_default = "./linked_output.json"
     parser = argparse.ArgumentParser(
@@ -342,7 +425,13 @@ def main():
         '-f', '--format',
         type=str,
         default="IOB",
-        help='file format {IOB|chunks}')
+        help='file format {IOB|chunks|json}')
+
+    parser.add_argument(
+        '--min_confidence',
+        type=float,
+        default=0.,
+        help='json format: do not link entities with a lower confidence (0 to 1)')
 
     parser.add_argument(
         '-r', '--reference_db',
@@ -356,6 +445,65 @@ def main():
         default=True,
         help='use vernacular-scientific name lookups {True|False}')
 
+    parser.add_argument(
+        '-c', '--cache',
+        type=str,
+        default=PATH_CACHE,
+        help='SQLite cache for API responses (empty string: no caching)')
+
+    parser.add_argument(
+        '--cache_ttl',
+        type=float,
+        default=30,
+        help='days after which cached API responses are queried again')
+
+    parser.add_argument(
+        '--cache_size',
+        type=int,
+        default=100000,
+        help='maximum number of cached API responses (least recently used are evicted)')
+
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='only use cached API responses, do not query the webservice')
+
+    parser.add_argument(
+        '-b', '--backend',
+        type=str,
+        default="api",
+        help='name resolution {api|local}: CoL webservice or local name index (see build_col_index.py)')
+
+    parser.add_argument(
+        '--index',
+        type=str,
+        default=PATH_INDEX,
+        help='SQLite name index for the local backend')
+
+    parser.add_argument(
+        '--base_url',
+        type=str,
+        default=BASE_URL,
+        help='query URL of the Catalogue of Life webservice')
+
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=8,
+        help='maximum number of concurrent API requests')
+
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=None,
+        help='maximum number of API requests per second')
+
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=3,
+        help='number of retries (with exponential backoff) of a failed API request')
+
     args = parser.parse_args()
     tagged_file = args.input_file
     json_output = args.json_output
@@ -363,6 +511,20 @@ def main():
     ref_db = args.reference_db
     use_lookup = args.use_lookup
 
+    cache = None
+    if args.backend == "local":
+        # the local index does not need a cache
+        client = ColIndex(args.index)
+    elif args.backend == "api":
+        if args.cache:
+            cache = ColCache(args.cache, ttl=args.cache_ttl * 24 * 3600, max_size=args.cache_size,
+                             offline=args.offline)
+        elif args.offline:
+            raise ValueError("Offline linking needs a cache (--cache).")
+        client = ColClient(concurrency=args.workers, rate=args.rate, retries=args.retries)
+    else:
+        raise NotImplementedError("Please provide a valid backend {api, local}.")
+
     with open(ref_db, 'r') as reference_db:
         lookup_table = store_reference_db(reference_db)
 
@@ -371,13 +533,16 @@ def main():
             list_tagged = read_tagged_file_iob(tagged)
         elif file_format == "chunks":
             list_tagged = read_tagged_file_chunks(tagged)
+        elif file_format == "json":
+            list_tagged = read_tagged_file_json(tagged, args.min_confidence)
         else:
-            raise NotImplementedError("Please provide a valid input format {IOB, chunks}:"
+            raise NotImplementedError("Please provide a valid input format {IOB, chunks, json}:"
                                       " \ndaisy\tB-en_species\ndaisy__B-en_species")
 
     time1 = time.time()
     no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict = process_file(list_tagged)
-    json_data, no_linked_entities = create_json(index_dict, query_atts, name_occurrence_dict, lookup_table, use_lookup)
+    json_data, no_linked_entities = create_json(index_dict, query_atts, name_occurrence_dict, lookup_table, use_lookup,
+                                                cache, client, args.base_url)
     time2 = time.time()
     elapsed = time2 - time1
 
@@ -0,0 +1,110 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Tests of col_client.py against a local stub of the Catalogue of Life webservice (no network access).
+
+# How to run the code:
+$ python3 -m unittest test_col_client
+"""
+
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from col_client import ColClient
+from entity_linker import create_json
+
+NAMES = ["Bellis perennis", "Angelonia", "Quercus robur", "Taraxacum", "Abies alba", "Fagus sylvatica"]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers a name query with one accepted name. The first names are answered last, so that concurrent
+    requests finish in another order than they were sent. The names of server.failing get a 429 response
+    to their first server.failures requests.
+    """
+
+    def do_GET(self):
+        server = self.server
+        name = parse_qs(urlsplit(self.path).query)["name"][0]
+        with server.lock:
+            server.requests.append((time.monotonic(), name))
+            attempt = sum(1 for _, requested in server.requests if requested == name)
+        if name in server.failing and attempt <= server.failures:
+            self.send_response(429)
+            self.end_headers()
+            return
+        time.sleep(0.01 * (len(NAMES) - NAMES.index(name)))
+        body = json.dumps({
+            "name": name,
+            "total_number_of_results": 1,
+            "results": [{"id": str(NAMES.index(name)), "name": name, "rank": "Species",
+                         "name_status": "accepted name", "url": "http://localhost/" + name}]
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ColClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failing = set()
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/col/webservice?".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def link(self, client):
+        index_dict = dict((name, {i: [i]}) for i, name in enumerate(NAMES))
+        name_occurrence_dict = dict((name, name) for name in NAMES)
+        return create_json(index_dict, {'format': 'json', 'response': 'full'}, name_occurrence_dict, {}, False,
+                           client=client, base_url=self.url)
+
+    def test_json_order(self):
+        sequential = self.link(None)
+        client = ColClient(concurrency=4)
+        try:
+            concurrent = self.link(client)
+        finally:
+            client.close()
+        self.assertEqual(json.dumps(sequential), json.dumps(concurrent))
+        self.assertEqual([entry['api_query_name'] for entry in concurrent[0]['plant_names']], NAMES)
+        self.assertEqual(concurrent[1], len(NAMES))
+
+    def test_retries_respect_rate(self):
+        rate = 20.
+        self.server.failing = set(NAMES[:2])
+        self.server.failures = 2
+        client = ColClient(concurrency=4, rate=rate, retries=3, backoff=0.)
+        try:
+            json_data, no_linked_entities = self.link(client)
+        finally:
+            client.close()
+        self.assertEqual(no_linked_entities, len(NAMES))
+        self.assertEqual(len(self.server.requests), len(NAMES) + 2 * 2)
+        starts = sorted(start for start, _ in self.server.requests)
+        intervals = [b - a for a, b in zip(starts, starts[1:])]
+        # the server receives the requests a few milliseconds after the client starts them
+        self.assertGreater(min(intervals), 1. / rate - 0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,10 +15,8 @@ $ python3 tokenize_corpus.py -d ./../raw_data/ -l de
 
 import argparse
 import os
-import spacy
 import sys
-from nltk import word_tokenize
-from nltk.tokenize import sent_tokenize
+from tokenizer_registry import TokenizerRegistry
 
 def fix_tokenization(tokens, bot_abbreviations):
     """
@@ -44,12 +42,13 @@ def fix_tokenization(tokens, bot_abbreviations):
     return fixed_tokens
 
 
-def tokenize_input(inputText, language, nlp):
+def tokenize_input(inputText, language, tokenizers):
     """
     Tokenize input using a language-specific tokenizer (spaCy for English, NLTK for German)
 
     :param inputText: (str) input line containing one or more sentences
     :param language: (str) iso-language code ('de' or 'en')
+    :param tokenizers: TokenizerRegistry holding the loaded tokenizers
     :return: fixed_tokens: (list) of tokens per sentence
     """
 
@@ -58,12 +57,9 @@ def tokenize_input(inputText, language, nlp):
                          "nm.", "nom.", "ambig.", "cons.", "dub.", "superfl.", "inval.", "nov.",
                          "nud.", "rej.", "nec.", "nothosubsp.", "p.", "hyb.", "syn.", "synon."]
 
-    if language == 'de':
-        sent_tokenize_list = sent_tokenize(inputText, 'german')
-    elif language == 'en':
-        sent_tokenize_list = sent_tokenize(inputText)
-    else:
+    if language not in ['de', 'en']:
         raise NotImplementedError("Please make sure to chose one of the following languages (de, en).")
+    sent_tokenize_list = tokenizers.sent_tokenize(inputText, language)
 
     # fix erroneous sentence segmentation
     fixed_sentences = []
@@ -75,12 +71,8 @@ def tokenize_input(inputText, language, nlp):
             fixed_sentences.append(sent)
 
     for sent in fixed_sentences:
-        if language == 'de':
-            tokens = word_tokenize(sent, 'german')
-            fixed_tokens = fix_tokenization(tokens, bot_abbreviations)
-        elif language == 'en':
-            tokens = list(nlp(sent))
-            fixed_tokens = fix_tokenization(tokens, bot_abbreviations)
+        tokens = tokenizers.word_tokenize(sent, language)
+        fixed_tokens = fix_tokenization(tokens, bot_abbreviations)
 
     return fixed_tokens
 
@@ -107,7 +99,7 @@ def main():
     language = args.language
 
     assert language in ["de", "en"]
-    nlp = spacy.load("en")
+    tokenizers = TokenizerRegistry()
 
     for file in sorted(os.listdir(input_dir)):
         if file.endswith(".txt") and ".tok." not in file:
@@ -118,7 +110,7 @@ def main():
                     if not line or line.startswith("#"):
                         continue
                     line = line.rstrip("\n")
-                    tokens = tokenize_input(line, language, nlp)
+                    tokens = tokenize_input(line, language, tokenizers)
                     for token in tokens:
                         outfile.write(token + "\n")
                     outfile.write("\n")
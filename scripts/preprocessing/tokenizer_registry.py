@@ -0,0 +1,131 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Registry of language-specific tokenizers (spaCy for English, NLTK for German).
+
+The resources of a language are loaded on first use and then kept for the lifetime of the process,
+so that tokenizing many lines (tokenize_corpus.py) or many requests (web_application.py) does not
+reload the spaCy pipeline or the NLTK punkt models every time.
+
+Usage:
+    tokenizers = TokenizerRegistry()
+    for sent in tokenizers.sent_tokenize(text, 'en'):
+        tokens = tokenizers.word_tokenize(sent, 'en')
+"""
+
+import sys
+import threading
+
+# iso language code -> NLTK punkt model
+PUNKT_LANGUAGES = {"de": "german", "en": "english"}
+
+# spaCy components that are not needed for tokenization
+SPACY_DISABLED = ["tagger", "parser", "ner"]
+
+
+def _load_punkt(punkt_language):
+    """
+    Load the NLTK punkt sentence tokenizer of a language.
+    :param punkt_language: (str) NLTK language name, e.g. 'german'
+    :return: sentence tokenizer object with a tokenize(text) method
+    """
+    try:
+        from nltk.tokenize import PunktTokenizer  # NLTK >= 3.8.2
+        return PunktTokenizer(punkt_language)
+    except ImportError:
+        import nltk.data
+        return nltk.data.load("tokenizers/punkt/{}.pickle".format(punkt_language))
+
+
+def _load_treebank():
+    """
+    Load the word tokenizer that nltk.word_tokenize applies to each sentence.
+    :return: word tokenizer object with a tokenize(sentence) method
+    """
+    try:
+        from nltk.tokenize import NLTKWordTokenizer
+        return NLTKWordTokenizer()
+    except ImportError:
+        from nltk.tokenize import TreebankWordTokenizer
+        return TreebankWordTokenizer()
+
+
+class TokenizerRegistry:
+    """
+    Lazily initialized tokenization resources, shared by all callers of a process.
+    """
+
+    def __init__(self, spacy_models=None):
+        """
+        :param spacy_models: (dict) iso language code -> spaCy model name for word tokenization,
+                             by default spaCy is used for English only
+        """
+        self.spacy_models = spacy_models if spacy_models is not None else {"en": "en"}
+        self._punkt = {}
+        self._spacy = {}
+        self._treebank = None
+        self._lock = threading.Lock()
+
+    def _check_language(self, language):
+        if language not in PUNKT_LANGUAGES:
+            raise NotImplementedError("Please choose one of the following languages (de, en).")
+
+    def get_punkt(self, language):
+        """
+        :param language: (str) iso-language code ('de' or 'en')
+        :return: NLTK punkt sentence tokenizer, loaded on first use
+        """
+        self._check_language(language)
+        with self._lock:
+            if language not in self._punkt:
+                print(">> loading NLTK punkt model for '{}'".format(language), file=sys.stderr, flush=True)
+                self._punkt[language] = _load_punkt(PUNKT_LANGUAGES[language])
+            return self._punkt[language]
+
+    def get_treebank(self):
+        """
+        :return: NLTK word tokenizer, loaded on first use
+        """
+        with self._lock:
+            if self._treebank is None:
+                self._treebank = _load_treebank()
+            return self._treebank
+
+    def get_spacy(self, language):
+        """
+        :param language: (str) iso-language code
+        :return: spaCy pipeline without parser and NER, loaded on first use
+        """
+        with self._lock:
+            if language not in self._spacy:
+                import spacy
+                model = self.spacy_models[language]
+                print(">> loading spaCy model '{}'".format(model), file=sys.stderr, flush=True)
+                self._spacy[language] = spacy.load(model, disable=SPACY_DISABLED)
+            return self._spacy[language]
+
+    def sent_tokenize(self, text, language):
+        """
+        Split a text into sentences (same as nltk.sent_tokenize).
+        :param text: (str) input text
+        :param language: (str) iso-language code ('de' or 'en')
+        :return: list of sentences
+        """
+        return self.get_punkt(language).tokenize(text)
+
+    def word_tokenize(self, sentence, language):
+        """
+        Split a sentence into tokens: spaCy if a model is configured for the language,
+        otherwise the same as nltk.word_tokenize.
+        :param sentence: (str) input sentence
+        :param language: (str) iso-language code ('de' or 'en')
+        :return: list of tokens (str)
+        """
+        self._check_language(language)
+        if language in self.spacy_models:
+            return [str(token) for token in self.get_spacy(language)(sentence)]
+        treebank = self.get_treebank()
+        return [token for sent in self.sent_tokenize(sentence, language) for token in treebank.tokenize(sent)]
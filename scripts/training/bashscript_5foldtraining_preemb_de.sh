@@ -16,7 +16,7 @@ for f in "${folds[@]}"
     echo "FOLD ${f}"
 
     # use theano flags to run on specific gpu
-    time THEANO_FLAGS='device=cuda7,dnn.conv.algo_bwd_filter=deterministic,dnn.conv.algo_bwd_data=deterministic,dnn.include_path=/usr/include,dnn.library_path=/usr/lib/x86_64-linux-gnu,force_device=True' python2.7 train-no-dev.py --train ./../data/crossvalidation_folds/alldata/alldata.train.fold${f}.txt --test ./../data/crossvalidation_folds/alldata/alldata.test.fold${f}.txt --tag_scheme iob --zeros 1 --fold ${f} --data "alldata" --pre_emb ./../pretrained_emb_de/fasttext_germ --word_dim 300
+    time THEANO_FLAGS='device=cuda7,dnn.conv.algo_bwd_filter=deterministic,dnn.conv.algo_bwd_data=deterministic,dnn.include_path=/usr/include,dnn.library_path=/usr/lib/x86_64-linux-gnu,force_device=True' python2.7 train-no-dev.py --train ./../data/crossvalidation_folds/alldata/alldata.train.fold${f}.txt --test ./../data/crossvalidation_folds/alldata/alldata.test.fold${f}.txt --tag_scheme iob --zeros 1 --fold ${f} --data "alldata" --save_eval 1 --pre_emb ./../pretrained_emb_de/fasttext_germ --word_dim 300
   done
 
 echo "ENDING CROSSVALIDATION LSTM-CRF TRAINING"
@@ -0,0 +1,258 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Run the k-fold crossvalidation training of a hyperparameter grid in parallel.
+
+One train-no-dev.py process is started per (configuration, fold), on the folds written by
+kfold_crossvalidation.py. The processes run on N CPU workers: every worker is pinned to its own CPUs
+and the OpenMP / BLAS libraries use as many threads as the worker has CPUs.
+
+Every process runs in the output directory, so that the evaluation files of the folds of a configuration
+are written to OUTDIR/evaluation/temp/model_.../ (layout read by final_eval_kfold.py, see --save_eval of
+train-no-dev.py) and the models to OUTDIR/models/. The output of every process is written to OUTDIR/logs/.
+
+# How to run the code:
+$ python3 kfold_training.py -f ./../data/crossvalidation_folds/alldata/ -o ./kfold_alldata/ \
+    -g '{"dropout": [0.3, 0.5], "char_dim": [25, 50]}' -w 4 -t 2 \
+    --options "--tag_scheme iob --zeros 1 --pre_emb ./../pretrained_emb_de/fasttext_germ --word_dim 300"
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train-no-dev.py")
+FOLD_PATTERN = re.compile(r"^(.*)\.train\.fold(\d+)\.txt$")
+# environment variables of the thread pools of OpenMP and the BLAS libraries
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+
+def find_folds(folds_dir):
+    """
+    Find the train / test files of the folds written by kfold_crossvalidation.py.
+    :param folds_dir: (str) directory with the NAME.train.foldN.txt and NAME.test.foldN.txt files
+    :return: data name (NAME), dictionary of fold number -> (train file, test file)
+    """
+    folds = {}
+    names = set()
+    for file in sorted(os.listdir(folds_dir)):
+        match = FOLD_PATTERN.match(file)
+        if match:
+            name, fold = match.group(1), int(match.group(2))
+            test_file = os.path.join(folds_dir, "{}.test.fold{}.txt".format(name, fold))
+            if not os.path.isfile(test_file):
+                raise FileNotFoundError("No test file for {}".format(file))
+            names.add(name)
+            folds[fold] = (os.path.abspath(os.path.join(folds_dir, file)), os.path.abspath(test_file))
+    if len(names) != 1:
+        raise ValueError("Expected the folds of one data set in {}, found: {}".format(folds_dir, sorted(names)))
+    return names.pop(), folds
+
+
+def read_grid(grid):
+    """
+    :param grid: (str) JSON object (or file with a JSON object) with a list of values of train-no-dev.py
+                 options, e.g. {"dropout": [0.3, 0.5], "char_dim": [25, 50]}
+    :return: list of configurations (dictionaries option -> value), all combinations of the values
+    """
+    if os.path.isfile(grid):
+        with open(grid, 'r', encoding='utf-8') as infile:
+            grid = infile.read()
+    grid = json.loads(grid)
+    options = sorted(grid)
+    values = [grid[option] if isinstance(grid[option], list) else [grid[option]] for option in options]
+    return [dict(zip(options, combination)) for combination in itertools.product(*values)]
+
+
+def absolute_path(value):
+    """
+    Make relative paths of existing files absolute, as the processes run in the output directory.
+    """
+    if isinstance(value, str) and os.path.exists(value):
+        return os.path.abspath(value)
+    return value
+
+
+def create_jobs(args, data, folds, configurations):
+    """
+    :return: list of (job name, command) for every configuration and fold
+    """
+    jobs = []
+    options = [absolute_path(option) for option in shlex.split(args.options)]
+    for i, configuration in enumerate(configurations):
+        config_name = "config{}_".format(i) + "_".join(
+            "{}={}".format(option, os.path.basename(str(value))) for option, value in sorted(configuration.items())
+        )
+        for fold, (train_file, test_file) in sorted(folds.items()):
+            command = [absolute_path(args.python), TRAIN_SCRIPT, "--train", train_file, "--test", test_file,
+                       "--fold", str(fold), "--data", data, "--save_eval", "1"] + options
+            for option, value in sorted(configuration.items()):
+                command += ["--" + option, str(absolute_path(value))]
+            jobs.append(("{}.fold{}".format(config_name, fold), command))
+    return jobs
+
+
+def get_cpu_slots(workers, threads):
+    """
+    Split the available CPUs between the workers.
+    :return: list of CPU sets (None if the CPU affinity cannot be set)
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < workers * threads:
+        print(">> only {} CPUs for {} workers with {} threads, the workers are not pinned".format(
+            len(cpus), workers, threads), file=sys.stderr, flush=True)
+        return [None] * workers
+    return [set(cpus[i * threads:(i + 1) * threads]) for i in range(workers)]
+
+
+def run_job(name, command, cpu_slots, threads, outdir):
+    """
+    Run a training process on a free worker.
+    :return: return code of the process
+    """
+    cpus = cpu_slots.get()
+    try:
+        env = dict(os.environ)
+        for variable in THREAD_VARIABLES:
+            env[variable] = str(threads)
+        preexec_fn = None
+        if cpus is not None:
+            def preexec_fn():
+                os.sched_setaffinity(0, cpus)
+
+        print(">> starting {} (CPUs {})".format(name, sorted(cpus) if cpus else "any"), file=sys.stderr, flush=True)
+        start = time.time()
+        with open(os.path.join(outdir, "logs", name + ".log"), 'w', encoding='utf-8') as log:
+            log.write(" ".join(shlex.quote(arg) for arg in command) + "\n")
+            log.flush()
+            returncode = subprocess.call(command, cwd=outdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                         preexec_fn=preexec_fn)
+        print(">> {} finished with code {} after {:.0f}s".format(name, returncode, time.time() - start),
+              file=sys.stderr, flush=True)
+        return returncode
+    finally:
+        cpu_slots.put(cpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel k-fold crossvalidation training of a hyperparameter grid')
+
+    parser.add_argument(
+        '-f', '--folds_dir',
+        type=str,
+        required=True,
+        help='directory with the folds of one data set (output of kfold_crossvalidation.py)')
+
+    parser.add_argument(
+        '-g', '--grid',
+        type=str,
+        default='{}',
+        help='JSON object (or file) with the values of train-no-dev.py options to combine')
+
+    parser.add_argument(
+        '-o', '--outdir',
+        type=str,
+        default='./',
+        help='output directory for the evaluation files, models and logs')
+
+    parser.add_argument(
+        '--options',
+        type=str,
+        default='',
+        help='train-no-dev.py options shared by all configurations')
+
+    parser.add_argument(
+        '--data',
+        type=str,
+        default=None,
+        help='data name of the models (default: name of the fold files)')
+
+    parser.add_argument(
+        '--folds',
+        type=str,
+        default=None,
+        help='comma-separated folds to train (default: all folds)')
+
+    parser.add_argument(
+        '-t', '--threads',
+        type=int,
+        default=1,
+        help='threads (and CPUs) per training process')
+
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='number of parallel training processes (default: number of CPUs / threads)')
+
+    parser.add_argument(
+        '--python',
+        type=str,
+        default='python2.7',
+        help='python interpreter of train-no-dev.py')
+
+    parser.add_argument(
+        '--dry_run',
+        action='store_true',
+        help='only print the training commands')
+
+    args = parser.parse_args()
+
+    data, folds = find_folds(args.folds_dir)
+    if args.data:
+        data = args.data
+    if args.folds:
+        selected = set(int(fold) for fold in args.folds.split(","))
+        folds = dict((fold, files) for fold, files in folds.items() if fold in selected)
+    jobs = create_jobs(args, data, folds, read_grid(args.grid))
+
+    if args.dry_run:
+        for name, command in jobs:
+            print(name + ":\t" + " ".join(shlex.quote(arg) for arg in command))
+        return
+
+    outdir = os.path.abspath(args.outdir)
+    if not os.path.exists(os.path.join(outdir, "logs")):
+        os.makedirs(os.path.join(outdir, "logs"))
+    workers = args.workers
+    if workers is None:
+        n_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        workers = max(1, n_cpus // args.threads)
+    workers = min(workers, len(jobs))
+    print(">> {} training processes on {} workers with {} threads".format(len(jobs), workers, args.threads),
+          file=sys.stderr, flush=True)
+
+    cpu_slots = queue.Queue()
+    for cpus in get_cpu_slots(workers, args.threads):
+        cpu_slots.put(cpus)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda job: run_job(job[0], job[1], cpu_slots, args.threads, outdir), jobs))
+
+    failed = [name for (name, _), returncode in zip(jobs, results) if returncode != 0]
+    if failed:
+        print(">> failed training processes (see logs): {}".format(", ".join(failed)), file=sys.stderr, flush=True)
+
+    eval_dir = os.path.join(outdir, "evaluation", "temp")
+    if os.path.isdir(eval_dir):
+        print(">> evaluation over the folds:", file=sys.stderr, flush=True)
+        for model_dir in sorted(os.listdir(eval_dir)):
+            print("$ python2 final_eval_kfold.py -d {} -o ./evaluation_files/".format(
+                os.path.join(eval_dir, model_dir) + "/"), file=sys.stderr, flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,12 @@ from collections import defaultdict
 import optparse
 import itertools
 from collections import OrderedDict
-from utils import create_input
+from utils import create_input, create_batch_input, create_eval_batches
+from utils import bucket_batches, sentence_lengths
 import loader
+import dataset
 
-from utils import models_path, evaluate, eval_script, eval_temp
+from utils import models_path, evaluate, eval_temp
 from loader import word_mapping, char_mapping, tag_mapping
 from loader import update_tag_scheme, prepare_dataset
 from loader import augment_with_pretrained
@@ -96,6 +98,30 @@ optparser.add_option(
     "-r", "--reload", default="0",
     type='int', help="Reload the last saved model"
 )
+optparser.add_option(
+    "--batch_size", default="1",
+    type='int', help="Number of sentences per training update"
+)
+optparser.add_option(
+    "--bucket_width", default="0",
+    type='int', help="Group training sentences by length buckets of this width (0 to disable)"
+)
+optparser.add_option(
+    "--data", default="",
+    help="Name of the training data (part of the model name)"
+)
+optparser.add_option(
+    "--fold", default="1",
+    type='int', help="Crossvalidation fold (last part of the model name)"
+)
+optparser.add_option(
+    "--dataset_cache", default="dataset_cache",
+    help="Directory of the indexed datasets, reused by the next runs on the same data (empty to disable)"
+)
+optparser.add_option(
+    "--save_eval", default="0",
+    type='int', help="Write the predictions and scores of every evaluation to the evaluation folder"
+)
 opts = optparser.parse_args()[0]
 
 # Parse parameters
@@ -115,6 +141,8 @@ parameters['cap_dim'] = opts.cap_dim
 parameters['crf'] = opts.crf == 1
 parameters['dropout'] = opts.dropout
 parameters['lr_method'] = opts.lr_method
+parameters['data'] = opts.data
+parameters['fold'] = opts.fold
 
 # Check parameters validity
 assert os.path.isfile(opts.train)
@@ -126,11 +154,11 @@ assert parameters['tag_scheme'] in ['iob', 'iobes']
 assert not parameters['all_emb'] or parameters['pre_emb']
 assert not parameters['pre_emb'] or parameters['word_dim'] > 0
 assert not parameters['pre_emb'] or os.path.isfile(parameters['pre_emb'])
+assert opts.batch_size > 0
+assert opts.bucket_width >= 0
 
-# Check evaluation script / folders
-if not os.path.isfile(eval_script):
-    raise Exception('CoNLL evaluation script not found at "%s"' % eval_script)
-if not os.path.exists(eval_temp):
+# Check evaluation folders
+if opts.save_eval and not os.path.exists(eval_temp):
     os.makedirs(eval_temp)
 if not os.path.exists(models_path):
     os.makedirs(models_path)
@@ -144,45 +172,81 @@ lower = parameters['lower']
 zeros = parameters['zeros']
 tag_scheme = parameters['tag_scheme']
 
-# Load sentences
-train_sentences = loader.load_sentences(opts.train, lower, zeros)
-#dev_sentences = loader.load_sentences(opts.dev, lower, zeros)
-test_sentences = loader.load_sentences(opts.test, lower, zeros)
-
-# Use selected tagging scheme (IOB / IOBES)
-update_tag_scheme(train_sentences, tag_scheme)
-#update_tag_scheme(dev_sentences, tag_scheme)
-update_tag_scheme(test_sentences, tag_scheme)
-
-# Create a dictionary / mapping of words
-# If we use pretrained embeddings, we add them to the dictionary.
-if parameters['pre_emb']:
-    dico_words_train = word_mapping(train_sentences, lower)[0]
-    dico_words, word_to_id, id_to_word = augment_with_pretrained(
-        dico_words_train.copy(),
-        parameters['pre_emb'],
-        list(itertools.chain.from_iterable(
-            [[w[0] for w in s] for s in test_sentences])
-        ) if not parameters['all_emb'] else None
+# Reuse the indexed datasets of a previous run on the same data
+cache_path = None
+if opts.dataset_cache:
+    cache_path = dataset.get_cache_path(opts.dataset_cache,
+                                        [opts.train, opts.test], parameters)
+if cache_path and dataset.is_cached(cache_path):
+    print "Loading the indexed datasets from %s..." % cache_path
+    mappings, (train_data, test_data) = dataset.load_cache(
+        cache_path, ['train', 'test']
     )
+    id_to_word = mappings['id_to_word']
+    id_to_char = mappings['id_to_char']
+    id_to_tag = mappings['id_to_tag']
+    dico_tags = mappings['dico_tags']
+    singletons = mappings['singletons']
+    # The raw test sentences are only used to write the predictions
+    test_sentences = loader.load_sentences(opts.test, lower, zeros) \
+        if opts.save_eval else None
 else:
-    dico_words, word_to_id, id_to_word = word_mapping(train_sentences, lower)
-    dico_words_train = dico_words
+    # Load sentences
+    train_sentences = loader.load_sentences(opts.train, lower, zeros)
+    #dev_sentences = loader.load_sentences(opts.dev, lower, zeros)
+    test_sentences = loader.load_sentences(opts.test, lower, zeros)
 
-# Create a dictionary and a mapping for words / POS tags / tags
-dico_chars, char_to_id, id_to_char = char_mapping(train_sentences)
-dico_tags, tag_to_id, id_to_tag = tag_mapping(train_sentences)
+    # Use selected tagging scheme (IOB / IOBES)
+    update_tag_scheme(train_sentences, tag_scheme)
+    #update_tag_scheme(dev_sentences, tag_scheme)
+    update_tag_scheme(test_sentences, tag_scheme)
 
-# Index data
-train_data = prepare_dataset(
-    train_sentences, word_to_id, char_to_id, tag_to_id, lower
-)
-# dev_data = prepare_dataset(
-#     dev_sentences, word_to_id, char_to_id, tag_to_id, lower
-# )
-test_data = prepare_dataset(
-    test_sentences, word_to_id, char_to_id, tag_to_id, lower
-)
+    # Create a dictionary / mapping of words
+    # If we use pretrained embeddings, we add them to the dictionary.
+    if parameters['pre_emb']:
+        dico_words_train = word_mapping(train_sentences, lower)[0]
+        dico_words, word_to_id, id_to_word = augment_with_pretrained(
+            dico_words_train.copy(),
+            parameters['pre_emb'],
+            list(itertools.chain.from_iterable(
+                [[w[0] for w in s] for s in test_sentences])
+            ) if not parameters['all_emb'] else None
+        )
+    else:
+        dico_words, word_to_id, id_to_word = word_mapping(train_sentences, lower)
+        dico_words_train = dico_words
+
+    # Create a dictionary and a mapping for words / POS tags / tags
+    dico_chars, char_to_id, id_to_char = char_mapping(train_sentences)
+    dico_tags, tag_to_id, id_to_tag = tag_mapping(train_sentences)
+
+    # Index data
+    train_data = prepare_dataset(
+        train_sentences, word_to_id, char_to_id, tag_to_id, lower
+    )
+    # dev_data = prepare_dataset(
+    #     dev_sentences, word_to_id, char_to_id, tag_to_id, lower
+    # )
+    test_data = prepare_dataset(
+        test_sentences, word_to_id, char_to_id, tag_to_id, lower
+    )
+
+    singletons = set([word_to_id[k] for k, v
+                      in dico_words_train.items() if v == 1])
+    if cache_path:
+        print "Saving the indexed datasets to %s..." % cache_path
+        dataset.save_cache(cache_path, {
+            'id_to_word': id_to_word,
+            'id_to_char': id_to_char,
+            'id_to_tag': id_to_tag,
+            'dico_tags': dico_tags,
+            'singletons': singletons,
+        }, {'train': train_data, 'test': test_data})
+        # Train on the memory-mapped datasets
+        del train_sentences
+        train_data, test_data = dataset.load_cache(
+            cache_path, ['train', 'test']
+        )[1]
 
 print "%i / %i sentences in train / test." % (
     len(train_data), len(test_data))
@@ -192,7 +256,7 @@ print 'Saving the mappings to disk...'
 model.save_mappings(id_to_word, id_to_char, id_to_tag)
 
 # Build the model
-f_train, f_eval = model.build(**parameters)
+f_train, f_eval = model.build(batch=opts.batch_size > 1, **parameters)
 
 # Reload previous model values
 if opts.reload:
@@ -202,30 +266,46 @@ if opts.reload:
 #
 # Train network
 #
-singletons = set([word_to_id[k] for k, v
-                  in dico_words_train.items() if v == 1])
 n_epochs = 100  # number of epochs over the training set
-freq_eval = 1000  # evaluate on dev every freq_eval steps
+freq_eval = 1000  # evaluate on dev every freq_eval sentences
 best_dev = -np.inf
 best_test = -np.inf
 all_test_scores_over_epochs = defaultdict(float)
+# inputs of the test set, prepared once for all the evaluations
+test_batches = create_eval_batches(parameters, test_data, opts.batch_size)
+train_lengths = sentence_lengths(train_data)
+bucket_random_state = np.random.RandomState(10)  # same seed as utils
 
 count = 0
 for epoch in xrange(n_epochs):
     epoch_costs = []
     print "Starting epoch %i..." % epoch
-    for i, index in enumerate(np.random.permutation(len(train_data))):
-        count += 1
-        input = create_input(train_data[index], parameters, True, singletons)
+    if opts.bucket_width:
+        train_batches = bucket_batches(train_lengths, opts.batch_size,
+                                       opts.bucket_width, bucket_random_state)
+    else:
+        permutation = np.random.permutation(len(train_data))
+        train_batches = [permutation[j:j + opts.batch_size]
+                         for j in xrange(0, len(train_data), opts.batch_size)]
+    for i, batch in enumerate(train_batches):
+        count += len(batch)
+        if opts.batch_size > 1:
+            input = create_batch_input([train_data[index] for index in batch],
+                                       parameters, True, singletons)
+        else:
+            input = create_input(train_data[batch[0]], parameters, True,
+                                 singletons)
         new_cost = f_train(*input)
         epoch_costs.append(new_cost)
         if i % 50 == 0 and i > 0 == 0:
             print "%i, cost average: %f" % (i, np.mean(epoch_costs[-50:]))
-        if count % freq_eval == 0:
+        if count % freq_eval < len(batch):
             # dev_score = evaluate(parameters, f_eval, dev_sentences,
             #                      dev_data, id_to_tag, dico_tags)
             test_score = evaluate(parameters, f_eval, test_sentences,
-                                  test_data, id_to_tag, dico_tags, epoch)
+                                  test_data, id_to_tag, dico_tags, epoch,
+                                  opts.batch_size, opts.save_eval == 1,
+                                  test_batches)
             # print "Score on dev: %.5f" % dev_score
             print "Score on test: %.5f" % test_score
             # if dev_score > best_dev:
@@ -12,7 +12,6 @@ import theano
 models_path = "./models"
 eval_path = "./evaluation"
 eval_temp = os.path.join(eval_path, "temp")
-eval_script = os.path.join(eval_path, "conlleval")
 
 def get_name(parameters):
     """
@@ -161,21 +160,21 @@ def iobes_iob(tags):
 def iob_ranges(tags):
     """
     IOB -> Ranges
+    As in conlleval, an I tag that does not continue an entity of the same
+    type starts a new entity.
     """
     ranges = []
-    def check_if_closing_range():
-        if i == len(tags)-1 or tags[i+1].split('-')[0] == 'O':
-            ranges.append((begin, i, type))
-    
+    begin = None
     for i, tag in enumerate(tags):
-        if tag.split('-')[0] == 'O':
-            pass
-        elif tag.split('-')[0] == 'B':
+        prefix = tag.split('-')[0]
+        if prefix == 'O':
+            continue
+        if prefix == 'B' or begin is None or tag.split('-', 1)[1] != type:
             begin = i
-            type = tag.split('-')[1]
-            check_if_closing_range()
-        elif tag.split('-')[0] == 'I':
-            check_if_closing_range()
+            type = tag.split('-', 1)[1]
+        if i == len(tags) - 1 or tags[i + 1] != 'I-' + type:
+            ranges.append((begin, i, type))
+            begin = None
     return ranges
 
 
@@ -215,6 +214,46 @@ def pad_word_chars(words):
     return char_for, char_rev, char_pos
 
 
+def bucket_batches(lengths, batch_size, bucket_width=1, random_state=None):
+    """
+    Group sentences of similar size into batches, to minimize the padding
+    of create_batch_input / pad_word_chars.
+    Input:
+        - list of (number of words, length of the longest word) per sentence
+        - maximum number of sentences per batch
+        - width of the length buckets: sentences are ordered by
+          (n_words // bucket_width, max_word_length // bucket_width)
+        - numpy RandomState to shuffle the sentences within a bucket and
+          the order of the batches (None: deterministic order)
+    Output:
+        - list of batches (lists of sentence indexes)
+    """
+    assert batch_size > 0 and bucket_width > 0
+    indexes = list(range(len(lengths)))
+    if random_state is not None:
+        random_state.shuffle(indexes)
+    # stable sort: the shuffled order is kept within a bucket
+    indexes.sort(key=lambda i: (lengths[i][0] // bucket_width,
+                                lengths[i][1] // bucket_width))
+    batches = [indexes[i:i + batch_size]
+               for i in range(0, len(indexes), batch_size)]
+    if random_state is not None:
+        random_state.shuffle(batches)
+    return batches
+
+
+def sentence_lengths(sentences):
+    """
+    Sizes of the sentence data used by bucket_batches:
+    (number of words, length of the longest word) per sentence.
+    """
+    if hasattr(sentences, 'sentence_lengths'):
+        # memory-mapped dataset (see dataset.IndexedDataset)
+        return sentences.sentence_lengths()
+    return [(len(data['chars']), max([len(w) for w in data['chars']] or [0]))
+            for data in sentences]
+
+
 def create_input(data, parameters, add_label, singletons=None):
     """
     Take sentence data and return an input for
@@ -242,64 +281,281 @@ def create_input(data, parameters, add_label, singletons=None):
     return input
 
 
-def evaluate(parameters, f_eval, raw_sentences, parsed_sentences,
-             id_to_tag, dictionary_tags, epoch):
+def create_batch_input(batch, parameters, add_label=False, singletons=None):
     """
-    Evaluate current model using CoNLL script.
+    Take a list of sentence data and return a padded input for the
+    batched training or evaluation function (see Model.build with
+    batch=True). Sentences are padded to the longest sentence of the batch,
+    and the characters of all words (padding words included) to the longest
+    word of the batch. The float mask of the real words comes after the
+    features, followed by the padded tags if add_label is set.
     """
+    max_length = max(len(data['words']) for data in batch)
+    words = []
+    chars = []
+    caps = []
+    mask = []
+    tags = []
+    for data in batch:
+        padding = max_length - len(data['words'])
+        sentence_words = data['words']
+        if singletons is not None:
+            sentence_words = insert_singletons(sentence_words, singletons)
+        words.append(sentence_words + [0] * padding)
+        chars.extend(data['chars'] + [[0]] * padding)
+        if parameters['cap_dim']:
+            caps.append(data['caps'] + [0] * padding)
+        mask.append([1] * len(data['words']) + [0] * padding)
+        if add_label:
+            tags.append(data['tags'] + [0] * padding)
+    char_for, char_rev, char_pos = pad_word_chars(chars)
+    input = []
+    if parameters['word_dim']:
+        input.append(np.array(words, dtype=np.int32))
+    if parameters['char_dim']:
+        input.append(np.array(char_for, dtype=np.int32))
+        if parameters['char_bidirect']:
+            input.append(np.array(char_rev, dtype=np.int32))
+        input.append(np.array(char_pos, dtype=np.int32))
+    if parameters['cap_dim']:
+        input.append(np.array(caps, dtype=np.int32))
+    input.append(np.array(mask, dtype=np.float32))
+    if add_label:
+        input.append(np.array(tags, dtype=np.int32))
+    return input
+
 
-    eval_script = os.path.join("evaluation/conlleval")
+def create_eval_batches(parameters, parsed_sentences, batch_size=1):
+    """
+    Prepare the inputs of the evaluation function once, so that a dataset
+    can be evaluated several times (see evaluate).
+    If batch_size > 1, sentences of similar size are padded together (see
+    bucket_batches and create_batch_input) for the batched evaluation
+    function. Otherwise every sentence is an input of its own.
+    Returns a list of (sentence indexes, input) with int32 arrays.
+    """
+    if batch_size > 1:
+        batches = bucket_batches(sentence_lengths(parsed_sentences),
+                                 batch_size)
+        return [(batch, create_batch_input([parsed_sentences[i]
+                                            for i in batch], parameters))
+                for batch in batches]
+    return [([i], [np.array(x, dtype=np.int32)
+                   for x in create_input(data, parameters, False)])
+            for i, data in enumerate(parsed_sentences)]
+
+
+def predict_batches(parameters, f_eval, parsed_sentences, batch_size,
+                    eval_batches=None):
+    """
+    Return the predicted tag indexes of every sentence. If batch_size > 1,
+    f_eval is the batched evaluation function (see Model.build with
+    batch=True). The inputs of create_eval_batches are prepared if they are
+    not given.
+    """
+    if eval_batches is None:
+        eval_batches = create_eval_batches(parameters, parsed_sentences,
+                                           batch_size)
+    all_y_preds = [None] * len(parsed_sentences)
+    for batch, input in eval_batches:
+        if batch_size > 1:
+            for i, y_preds in zip(batch, f_eval(*input)):
+                all_y_preds[i] = np.array(
+                    y_preds[:len(parsed_sentences[i]['words'])],
+                    dtype=np.int32
+                )
+        elif parameters['crf']:
+            all_y_preds[batch[0]] = np.array(f_eval(*input),
+                                             dtype=np.int32)[1:-1]
+        else:
+            all_y_preds[batch[0]] = \
+                f_eval(*input).argmax(axis=1).astype(np.int32)
+    return all_y_preds
 
+
+def conll_tag_codes(id_to_tag):
+    """
+    Chunk prefix (0 for O, 1 for B, 2 for I) and type of every tag id, as
+    read by the CoNLL script from IOB tags (S / E tags of the IOBES scheme
+    are read as B / I tags). Code len(id_to_tag) is an O tag.
+    Returns the prefixes, the types (indexes in the type names, 0 for O)
+    and the type names.
+    """
     n_tags = len(id_to_tag)
-    predictions = []
-    count = np.zeros((n_tags, n_tags), dtype=np.int32)
+    prefixes = np.zeros(n_tags + 1, dtype=np.int8)
+    types = np.zeros(n_tags + 1, dtype=np.int32)
+    type_names = [''] + sorted(set(
+        id_to_tag[i].split('-', 1)[1] for i in range(n_tags)
+        if '-' in id_to_tag[i]
+    ))
+    for i in range(n_tags):
+        if '-' in id_to_tag[i]:
+            prefix, tag_type = id_to_tag[i].split('-', 1)
+            prefixes[i] = 1 if prefix in ['B', 'S'] else 2
+            types[i] = type_names.index(tag_type)
+    return prefixes, types, type_names
 
-    for raw_sentence, data in zip(raw_sentences, parsed_sentences):
-        input = create_input(data, parameters, False)
 
-        if parameters['crf']:
-            #print(raw_sentence)
-            y_preds = np.array(f_eval(*input))[1:-1]
+def conll_chunks(prefixes, types):
+    """
+    Start indexes, end indexes (included) and types of the chunks of a
+    sequence of tag codes (see conll_tag_codes), with the chunk boundaries
+    of the CoNLL script: a chunk starts with a B tag or with a tag of
+    another type than the previous tag.
+    """
+    previous_types = np.r_[0, types[:-1]]
+    next_prefixes = np.r_[prefixes[1:], 0]
+    next_types = np.r_[types[1:], 0]
+    inside = prefixes > 0
+    starts = np.nonzero(inside & ((prefixes == 1) |
+                                  (types != previous_types)))[0]
+    ends = np.nonzero(inside & ((next_prefixes != 2) |
+                                (next_types != types)))[0]
+    return starts, ends, types[starts]
+
+
+def conll_counts(y_reals, y_preds, id_to_tag):
+    """
+    Counts of the CoNLL script, computed from the gold and predicted tag
+    ids of every sentence. A predicted chunk is correct if a gold chunk has
+    the same words and type.
+    Returns a dictionary with the number of tokens and of correctly tagged
+    tokens, the type names and the number of gold, predicted and correct
+    chunks of every type.
+    """
+    prefixes, types, type_names = conll_tag_codes(id_to_tag)
+    lengths = np.array([len(y) for y in y_reals], dtype=np.int64)
+    assert lengths.tolist() == [len(y) for y in y_preds]
+    # Sentences are concatenated with an O tag after every sentence
+    size = int(lengths.sum()) + len(lengths)
+    is_token = np.ones(size, dtype=bool)
+    is_token[np.cumsum(lengths + 1) - 1] = False
+    chunks = []
+    for sentences in [y_reals, y_preds]:
+        flat = np.full(size, len(id_to_tag), dtype=np.int32)
+        if len(sentences) > 0:
+            flat[is_token] = np.concatenate(sentences)
+        chunks.append((prefixes[flat], types[flat]))
+    (real_prefixes, real_types), (pred_prefixes, pred_types) = chunks
+    correct_tags = ((real_prefixes == pred_prefixes) &
+                    (real_types == pred_types) & is_token).sum()
+
+    n_types = len(type_names)
+    keys = []
+    for tag_prefixes, tag_types in chunks:
+        starts, ends, chunk_types = conll_chunks(tag_prefixes, tag_types)
+        keys.append((starts * size + ends) * n_types + chunk_types)
+    correct_types = np.intersect1d(keys[0], keys[1]) % n_types
+    return {
+        'tokens': int(lengths.sum()),
+        'correct_tags': int(correct_tags),
+        'type_names': type_names[1:],
+        'gold': np.bincount(keys[0] % n_types, minlength=n_types)[1:],
+        'found': np.bincount(keys[1] % n_types, minlength=n_types)[1:],
+        'correct': np.bincount(correct_types, minlength=n_types)[1:],
+    }
+
+
+def conll_report(counts):
+    """
+    Output lines of the CoNLL script for the counts of conll_counts, and
+    the F1 score on all the chunks.
+    """
+    def scores(correct, found, gold):
+        precision = 100. * correct / found if found > 0 else 0.
+        recall = 100. * correct / gold if gold > 0 else 0.
+        if precision + recall > 0:
+            f1 = 2 * precision * recall / (precision + recall)
         else:
-            y_preds = f_eval(*input).argmax(axis=1)
-        y_reals = np.array(data['tags']).astype(np.int32)
-        assert len(y_preds) == len(y_reals)
-        p_tags = [id_to_tag[y_pred] for y_pred in y_preds]
-        r_tags = [id_to_tag[y_real] for y_real in y_reals]
-        if parameters['tag_scheme'] == 'iobes':
-            p_tags = iobes_iob(p_tags)
-            r_tags = iobes_iob(r_tags)
-        for i, (y_pred, y_real) in enumerate(zip(y_preds, y_reals)):
-            new_line = " ".join(raw_sentence[i][:-1] + [r_tags[i], p_tags[i]])
-            predictions.append(new_line)
-            count[y_real, y_pred] += 1
-        predictions.append("")
-
-    # Write predictions to disk and run CoNLL script externally
-    # eval_id = np.random.randint(1000000, 2000000)
-        # output_path = os.path.join(eval_temp, "eval.%ie.output" % epoch)
-        # scores_path = os.path.join(eval_temp, "eval.%ie.scores" % epoch)
-        scores_directory = "model_" + get_name(parameters)[:-7] # take everything except fold
-        model_dir = os.path.join(eval_temp, scores_directory) # create data_specific output dir in temp/model_nameparams
-        if not os.path.exists(model_dir):
-            os.makedirs(model_dir)
-        out_dir = os.path.join(model_dir, str(get_name(parameters)))
-        if not os.path.exists(out_dir):
-            os.makedirs(out_dir)
-        output_path = os.path.join(out_dir, "eval.e%i.output" % epoch)
-        scores_path = os.path.join(out_dir, "eval.e%i.scores" % epoch)
-    with codecs.open(output_path, 'w', 'utf8') as f:
-        f.write("\n".join(predictions))
-    os.system("%s < %s > %s" % (eval_script, output_path, scores_path))
+            f1 = 0.
+        return precision, recall, f1
+
+    gold, found, correct = [counts[key].sum()
+                            for key in ['gold', 'found', 'correct']]
+    precision, recall, f1 = scores(correct, found, gold)
+    lines = ["processed %i tokens with %i phrases; "
+             "found: %i phrases; correct: %i." % (
+                 counts['tokens'], gold, found, correct
+             )]
+    if counts['tokens'] > 0:
+        lines.append("accuracy: %6.2f%%; precision: %6.2f%%; "
+                     "recall: %6.2f%%; FB1: %6.2f" % (
+                         100. * counts['correct_tags'] / counts['tokens'],
+                         precision, recall, f1
+                     ))
+    for i, type_name in enumerate(counts['type_names']):
+        if counts['gold'][i] > 0 or counts['found'][i] > 0:
+            lines.append("%17s: precision: %6.2f%%; recall: %6.2f%%; "
+                         "FB1: %6.2f  %i" % ((type_name,) + scores(
+                             counts['correct'][i], counts['found'][i],
+                             counts['gold'][i]
+                         ) + (counts['found'][i],)))
+    return lines, f1
+
+
+def evaluate(parameters, f_eval, raw_sentences, parsed_sentences,
+             id_to_tag, dictionary_tags, epoch, batch_size=1,
+             save_output=False, eval_batches=None):
+    """
+    Evaluate current model with the scores of the CoNLL script (computed in
+    process, see conll_counts).
+    If batch_size > 1, f_eval is a batched evaluation function.
+    eval_batches are the inputs of create_eval_batches, prepared once for
+    all the evaluations of the dataset (prepared again if not given).
+    If save_output, the predictions and the scores are written to eval_temp
+    in the format of the CoNLL script.
+    """
+    n_tags = len(id_to_tag)
+    count = np.zeros((n_tags, n_tags), dtype=np.int32)
+
+    sentence_preds = predict_batches(parameters, f_eval, parsed_sentences,
+                                     batch_size, eval_batches)
+    sentence_reals = [np.array(data['tags'], dtype=np.int32)
+                      for data in parsed_sentences]
+    y_preds = np.concatenate(sentence_preds)
+    y_reals = np.concatenate(sentence_reals)
+    assert len(y_preds) == len(y_reals)
+    np.add.at(count, (y_reals, y_preds), 1)
 
     # CoNLL evaluation results
-    eval_lines = [l.rstrip() for l in codecs.open(scores_path, 'r', 'utf8')]
+    eval_lines, f1 = conll_report(
+        conll_counts(sentence_reals, sentence_preds, id_to_tag)
+    )
     for line in eval_lines:
         print(line)
 
-    # Remove temp files
-    # os.remove(output_path)
-    # os.remove(scores_path)
+    # Write predictions and scores to disk only if asked
+    if save_output:
+        predictions = []
+        for raw_sentence, y_preds, y_reals in zip(
+                raw_sentences, sentence_preds, sentence_reals):
+            p_tags = [id_to_tag[y_pred] for y_pred in y_preds]
+            r_tags = [id_to_tag[y_real] for y_real in y_reals]
+            if parameters['tag_scheme'] == 'iobes':
+                p_tags = iobes_iob(p_tags)
+                r_tags = iobes_iob(r_tags)
+            for i in range(len(y_preds)):
+                predictions.append(
+                    " ".join(raw_sentence[i][:-1] + [r_tags[i], p_tags[i]])
+                )
+            predictions.append("")
+        # data specific output dir in temp/model_nameparams
+        # (everything except the fold)
+        scores_directory = "model_" + get_name(parameters)[:-7]
+        out_dir = os.path.join(eval_temp, scores_directory,
+                               str(get_name(parameters)))
+        try:
+            os.makedirs(out_dir)
+        except OSError:
+            # created by another training process of the same model
+            if not os.path.isdir(out_dir):
+                raise
+        output_path = os.path.join(out_dir, "eval.e%i.output" % epoch)
+        scores_path = os.path.join(out_dir, "eval.e%i.scores" % epoch)
+        with codecs.open(output_path, 'w', 'utf8') as f:
+            f.write("\n".join(predictions))
+        with codecs.open(scores_path, 'w', 'utf8') as f:
+            f.write("\n".join(eval_lines) + "\n")
 
     # Confusion matrix with accuracy for each tag
     print(("{: >2}{: >7}{: >7}%s{: >9}" % ("{: >7}" * n_tags)).format(
@@ -319,4 +575,4 @@ def evaluate(parameters, f_eval, raw_sentences, parsed_sentences,
     ))
 
     # F1 on all entities
-    return float(eval_lines[1].strip().split()[-1])
+    return f1
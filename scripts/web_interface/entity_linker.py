@@ -23,10 +23,16 @@ $ python3 entity_linker.py -i ./../../resources/corpora/training_corpora/de/botl
 from collections import defaultdict
 import argparse
 import json
+import os
 import requests
 import sys
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "entity_linking"))
+from col_cache import empty_response
+
+BASE_URL = "http://webservice.catalogueoflife.org/col/webservice?"
+
 
 def get_bibref_information(data):
     """
@@ -96,7 +102,34 @@ def _store_empty():
     """
     return "", "", "", "", "", ""
 
-def send_api_request(BASE_URL, my_atts, no_linked_entities, lookup_table):
+def query_col(BASE_URL, atts, cache=None, client=None):
+    """
+    Query API (Catalogue of Life) for the name in atts, unless its response is cached.
+
+    :param BASE_URL: string (query URL)
+    :param atts: dictionary (for query attributes)
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling)
+    :return: data: dictionary structure returned from API
+    """
+    if cache is not None:
+        data = cache.get(atts['name'])
+        if data is not None:
+            return data
+        if cache.offline:
+            return empty_response(atts['name'])
+
+    if client is not None:
+        data = client.get(BASE_URL, atts)
+    else:
+        resp = requests.get(BASE_URL, params=atts)
+        data = resp.json()
+    if cache is not None:
+        cache.put(atts['name'], data)
+    return data
+
+
+def send_api_request(BASE_URL, my_atts, no_linked_entities, lookup_table, cache=None, client=None):
     """
     Query API (Catalogue of Life) and store relevant information.
     Unless specified otherwise, name lookups are used for higher entity linking coverage.
@@ -106,10 +139,11 @@ def send_api_request(BASE_URL, my_atts, no_linked_entities, lookup_table):
     :param no_linked_entities: total number of linked entities
     :param lookup_table: dictionary containing vernacular -> scientific name mappings
     :param use_lookup: boolean, if true vernacular -> scientific name lookups are performed
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling)
     :return: input_name, id, rank, scient_name, status, bib_ref, url, no_linked_entities
     """
-    resp = requests.get(BASE_URL, params=my_atts)
-    data = resp.json()
+    data = query_col(BASE_URL, my_atts, cache, client)
 
     if data["total_number_of_results"] == 0:
         input_name = data["name"]
@@ -117,8 +151,7 @@ def send_api_request(BASE_URL, my_atts, no_linked_entities, lookup_table):
         if lookup_table.get(input_name):
             lookup_query_name = lookup_table[input_name][0]
             my_atts['name'] = lookup_query_name
-            resp = requests.get(BASE_URL, params=my_atts)
-            data = resp.json()
+            data = query_col(BASE_URL, my_atts, cache, client)
             if data["total_number_of_results"] == 0:
                 input_name = data["name"]
                 id, rank, scient_name, status, bib_ref, url = _store_empty()
@@ -136,92 +169,90 @@ def send_api_request(BASE_URL, my_atts, no_linked_entities, lookup_table):
     return input_name, id, rank, scient_name, status, bib_ref, url, no_linked_entities
 
 
-def process_file(tagged_file):
+def process_file(list_tagged):
     """
     Store indices of entity candidates in dictionary and store file information
-    :param tagged_file: file-like obj with tagged sentences
+    :param list_tagged: list of (token, iob) tuples, sentences are separated by ("EOS", "EOS")
     :return: no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict
     """
     query_atts = {}
     query_atts['format'] = 'json'
 
-    with open(tagged_file, 'r') as tagged:
-        list_tagged = read_tagged_file(tagged)
-        index_dict = defaultdict(dict)
-        name_occurrence_dict = defaultdict()
-        sentence_counter = 1
-        index_counter = -1
-        no_total_sentences = 0
-        no_total_entities = 0
-        for index, (token, iob_tag) in enumerate(list_tagged):
-            index_counter += 1
-
-            if iob_tag == "EOS":
-                no_total_sentences += 1
-                sentence_counter += 1
-                index_counter = -1
-
-            if iob_tag == "O":
-                continue
-            else:
-                if iob_tag.startswith('B-'):
-                    # unigram case or case with two separate consecutive tags: B-en_species B-en_fam
-                    no_total_entities += 1
-                    checkindex = index + 1
-                    if list_tagged[checkindex][1] == 'O' or list_tagged[checkindex][1].startswith("B-"):
+    index_dict = defaultdict(dict)
+    name_occurrence_dict = defaultdict()
+    sentence_counter = 1
+    index_counter = -1
+    no_total_sentences = 0
+    no_total_entities = 0
+    for index, (token, iob_tag) in enumerate(list_tagged):
+        index_counter += 1
+
+        if iob_tag == "EOS":
+            no_total_sentences += 1
+            sentence_counter += 1
+            index_counter = -1
+
+        if iob_tag == "O":
+            continue
+        else:
+            if iob_tag.startswith('B-'):
+                # unigram case or case with two separate consecutive tags: B-en_species B-en_fam
+                no_total_entities += 1
+                checkindex = index + 1
+                if list_tagged[checkindex][1] == 'O' or list_tagged[checkindex][1].startswith("B-"):
+
+                    query_atts['name'] = token
+                    name_occurrence_dict[token] = token
+                    uni_index = index_counter
+
+                    try:
+                        index_dict[token][sentence_counter] += [uni_index]
+                    except KeyError:
+                        index_dict[token][sentence_counter] = []
+                        index_dict[token][sentence_counter] += [uni_index]
+
+                else:
+                    # bigram case: (only 2 tokens)
+                    if list_tagged[checkindex][1].startswith('I-') and list_tagged[checkindex + 1][1] == 'O':
+                        bigram_name = token + " " + list_tagged[checkindex][0]
+                        query_atts['name'] = bigram_name
+                        name_occurrence_dict[bigram_name] = bigram_name
+                        start_index, end_index = index_counter, index_counter + 1
+                        try:
+                            index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
+                        except KeyError:
+                            index_dict[bigram_name][sentence_counter] = []
+                            index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
+
+                    else:
+                        # ngram case with more than 2 tokens
+                        bigram_name = token + " " + list_tagged[checkindex][0]  # for API query
+                        query_atts['name'] = bigram_name
+
+                        temp_index_counter = index_counter
+                        temp_start_index = index_counter
 
-                        query_atts['name'] = token
-                        name_occurrence_dict[token] = token
-                        uni_index = index_counter
+                        ngram_name = []
+                        ngram_name.append(bigram_name)
+
+                        while list_tagged[checkindex + 1][1] != 'O':
+                            checkindex += 1
+                            ngram_name.append(list_tagged[checkindex][0])
+                            joined_ngram_name = " ".join(ngram_name)
+                            start_index, end_index = temp_start_index, index_counter + 2
+                            index_counter += 1
 
                         try:
-                            index_dict[token][sentence_counter] += [uni_index]
+                            index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
                         except KeyError:
-                            index_dict[token][sentence_counter] = []
-                            index_dict[token][sentence_counter] += [uni_index]
+                            index_dict[bigram_name][sentence_counter] = []
+                            index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
 
-                    else:
-                        # bigram case: (only 2 tokens)
-                        if list_tagged[checkindex][1].startswith('I-') and list_tagged[checkindex + 1][1] == 'O':
-                            bigram_name = token + " " + list_tagged[checkindex][0]
-                            query_atts['name'] = bigram_name
-                            name_occurrence_dict[bigram_name] = bigram_name
-                            start_index, end_index = index_counter, index_counter + 1
-                            try:
-                                index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
-                            except KeyError:
-                                index_dict[bigram_name][sentence_counter] = []
-                                index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
-
-                        else:
-                            # ngram case with more than 2 tokens
-                            bigram_name = token + " " + list_tagged[checkindex][0]  # for API query
-                            query_atts['name'] = bigram_name
-
-                            temp_index_counter = index_counter
-                            temp_start_index = index_counter
-
-                            ngram_name = []
-                            ngram_name.append(bigram_name)
-
-                            while list_tagged[checkindex + 1][1] != 'O':
-                                checkindex += 1
-                                ngram_name.append(list_tagged[checkindex][0])
-                                joined_ngram_name = " ".join(ngram_name)
-                                start_index, end_index = temp_start_index, index_counter + 2
-                                index_counter += 1
-
-                            try:
-                                index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
-                            except KeyError:
-                                index_dict[bigram_name][sentence_counter] = []
-                                index_dict[bigram_name][sentence_counter] += [(start_index, end_index)]
-
-                            index_counter = temp_index_counter
-                            name_occurrence_dict[bigram_name] = joined_ngram_name
-
-                elif iob_tag.startswith('I-'):
-                    continue
+                        index_counter = temp_index_counter
+                        name_occurrence_dict[bigram_name] = joined_ngram_name
+
+            elif iob_tag.startswith('I-'):
+                continue
 
     return no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict
 
@@ -242,22 +273,36 @@ def store_reference_db(language):
     return lookup_table
 
 
-def create_json(index_dict, query_atts, name_occurrence_dict, lookup_table):
+def create_json(index_dict, query_atts, name_occurrence_dict, lookup_table, cache=None, client=None,
+                base_url=BASE_URL):
     """
     Create json-object from botanical and positional information about all entity candidates.
     :param index_dict: dictionary containing positional information for each entity candidate
     :param atts: query attributes
     :param name_occurrence_dict: dictionary
     :param lookup_table: dictionary containing vernacular -> scientific name mappings
+    :param cache: ColCache object or None (no caching)
+    :param client: ColClient object or None (one request at a time without connection pooling),
+                   with a client the entity candidates are linked in parallel threads
+    :param base_url: string (query URL)
     :return: json_data (dict), no_linked_entities (int)
     """
-    BASE_URL = "http://webservice.catalogueoflife.org/col/webservice?"
     json_data = {}
     json_data['plant_names'] = []
     no_linked_entities = 0
 
-    for query_name, indices in index_dict.items():
-        query_atts['name'] = query_name
+    query_names = list(index_dict)
+
+    def link(query_name):
+        return send_api_request(base_url, dict(query_atts, name=query_name), 0, lookup_table, cache, client)
+
+    if client is not None:
+        api_results = client.map(link, query_names)
+    else:
+        api_results = [link(query_name) for query_name in query_names]
+
+    for query_name, api_result in zip(query_names, api_results):
+        indices = index_dict[query_name]
         inds = {}
         inds["sentence_ID"] = []
         for sent_index, span_index in indices.items():
@@ -269,11 +314,8 @@ def create_json(index_dict, query_atts, name_occurrence_dict, lookup_table):
             inds["sentence_ID"].append({
                 "sent_ID_{}".format(sent_index): span_index
             })
-#BASE_URL, my_atts, no_linked_entities, lookup_table
-        input_name, id, rank, scient_name, status, bib_ref, url, no_linked_entities = send_api_request(BASE_URL,
-                                                                                                       query_atts,
-                                                                                                       no_linked_entities,
-                                                                                                       lookup_table)
+        input_name, id, rank, scient_name, status, bib_ref, url, linked = api_result
+        no_linked_entities += linked
         json_data['plant_names'].append({
             'entity_candidate': name_occurrence_dict[query_name],
             'api_query_name': query_name,
@@ -320,8 +362,11 @@ def main():
 
     lookup_table = store_reference_db(language)
 
+    with open(tagged_file, 'r') as tagged:
+        list_tagged = read_tagged_file(tagged)
+
     time1 = time.time()
-    no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict = process_file(tagged_file)
+    no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict = process_file(list_tagged)
     json_data, no_linked_entities = create_json(index_dict, query_atts, name_occurrence_dict, lookup_table)
     time2 = time.time()
     elapsed = time2 - time1
@@ -0,0 +1,178 @@
+# usr/bin/env python3
+# author: Isabel Meraner
+# Project: Neural Entity Recognition for Scientific and Vernacular Plant Names (MA-Thesis)
+# Institute of Computational Linguistics (University of Zurich), 2019
+
+"""
+Registry of the NER models that the web application can use.
+
+The model directories are scanned at startup: only the parameters of the models are read (parameters.pkl, or the
+header of a model bundle, see tagger-master/bundle.py). A model is loaded when it is first requested, and the least
+recently used models are unloaded when the loaded models need more memory than the memory budget.
+
+Usage:
+    models = ModelRegistry(["./models/", "./../../resources/models/"], memory_budget=1024 * 1024 ** 2)
+    tagger = models.get("model_wiki_de")
+    tags = tagger.tag([["Die", "Borstige", "Robinie"]])
+"""
+
+import os
+import pickle
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagger-master"))
+from bundle import Bundle, is_bundle
+from tagging import Tagger
+
+# language of a model, from its name (e.g. model_wiki_crosscorpus_de_capdim1)
+LANGUAGE_PATTERN = re.compile(r"(?:^|_)(de|en)(?:_|\.|$)")
+
+# parameters shown in the model descriptions
+DESCRIBED_PARAMETERS = ["data", "tag_scheme", "word_dim", "char_dim", "cap_dim", "word_lstm_dim", "crf", "dropout"]
+
+
+def _read_parameters(path):
+    """
+    :param path: (str) model directory or bundle
+    :return: dictionary of the model parameters
+    """
+    if is_bundle(path):
+        return Bundle(path).parameters
+    with open(os.path.join(path, "parameters.pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def _get_size(path):
+    """
+    :param path: (str) model directory or bundle
+    :return: size of the model files in bytes
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+
+
+def model_memory(tagger):
+    """
+    Memory used by the values of a loaded model.
+    :param tagger: Tagger object
+    :return: size in bytes
+    """
+    model = tagger.model
+    size = sum(value.nbytes for values in model.components.values() for value in values.values())
+    if model.word_features is not None:
+        size += model.word_features.nbytes
+    return size
+
+
+class ModelRegistry:
+    """
+    Lazily loaded NER models (NumPy engine), shared by all requests of the web application.
+    """
+
+    def __init__(self, models_dirs, memory_budget, char_cache_size=0):
+        """
+        :param models_dirs: (list) directories with model directories and bundles (searched recursively),
+                            models of the first directories are used if several models have the same name
+        :param memory_budget: (int) maximum memory of the loaded models in bytes,
+                              a single model is always kept even if it is larger
+        :param char_cache_size: (int) character features cached per model (see NumpyModel)
+        """
+        self.models_dirs = models_dirs
+        self.memory_budget = memory_budget
+        self.char_cache_size = char_cache_size
+        self.models = OrderedDict()
+        self._loaded = OrderedDict()
+        self._memory = {}
+        self._loading_locks = {}
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """
+        Find the models in the model directories. A bundle is preferred to a model directory with the same name.
+        """
+        models = OrderedDict()
+        for models_dir in self.models_dirs:
+            found = {}
+            for root, dirs, files in os.walk(models_dir):
+                dirs.sort()
+                if "parameters.pkl" in files:
+                    found.setdefault(os.path.basename(root), root)
+                for file in sorted(files):
+                    path = os.path.join(root, file)
+                    if file.endswith(".bundle") and is_bundle(path):
+                        found[file[:-len(".bundle")]] = path
+            for name in sorted(found):
+                if name not in models:
+                    models[name] = self._describe(name, found[name])
+        with self._lock:
+            self.models = models
+
+    def _describe(self, name, path):
+        """
+        :param name: (str) model name
+        :param path: (str) model directory or bundle
+        :return: dictionary with the model description
+        """
+        parameters = _read_parameters(path)
+        match = LANGUAGE_PATTERN.search(name)
+        return {
+            "name": name,
+            "path": path,
+            "language": match.group(1) if match else None,
+            "size": _get_size(path),
+            "parameters": dict((key, parameters.get(key)) for key in DESCRIBED_PARAMETERS),
+        }
+
+    def describe(self, language=None):
+        """
+        :param language: (str) only describe the models of a language, all models if None
+        :return: list of model descriptions, with the loaded state of the models
+        """
+        with self._lock:
+            return [dict(model, loaded=name in self._loaded) for name, model in self.models.items()
+                    if language is None or model["language"] == language]
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def get(self, name):
+        """
+        Return the tagger of a model, loaded on first use.
+        :param name: (str) model name
+        :return: Tagger object
+        """
+        with self._lock:
+            path = self.models[name]["path"]
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            loading_lock = self._loading_locks.setdefault(name, threading.Lock())
+
+        # other models can be used while a model is loaded
+        with loading_lock:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name]
+            print(">> loading model {}...".format(name), file=sys.stderr, flush=True)
+            tagger = Tagger(path, engine="numpy", char_cache_size=self.char_cache_size)
+            with self._lock:
+                self._loaded[name] = tagger
+                self._memory[name] = model_memory(tagger)
+                self._evict()
+        return tagger
+
+    def _evict(self):
+        """
+        Unload the least recently used models until the loaded models fit in the memory budget.
+        Requests that use an unloaded model can finish with it.
+        """
+        while len(self._loaded) > 1 and sum(self._memory.values()) > self.memory_budget:
+            name, _ = self._loaded.popitem(last=False)
+            del self._memory[name]
+            print(">> unloading model {}".format(name), file=sys.stderr, flush=True)
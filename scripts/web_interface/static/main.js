@@ -6,15 +6,18 @@ var language = 'en';
     deButton.addEventListener('click', function () {
         language = 'de';
         checkLanguageButtonActive();
+        loadModels();
 
     }, false);
 
     enButton.addEventListener('click', function () {
         language = 'en';
         checkLanguageButtonActive();
+        loadModels();
 
     }, false);
     checkLanguageButtonActive();
+    loadModels();
 
 })();
 
@@ -29,6 +32,21 @@ function checkLanguageButtonActive() {
     }
 }
 
+// list the NER models of the language (the default model of the language is selected)
+function loadModels() {
+    $.getJSON("/models", {lang: language}, function (response) {
+        var select = $("#modelSelect");
+        select.empty();
+        $.each(response.models, function (i, model) {
+            var option = $("<option></option>").attr("value", model.name).text(model.name);
+            if (model.name === response.default_models[language]) {
+                option.attr("selected", "selected");
+            }
+            select.append(option);
+        });
+    });
+}
+
 // Attach a submit handler to the form
 $("#askForm").submit(function (event) {
     // Stop form from submitting normally
@@ -50,12 +68,19 @@ $("#askForm").submit(function (event) {
     // Send the data using post
     var posting = $.post(url, {
         data: term,
-        lang: language
+        lang: language,
+        model: $("#modelSelect").val() || ""
     });
 
     // On Success
     posting.done(function (data) {
         $("#result").append("<pre class='chatTextRow'><code class='botChatText'>" + data + "</code></pre>");
+        // Download the JSON of this request (no file is shared between requests on the server)
+        var downloadLink = $("#DownloadJson a");
+        if (downloadLink.attr("href").indexOf("blob:") === 0) {
+            URL.revokeObjectURL(downloadLink.attr("href"));
+        }
+        downloadLink.attr("href", URL.createObjectURL(new Blob([data], {type: "application/json"})));
         $("#DownloadJson").css({ display: "block" });
         $('.modal2').removeClass('active2');
     });
@@ -0,0 +1,193 @@
+"""
+Single-file model bundle, which can be memory-mapped by several processes.
+
+Layout (little-endian):
+    - magic string (8 bytes)
+    - header length (uint64)
+    - header (utf-8 JSON) with the parameters of the model and the location
+      of every array and string table in the file
+    - arrays, aligned on ALIGNMENT bytes: component values (named as the
+      variables of the .mat files of Model.save), optional precomputed word
+      features (see export_features.py), in column-major order as in the
+      .mat files (faster products with a row vector). Arrays are float32,
+      or float16 / int8 in quantized models (see quantization.py)
+    - string tables of the mappings (id_to_word, id_to_char, id_to_tag):
+      int64 offsets of the strings followed by the utf-8 bytes of all the
+      strings, so that string i is bytes[offsets[i]:offsets[i + 1]]
+"""
+import os
+import json
+import pickle
+import struct
+from collections import OrderedDict
+import numpy as np
+import scipy.io
+
+
+MAGIC = b'LSTMCRF1'
+ALIGNMENT = 64
+MAPPINGS = ['id_to_word', 'id_to_char', 'id_to_tag']
+DTYPES = ['<f4', '<f2', '|i1']
+
+
+def is_bundle(path):
+    """
+    Whether the file at path is a model bundle.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_model(model_path):
+    """
+    Read the parameters, mappings and component values of a model saved by
+    Model.save, with the precomputed word features if they were exported.
+    """
+    with open(os.path.join(model_path, 'parameters.pkl'), 'rb') as f:
+        parameters = pickle.load(f)
+    with open(os.path.join(model_path, 'mappings.pkl'), 'rb') as f:
+        mappings = pickle.load(f)
+    arrays = OrderedDict()
+    for file_name in sorted(os.listdir(model_path)):
+        if not file_name.endswith('.mat'):
+            continue
+        param_values = scipy.io.loadmat(os.path.join(model_path, file_name))
+        for key in sorted(param_values):
+            if not key.startswith('__'):
+                arrays[key] = param_values[key].astype(np.float32)
+    features_path = os.path.join(model_path, 'word_features.npy')
+    if os.path.isfile(features_path):
+        arrays['word_features'] = np.load(features_path)
+    return (dict(parameters),
+            dict((name, mappings[name]) for name in MAPPINGS), arrays)
+
+
+def write_bundle(path, parameters, mappings, arrays):
+    """
+    Write a model bundle.
+        - parameters: dictionary of the model parameters (parameters.pkl)
+        - mappings: dictionary of the mappings (mappings.pkl), from ids
+          0 to n - 1 to strings
+        - arrays: dictionary of the arrays, stored as float32 unless they
+          are float16 or int8
+    """
+    blocks = []
+    header = OrderedDict([('parameters', parameters),
+                          ('arrays', OrderedDict()),
+                          ('strings', OrderedDict())])
+    for name, value in arrays.items():
+        value = np.asarray(value)
+        if value.dtype.str not in DTYPES:
+            value = value.astype('<f4')
+        header['arrays'][name] = {'shape': list(value.shape),
+                                  'dtype': value.dtype.str}
+        blocks.append((header['arrays'][name], value.tobytes(order='F')))
+    for name in MAPPINGS:
+        mapping = mappings[name]
+        assert sorted(mapping) == list(range(len(mapping)))
+        strings = [mapping[i].encode('utf-8') for i in range(len(mapping))]
+        offsets = np.cumsum([0] + [len(s) for s in strings]).astype('<i8')
+        header['strings'][name] = {'count': len(strings)}
+        blocks.append((header['strings'][name],
+                       offsets.tobytes() + b''.join(strings)))
+
+    # The offsets in the header depend on the length of the header
+    header_length = 0
+    while True:
+        offset = align(len(MAGIC) + 8 + header_length)
+        for entry, data in blocks:
+            entry['offset'] = offset
+            offset = align(offset + len(data))
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) <= header_length:
+            break
+        header_length = len(encoded) + ALIGNMENT
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', header_length))
+        f.write(encoded.ljust(header_length))
+        for entry, data in blocks:
+            f.write(b'\0' * (entry['offset'] - f.tell()))
+            f.write(data)
+
+
+class StringTable(object):
+    """
+    Read-only mapping from ids to the strings of a bundle (decoded on
+    access), used in place of the dictionaries of mappings.pkl.
+    """
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise KeyError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]] \
+            .tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __contains__(self, i):
+        return 0 <= i < len(self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[i] for i in self]
+
+    def items(self):
+        return [(i, self[i]) for i in self]
+
+
+class Bundle(object):
+    """
+    Memory-mapped model bundle. The arrays are read-only views of the file,
+    the pages are shared by all the processes that map the same file.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Plain array views of the mapped file (operations on np.memmap
+        # objects are slower)
+        self.data = np.asarray(np.memmap(path, dtype=np.uint8, mode='r'))
+        if self.data[:len(MAGIC)].tobytes() != MAGIC:
+            raise Exception("%s is not a model bundle" % path)
+        start = len(MAGIC) + 8
+        header_length = struct.unpack(
+            '<Q', self.data[len(MAGIC):start].tobytes()
+        )[0]
+        header = json.loads(
+            self.data[start:start + header_length].tobytes().decode('utf-8'),
+            object_pairs_hook=OrderedDict
+        )
+        self.parameters = header['parameters']
+        self.arrays = OrderedDict()
+        for name, entry in header['arrays'].items():
+            shape = tuple(entry['shape'])
+            dtype = np.dtype(entry.get('dtype', '<f4'))
+            size = int(np.prod(shape)) * dtype.itemsize
+            self.arrays[name] = self.data[entry['offset']:
+                                          entry['offset'] + size] \
+                .view(dtype).reshape(shape, order='F')
+        self.mappings = {}
+        for name, entry in header['strings'].items():
+            offset = entry['offset']
+            offsets = self.data[offset:offset + 8 * (entry['count'] + 1)] \
+                .view('<i8')
+            data_offset = offset + 8 * (entry['count'] + 1)
+            self.mappings[name] = StringTable(
+                offsets, self.data[data_offset:data_offset + offsets[-1]]
+            )
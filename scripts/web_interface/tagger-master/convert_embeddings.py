@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import optparse
+from embeddings import convert_embeddings, get_cache_paths
+
+optparser = optparse.OptionParser()
+optparser.add_option(
+    "-e", "--pre_emb", default="",
+    help="Pretrained embeddings (text file) to convert"
+)
+opts = optparser.parse_args()[0]
+
+# Check parameters validity
+assert os.path.isfile(opts.pre_emb)
+
+# Write the binary cache next to the text file
+start = time.time()
+n_vectors = convert_embeddings(opts.pre_emb)
+print('---- %i vectors written to %s in %.4fs ----' % (
+    n_vectors, " / ".join(get_cache_paths(opts.pre_emb)),
+    time.time() - start))
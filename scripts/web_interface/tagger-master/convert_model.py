@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import optparse
+from bundle import read_model, write_bundle
+
+optparser = optparse.OptionParser(
+    usage="%prog [options] model_dir [model_dir ...]",
+    description="Convert trained models (.mat files and pickles) to single "
+                "file bundles (model_dir.bundle by default)."
+)
+optparser.add_option(
+    "-o", "--output", default="",
+    help="Bundle location (for a single model)"
+)
+opts, model_paths = optparser.parse_args()
+
+# Check parameters validity
+assert model_paths, "No model to convert"
+assert not opts.output or len(model_paths) == 1
+for model_path in model_paths:
+    assert os.path.isdir(model_path)
+
+for model_path in model_paths:
+    start = time.time()
+    bundle_path = opts.output or model_path.rstrip('/\\') + '.bundle'
+    write_bundle(bundle_path, *read_model(model_path))
+    print('%s -> %s (%.1f MB) in %.4fs' % (
+        model_path, bundle_path, os.path.getsize(bundle_path) / 1e6,
+        time.time() - start))
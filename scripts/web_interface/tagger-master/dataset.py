@@ -0,0 +1,165 @@
+"""
+Binary cache of the indexed datasets of a training run (see
+prepare_dataset), so that the corpora are not parsed and indexed again by
+the next runs on the same data.
+
+A cache directory contains the mappings (mappings.pkl) and a directory per
+dataset with flat int32 arrays, memory-mapped by IndexedDataset:
+    - words.npy, caps.npy, tags.npy: word ids, capitalization features
+      and tag ids of all the words
+    - chars.npy: char ids of all the words
+    - sentence_offsets.npy: the words of sentence i are
+      [sentence_offsets[i], sentence_offsets[i + 1])
+    - char_offsets.npy: the chars of word j are
+      [char_offsets[j], char_offsets[j + 1])
+The name of the cache directory is a hash of the corpus files and of the
+parameters that change the indexing (see get_cache_path).
+"""
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import numpy as np
+
+
+CACHE_PARAMETERS = ['lower', 'zeros', 'tag_scheme', 'pre_emb', 'all_emb']
+ARRAYS = ['words', 'chars', 'caps', 'tags', 'sentence_offsets',
+          'char_offsets']
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-1 of the content of a file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_cache_path(cache_dir, paths, parameters):
+    """
+    Cache directory of the datasets of the corpus files in paths, indexed
+    with the given parameters. The pretrained embeddings (which change the
+    word mapping) are identified by their path, size and modification time
+    rather than by their content, which would take long to hash.
+    """
+    key = {
+        'files': [file_hash(path) for path in paths],
+        'parameters': [[name, parameters[name]]
+                       for name in CACHE_PARAMETERS],
+    }
+    if parameters['pre_emb']:
+        stat = os.stat(parameters['pre_emb'])
+        key['pre_emb'] = [os.path.abspath(parameters['pre_emb']),
+                          stat.st_size, int(stat.st_mtime)]
+    digest = hashlib.sha1(
+        json.dumps(key, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    return os.path.join(cache_dir, digest)
+
+
+def is_cached(cache_path):
+    return os.path.isfile(os.path.join(cache_path, 'mappings.pkl'))
+
+
+def save_dataset(path, data):
+    """
+    Write the arrays of a dataset of prepare_dataset to a directory.
+    """
+    n_words = [len(sentence['words']) for sentence in data]
+    chars = [word for sentence in data for word in sentence['chars']]
+    arrays = {
+        'words': [w for sentence in data for w in sentence['words']],
+        'chars': [c for word in chars for c in word],
+        'caps': [c for sentence in data for c in sentence['caps']],
+        'tags': [t for sentence in data for t in sentence['tags']],
+        'sentence_offsets': np.cumsum([0] + n_words),
+        'char_offsets': np.cumsum([0] + [len(word) for word in chars]),
+    }
+    os.makedirs(path)
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + '.npy'),
+                np.asarray(arrays[name], dtype=np.int32))
+
+
+def save_cache(cache_path, mappings, datasets):
+    """
+    Write the mappings (dictionary) and the datasets (dictionary of name ->
+    dataset of prepare_dataset) to a cache directory. The cache is written
+    to a temporary directory first, so that training processes on the same
+    data can create it at the same time.
+    """
+    tmp_path = '%s.tmp%i' % (cache_path, os.getpid())
+    os.makedirs(tmp_path)
+    for name, data in datasets.items():
+        save_dataset(os.path.join(tmp_path, name), data)
+    with open(os.path.join(tmp_path, 'mappings.pkl'), 'wb') as f:
+        pickle.dump(mappings, f)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Already created by another process
+        shutil.rmtree(tmp_path)
+
+
+def load_cache(cache_path, names):
+    """
+    Load the mappings and the (memory-mapped) datasets of a cache directory.
+    """
+    with open(os.path.join(cache_path, 'mappings.pkl'), 'rb') as f:
+        mappings = pickle.load(f)
+    return mappings, [IndexedDataset(os.path.join(cache_path, name))
+                      for name in names]
+
+
+class IndexedDataset(object):
+    """
+    Memory-mapped dataset of a cache directory. Sentences are read as the
+    dictionaries of prepare_dataset (without str_words).
+    """
+    def __init__(self, path):
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'),
+                                        mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.sentence_offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = self.sentence_offsets[i], self.sentence_offsets[i + 1]
+        char_offsets = (self.char_offsets[start:end + 1] -
+                        self.char_offsets[start]).tolist()
+        chars = self.chars[self.char_offsets[start]:
+                           self.char_offsets[end]].tolist()
+        return {
+            'words': self.words[start:end].tolist(),
+            'chars': [chars[char_offsets[j]:char_offsets[j + 1]]
+                      for j in range(end - start)],
+            'caps': self.caps[start:end].tolist(),
+            'tags': self.tags[start:end].tolist(),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sentence_lengths(self):
+        """
+        (number of words, length of the longest word) per sentence, as
+        utils.sentence_lengths without reading the sentences.
+        """
+        word_lengths = np.diff(self.char_offsets)
+        n_words = np.diff(self.sentence_offsets)
+        max_lengths = np.zeros(len(self), dtype=np.int64)
+        non_empty = n_words > 0
+        if non_empty.any():
+            max_lengths[non_empty] = np.maximum.reduceat(
+                word_lengths, self.sentence_offsets[:-1][non_empty]
+            )
+        return list(zip(n_words.tolist(), max_lengths.tolist()))
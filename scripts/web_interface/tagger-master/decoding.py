@@ -0,0 +1,206 @@
+"""
+Vectorized CRF decoding with NumPy, outside of the Theano graph.
+
+All functions take a batch of padded sentences:
+    - scores, tensor of shape (batch_size, max_length, n_tags) with the
+      emission scores of every word (tags_scores in Model.build)
+    - transitions, matrix of shape (n_tags + 2, n_tags + 2) as trained by
+      Model.build, where the last two classes are the begin / end states
+    - mask, matrix of shape (batch_size, max_length) with 1 for real words
+      and 0 for padding (padding at the end of the sentences)
+Scores are given in the log space. Every sentence must have at least one
+word. Padded positions of the returned paths and marginals are 0.
+
+The begin / end states are handled with the transitions from / to them,
+which gives the same paths as nn.forward with the extra begin / end steps.
+"""
+import numpy as np
+
+
+def log_sum_exp(x, axis=None):
+    """
+    Sum probabilities in the log-space.
+    """
+    xmax = x.max(axis=axis, keepdims=True)
+    return (np.log(np.exp(x - xmax).sum(axis=axis, keepdims=True)) +
+            xmax).squeeze(axis=axis)
+
+
+def split_transitions(transitions):
+    """
+    Split the transitions of Model.build into the transitions between tags,
+    from the begin state and to the end state.
+    """
+    n_tags = transitions.shape[0] - 2
+    return (transitions[:n_tags, :n_tags], transitions[n_tags, :n_tags],
+            transitions[:n_tags, n_tags + 1])
+
+
+def get_mask(scores, mask):
+    """
+    Mask of the real words, all ones if no mask is given.
+    """
+    if mask is None:
+        return np.ones(scores.shape[:2], dtype=scores.dtype)
+    return np.asarray(mask, dtype=scores.dtype)
+
+
+def viterbi(scores, transitions, mask=None):
+    """
+    Best path of every sentence.
+    Returns:
+        - paths, int32 matrix of shape (batch_size, max_length)
+        - path scores, vector of shape (batch_size,)
+    """
+    mask = get_mask(scores, mask)
+    trans, start, end = split_transitions(transitions)
+    batch_size, max_length, n_tags = scores.shape
+    identity = np.tile(np.arange(n_tags, dtype=np.int32), (batch_size, 1))
+
+    alpha = start + scores[:, 0]
+    backpointers = np.empty((max_length, batch_size, n_tags), dtype=np.int32)
+    for t in range(1, max_length):
+        candidates = alpha[:, :, None] + trans
+        best = candidates.argmax(axis=1).astype(np.int32)
+        new_alpha = candidates.max(axis=1) + scores[:, t]
+        # Padded steps keep the alpha of the last real word
+        m = mask[:, t, None]
+        alpha = np.where(m > 0, new_alpha, alpha)
+        backpointers[t] = np.where(m > 0, best, identity)
+    alpha = alpha + end
+
+    paths = np.empty((batch_size, max_length), dtype=np.int32)
+    paths[:, -1] = alpha.argmax(axis=1)
+    batch_range = np.arange(batch_size)
+    for t in range(max_length - 1, 0, -1):
+        paths[:, t - 1] = backpointers[t][batch_range, paths[:, t]]
+    paths[mask == 0] = 0
+    return paths, alpha.max(axis=1)
+
+
+def kbest_viterbi(scores, transitions, k, mask=None):
+    """
+    The k best paths of every sentence, best first. Sentences with less
+    than k possible paths get paths with a score of -inf.
+    Returns:
+        - paths, int32 tensor of shape (batch_size, k, max_length)
+        - path scores, matrix of shape (batch_size, k)
+    """
+    assert k > 0
+    mask = get_mask(scores, mask)
+    trans, start, end = split_transitions(transitions)
+    batch_size, max_length, n_tags = scores.shape
+    # A backpointer is the index (previous tag * k + previous rank)
+    identity = np.arange(n_tags * k, dtype=np.int32).reshape(n_tags, k)
+    batch_range = np.arange(batch_size)
+    tag_range = np.arange(n_tags)
+
+    alpha = np.full((batch_size, n_tags, k), -np.inf, dtype=scores.dtype)
+    alpha[:, :, 0] = start + scores[:, 0]
+    backpointers = np.empty((max_length, batch_size, n_tags, k),
+                            dtype=np.int32)
+    for t in range(1, max_length):
+        # (batch_size, tag, previous tag * k + previous rank)
+        candidates = (alpha[:, :, None, :] + trans[None, :, :, None]) \
+            .transpose(0, 2, 1, 3).reshape(batch_size, n_tags, n_tags * k)
+        best = np.argsort(-candidates, axis=2, kind='mergesort')[:, :, :k]
+        new_alpha = (candidates[batch_range[:, None, None],
+                                tag_range[None, :, None], best] +
+                     scores[:, t, :, None])
+        m = mask[:, t, None, None]
+        alpha = np.where(m > 0, new_alpha, alpha)
+        backpointers[t] = np.where(m > 0, best, identity)
+
+    final = (alpha + end[:, None]).reshape(batch_size, n_tags * k)
+    best = np.argsort(-final, axis=1, kind='mergesort')[:, :k]
+    path_scores = final[batch_range[:, None], best]
+
+    paths = np.empty((batch_size, k, max_length), dtype=np.int32)
+    tags, ranks = best // k, best % k
+    for t in range(max_length - 1, -1, -1):
+        paths[:, :, t] = tags
+        if t > 0:
+            previous = backpointers[t][batch_range[:, None], tags, ranks]
+            tags, ranks = previous // k, previous % k
+    paths *= (mask[:, None, :] > 0)
+    return paths, path_scores
+
+
+def forward_backward(scores, transitions, mask=None):
+    """
+    Forward and backward scores of every sentence (log space).
+    alpha[b, t, j] is the score of all the paths of the first t + 1 words
+    that end in j, beta[b, t, j] the score of all the paths from j at word t
+    to the end state.
+    Returns:
+        - alpha, tensor of shape (batch_size, max_length, n_tags)
+        - beta, tensor of shape (batch_size, max_length, n_tags)
+        - log partition function, vector of shape (batch_size,)
+    Scores are summed in float64 to keep the probabilities accurate.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    mask = get_mask(scores, mask)
+    trans, start, end = split_transitions(
+        np.asarray(transitions, dtype=np.float64)
+    )
+    batch_size, max_length, n_tags = scores.shape
+
+    alpha = np.empty(scores.shape, dtype=scores.dtype)
+    alpha[:, 0] = start + scores[:, 0]
+    for t in range(1, max_length):
+        new_alpha = log_sum_exp(alpha[:, t - 1, :, None] + trans, axis=1) + \
+            scores[:, t]
+        alpha[:, t] = np.where(mask[:, t, None] > 0, new_alpha, alpha[:, t - 1])
+
+    # The backward pass starts from the end state after the last real word
+    beta = np.empty(scores.shape, dtype=scores.dtype)
+    beta[:, -1] = end
+    for t in range(max_length - 2, -1, -1):
+        new_beta = log_sum_exp(
+            trans + (scores[:, t + 1] + beta[:, t + 1])[:, None, :], axis=2
+        )
+        beta[:, t] = np.where(mask[:, t + 1, None] > 0, new_beta,
+                              beta[:, t + 1])
+
+    log_z = log_sum_exp(alpha[:, -1] + end, axis=1)
+    return alpha, beta, log_z
+
+
+def marginals(scores, transitions, mask=None):
+    """
+    Probability of every tag at every word under the CRF.
+    Returns a tensor of shape (batch_size, max_length, n_tags).
+    """
+    mask = get_mask(scores, mask)
+    alpha, beta, log_z = forward_backward(scores, transitions, mask)
+    return np.exp(alpha + beta - log_z[:, None, None]) * mask[:, :, None]
+
+
+def segment_probabilities(scores, transitions, paths, segments, mask=None):
+    """
+    Probability that the words of a segment have the tags of the given path
+    (exact, from the forward and backward scores of the words around it).
+    segments contains a list of (start, end) word indexes (end included)
+    for every sentence, and the same structure with probabilities is
+    returned. The probability of a one word segment is its marginal.
+    """
+    alpha, beta, log_z = forward_backward(scores, transitions, mask)
+    trans = split_transitions(transitions)[0]
+    batch_size, max_length = paths.shape
+    batch_range = np.arange(batch_size)[:, None]
+    time_range = np.arange(max_length)[None, :]
+    # Score of the path from the first word, without the begin transition
+    prefix = np.cumsum(scores[batch_range, time_range, paths], axis=1,
+                       dtype=np.float64)
+    prefix[:, 1:] += np.cumsum(trans[paths[:, :-1], paths[:, 1:]], axis=1,
+                               dtype=np.float64)
+    alpha = alpha[batch_range, time_range, paths]
+    beta = beta[batch_range, time_range, paths]
+    probabilities = []
+    for b, sentence_segments in enumerate(segments):
+        probabilities.append([
+            float(np.exp(alpha[b, i] + prefix[b, j] - prefix[b, i] +
+                         beta[b, j] - log_z[b]))
+            for i, j in sentence_segments
+        ])
+    return probabilities
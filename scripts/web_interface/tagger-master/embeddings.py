@@ -0,0 +1,188 @@
+"""
+Streaming reader of pretrained embedding files (one word and its values
+per line, as the fastText .vec files), that only keeps the vectors of the
+words of the vocabulary.
+
+A text file can be converted once (see convert_embeddings.py) to a binary
+cache next to it, used by the next trainings instead of the text file:
+    - <pre_emb>.npy: float32 matrix of the vectors (memory-mapped, only the
+      vectors of the vocabulary are read)
+    - <pre_emb>.vocab: utf-8 words of the rows, one per line
+"""
+import os
+import io
+import re
+import numpy as np
+
+
+def candidates(word):
+    """
+    Words looked up for a word of the vocabulary, by priority: the word,
+    the lowercased word, the lowercased word with digits replaced by 0.
+    """
+    lower = word.lower()
+    return [word, lower, re.sub(r'\d', '0', lower)]
+
+
+def get_cache_paths(path):
+    return path + '.npy', path + '.vocab'
+
+
+def is_cached(path):
+    """
+    Whether the binary cache of an embedding file exists and is up to date.
+    """
+    return all(os.path.isfile(cache_path) and
+               os.path.getmtime(cache_path) >= os.path.getmtime(path)
+               for cache_path in get_cache_paths(path))
+
+
+def read_lines(path):
+    """
+    Words of a text embedding file, with their lines.
+    """
+    with io.open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            split = line.split(None, 1)
+            if split:
+                yield split[0], line
+
+
+def detect_word_dim(path):
+    """
+    Dimension of the vectors of a text embedding file: the number of values
+    of its first line with more than one value (the fastText header has
+    one, the number of vectors).
+    """
+    for _, line in read_lines(path):
+        n_values = len(line.split()) - 1
+        if n_values > 1:
+            return n_values
+    return None
+
+
+def read_valid_lines(path):
+    """
+    Words of the valid lines of a text embedding file (lines with the
+    values of a vector, see detect_word_dim), with their lines. These are
+    the lines stored in the cache.
+    """
+    word_dim = detect_word_dim(path)
+    if word_dim is None:
+        return
+    for word, line in read_lines(path):
+        if len(line.split()) == word_dim + 1:
+            yield word, line
+
+
+def iter_words(path):
+    """
+    Words of the valid lines of an embedding file, with their lines (None
+    if the words are read from the cache). The words are the same with and
+    without the cache.
+    """
+    if is_cached(path):
+        with io.open(get_cache_paths(path)[1], 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n'), None
+    else:
+        for word, line in read_valid_lines(path):
+            yield word, line
+
+
+def parse_vector(line, word_dim):
+    """
+    Values of a line of an embedding file, None if the line is invalid.
+    """
+    values = line.rstrip().split()
+    if len(values) != word_dim + 1:
+        return None
+    return np.array([float(x) for x in values[1:]]).astype(np.float32)
+
+
+def read_words(path, words=None):
+    """
+    Words of an embedding file (vectors are not parsed). If words is given,
+    only the words of words that are in the file are returned.
+    """
+    if words is not None and not isinstance(words, (set, frozenset)):
+        words = set(words)
+    return set(word for word, _ in iter_words(path)
+               if words is None or word in words)
+
+
+def load_embeddings(path, embeddings, id_to_word):
+    """
+    Initialize the rows of an embedding matrix with the pretrained vectors
+    of their words (or of the other candidates of their words). Vectors
+    are read in a single pass over the file, and only the vectors of the
+    vocabulary are parsed. As with a dictionary of the file, the last valid
+    line of a word is used.
+    Returns the number of rows initialized with the word, with the
+    lowercased word and with the lowercased word with zeros, and the number
+    of invalid lines of the vocabulary.
+    """
+    n_words, word_dim = embeddings.shape
+    # word -> [(row, priority)]
+    wanted = {}
+    for i in range(n_words):
+        for priority, candidate in enumerate(candidates(id_to_word[i])):
+            wanted.setdefault(candidate, []).append((i, priority))
+    best = np.full(n_words, len(candidates('')), dtype=np.int32)
+
+    cached = is_cached(path)
+    if cached:
+        vectors = np.load(get_cache_paths(path)[0], mmap_mode='r')
+        assert vectors.shape[1] == word_dim, \
+            "The cached embeddings of %s have %i dimensions" % (
+                path, vectors.shape[1])
+    n_invalid = 0
+    for row, (word, line) in enumerate(iter_words(path)):
+        if word not in wanted:
+            continue
+        if cached:
+            vector = vectors[row]
+        else:
+            vector = parse_vector(line, word_dim)
+            if vector is None:
+                n_invalid += 1
+                continue
+        for i, priority in wanted[word]:
+            if priority <= best[i]:
+                embeddings[i] = vector
+                best[i] = priority
+    counts = np.bincount(best, minlength=len(candidates('')) + 1)
+    return counts[0], counts[1], counts[2], n_invalid
+
+
+def convert_embeddings(path):
+    """
+    Write the binary cache of a text embedding file (invalid lines, e.g.
+    the header of fastText files, are skipped). The words of the valid
+    lines are counted in a first pass, and the vectors are written to the
+    memory-mapped matrix in a second one.
+    Returns the number of vectors.
+    """
+    word_dim = detect_word_dim(path)
+    assert word_dim, "No vectors in %s" % path
+    n_vectors = sum(1 for _ in read_valid_lines(path))
+
+    matrix_path, vocab_path = get_cache_paths(path)
+    for cache_path in [matrix_path, vocab_path]:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+    vectors = np.lib.format.open_memmap(matrix_path + '.tmp', mode='w+',
+                                        dtype=np.float32,
+                                        shape=(n_vectors, word_dim))
+    row = 0
+    with io.open(vocab_path + '.tmp', 'w', encoding='utf-8') as f:
+        for word, line in read_valid_lines(path):
+            vectors[row] = parse_vector(line, word_dim)
+            f.write(word + u'\n')
+            row += 1
+    vectors.flush()
+    del vectors
+    # The vocabulary is written last, the cache is complete when it exists
+    os.rename(matrix_path + '.tmp', matrix_path)
+    os.rename(vocab_path + '.tmp', vocab_path)
+    return n_vectors
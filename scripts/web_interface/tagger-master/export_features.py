@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import optparse
+from numpy_model import NumpyModel
+
+optparser = optparse.OptionParser()
+optparser.add_option(
+    "-m", "--model", default="",
+    help="Model location"
+)
+optparser.add_option(
+    "-c", "--chunk_size", default="1000",
+    type='int', help="Number of words computed at once"
+)
+opts = optparser.parse_args()[0]
+
+# Check parameters validity
+assert os.path.isdir(opts.model)
+assert opts.chunk_size > 0
+
+# Load existing model
+print("Loading model...")
+model = NumpyModel(model_path=opts.model)
+assert model.parameters['word_dim'], "The model has no word embeddings"
+model.reload()
+
+# Precompute the word features of the vocabulary
+start = time.time()
+features_path = model.export_word_features(chunk_size=opts.chunk_size)
+print('---- %i word features exported to %s in %.4fs ----' % (
+    len(model.id_to_word), features_path, time.time() - start))
@@ -1,8 +1,8 @@
 import os
-import re
 import codecs
 from utils import create_dico, create_mapping, zero_digits
 from utils import iob2, iob_iobes
+from embeddings import candidates, read_words
 
 
 def load_sentences(path, lower, zeros):
@@ -163,27 +163,21 @@ def augment_with_pretrained(dictionary, ext_emb_path, words):
     print('Loading pretrained embeddings from %s...' % ext_emb_path)
     assert os.path.isfile(ext_emb_path)
 
-    # Load pretrained embeddings from file
-    pretrained = set([
-        line.rstrip().split()[0].strip()
-        for line in codecs.open(ext_emb_path, 'r', 'utf-8')
-        if len(ext_emb_path) > 0
-    ])
-
     # We either add every word in the pretrained file,
     # or only words given in the `words` list to which
-    # we can assign a pretrained embedding
+    # we can assign a pretrained embedding.
+    # Only the words are read (see embeddings.py), in a single pass.
     if words is None:
-        for word in pretrained:
+        for word in read_words(ext_emb_path):
             if word not in dictionary:
                 dictionary[word] = 0
     else:
+        pretrained = read_words(ext_emb_path, set(
+            candidate for word in words for candidate in candidates(word)
+        ))
         for word in words:
-            if any(x in pretrained for x in [
-                word,
-                word.lower(),
-                re.sub('\d', '0', word.lower())
-            ]) and word not in dictionary:
+            if any(x in pretrained for x in candidates(word)) \
+                    and word not in dictionary:
                 dictionary[word] = 0
 
     word_to_id, id_to_word = create_mapping(dictionary)
@@ -1,14 +1,16 @@
 import os
-import re
 import numpy as np
 import scipy.io
 import theano
 import theano.tensor as T
-import codecs
 import pickle
 
 from utils import shared, set_values, get_name
+from bundle import Bundle, is_bundle
+from quantization import SCALE_SUFFIX, dequantize
+from embeddings import load_embeddings
 from nn import HiddenLayer, EmbeddingLayer, DropoutLayer, LSTM, forward
+from nn import forward_batch
 from optimization import Optimization
 
 
@@ -19,8 +21,10 @@ class Model(object):
     def __init__(self, parameters=None, models_path=None, model_path=None):
         """
         Initialize the model. We either provide the parameters and a path where
-        we store the models, or the location of a trained model.
+        we store the models, or the location of a trained model (directory
+        or bundle, see bundle.py).
         """
+        self.bundle = None
         if model_path is None:
             assert parameters and models_path
             # Create a name based on the parameters
@@ -41,11 +45,16 @@ class Model(object):
             assert parameters is None and models_path is None
             # Model location
             self.model_path = model_path
-            self.parameters_path = os.path.join(model_path, 'parameters.pkl')
-            self.mappings_path = os.path.join(model_path, 'mappings.pkl')
-            # Load the parameters and the mappings from disk
-            with open(self.parameters_path, 'rb') as f:
-                self.parameters = pickle.load(f)
+            if is_bundle(model_path):
+                self.bundle = Bundle(model_path)
+                self.parameters = self.bundle.parameters
+            else:
+                self.parameters_path = os.path.join(model_path,
+                                                    'parameters.pkl')
+                self.mappings_path = os.path.join(model_path, 'mappings.pkl')
+                # Load the parameters and the mappings from disk
+                with open(self.parameters_path, 'rb') as f:
+                    self.parameters = pickle.load(f)
             self.reload_mappings()
         self.components = {}
 
@@ -68,8 +77,11 @@ class Model(object):
         """
         Load mappings from disk.
         """
-        with open(self.mappings_path, 'rb') as f:
-            mappings = pickle.load(f)
+        if self.bundle is not None:
+            mappings = self.bundle.mappings
+        else:
+            with open(self.mappings_path, 'rb') as f:
+                mappings = pickle.load(f)
         self.id_to_word = mappings['id_to_word']
         self.id_to_char = mappings['id_to_char']
         self.id_to_tag = mappings['id_to_tag']
@@ -87,6 +99,7 @@ class Model(object):
         """
         Write components values to disk.
         """
+        assert self.bundle is None, "Bundles are converted from saved models"
         for name, param in list(self.components.items()):
             param_path = os.path.join(self.model_path, "%s.mat" % name)
             if hasattr(param, 'params'):
@@ -94,14 +107,27 @@ class Model(object):
             else:
                 param_values = {name: param.get_value()}
             scipy.io.savemat(param_path, param_values)
+        # Precomputed word features of the old values are outdated
+        features_path = os.path.join(self.model_path, 'word_features.npy')
+        if os.path.isfile(features_path):
+            os.remove(features_path)
 
     def reload(self):
         """
         Load components values from disk.
         """
         for name, param in list(self.components.items()):
-            param_path = os.path.join(self.model_path, "%s.mat" % name)
-            param_values = scipy.io.loadmat(param_path)
+            if self.bundle is not None:
+                # Quantized values are converted to float32
+                param_values = dict(
+                    (key, dequantize(value, self.bundle.arrays.get(
+                        key + SCALE_SUFFIX)))
+                    for key, value in self.bundle.arrays.items()
+                    if key == name or key.startswith(name + '__')
+                )
+            else:
+                param_path = os.path.join(self.model_path, "%s.mat" % name)
+                param_values = scipy.io.loadmat(param_path)
             if hasattr(param, 'params'):
                 for p in param.params:
                     set_values(p.name, p, param_values[p.name])
@@ -121,10 +147,16 @@ class Model(object):
               crf,
               cap_dim,
               training=True,
+              batch=False,
               **kwargs
               ):
         """
         Build the network.
+        If batch is set, the training and evaluation functions take padded
+        inputs for several sentences at once (see utils.create_batch_input).
+        The training cost is averaged over the sentences of a batch, and the
+        evaluation function returns a matrix with the best tag sequence of
+        every sentence.
         """
         # Training parameters
         n_words = len(self.id_to_word)
@@ -137,16 +169,28 @@ class Model(object):
 
         # Network variables
         is_train = T.iscalar('is_train')
-        word_ids = T.ivector(name='word_ids')
+        if batch:
+            # Padded sentences of shape (batch_size, max_length); the chars
+            # of all the (padded) words of the batch are stacked together
+            word_ids = T.imatrix(name='word_ids')
+            word_mask = T.fmatrix(name='word_mask')
+        else:
+            word_ids = T.ivector(name='word_ids')
         char_for_ids = T.imatrix(name='char_for_ids')
         char_rev_ids = T.imatrix(name='char_rev_ids')
         char_pos_ids = T.ivector(name='char_pos_ids')
-        tag_ids = T.ivector(name='tag_ids')
+        tag_ids = T.imatrix(name='tag_ids') if batch else \
+            T.ivector(name='tag_ids')
         if cap_dim:
-            cap_ids = T.ivector(name='cap_ids')
+            cap_ids = T.imatrix(name='cap_ids') if batch else \
+                T.ivector(name='cap_ids')
 
         # Sentence length
-        s_len = (word_ids if word_dim else char_pos_ids).shape[0]
+        if batch:
+            b_size = word_mask.shape[0]
+            s_len = word_mask.shape[1]
+        else:
+            s_len = (word_ids if word_dim else char_pos_ids).shape[0]
 
         # Final input (all word features)
         input_dim = 0
@@ -164,37 +208,14 @@ class Model(object):
             if pre_emb and training:
                 new_weights = word_layer.embeddings.get_value()
                 print('Loading pretrained embeddings from %s...' % pre_emb)
-                pretrained = {}
-                emb_invalid = 0
-                for i, line in enumerate(codecs.open(pre_emb, 'r', 'utf-8')):
-                    line = line.rstrip().split()
-                    if len(line) == word_dim + 1:
-                        pretrained[line[0]] = np.array(
-                            [float(x) for x in line[1:]]
-                        ).astype(np.float32)
-                    else:
-                        emb_invalid += 1
+                # Only the vectors of the vocabulary are kept (see
+                # embeddings.py), they are written to the new weights
+                c_found, c_lower, c_zeros, emb_invalid = load_embeddings(
+                    pre_emb, new_weights, self.id_to_word
+                )
                 if emb_invalid > 0:
                     print('WARNING: %i invalid lines' % emb_invalid)
-                c_found = 0
-                c_lower = 0
-                c_zeros = 0
-                # Lookup table initialization
-                for i in range(n_words):
-                    word = self.id_to_word[i]
-                    if word in pretrained:
-                        new_weights[i] = pretrained[word]
-                        c_found += 1
-                    elif word.lower() in pretrained:
-                        new_weights[i] = pretrained[word.lower()]
-                        c_lower += 1
-                    elif re.sub('\d', '0', word.lower()) in pretrained:
-                        new_weights[i] = pretrained[
-                            re.sub('\d', '0', word.lower())
-                        ]
-                        c_zeros += 1
                 word_layer.embeddings.set_value(new_weights)
-                print('Loaded %i pretrained embeddings.' % len(pretrained))
                 print(('%i / %i (%.4f%%) words have been initialized with '
                        'pretrained embeddings.') % (
                             c_found + c_lower + c_zeros, n_words,
@@ -220,12 +241,20 @@ class Model(object):
             char_lstm_for.link(char_layer.link(char_for_ids))
             char_lstm_rev.link(char_layer.link(char_rev_ids))
 
+            n_char_words = char_pos_ids.shape[0]
             char_for_output = char_lstm_for.h.dimshuffle((1, 0, 2))[
-                T.arange(s_len), char_pos_ids
+                T.arange(n_char_words), char_pos_ids
             ]
             char_rev_output = char_lstm_rev.h.dimshuffle((1, 0, 2))[
-                T.arange(s_len), char_pos_ids
+                T.arange(n_char_words), char_pos_ids
             ]
+            if batch:
+                char_for_output = char_for_output.reshape(
+                    (b_size, s_len, char_lstm_dim)
+                )
+                char_rev_output = char_rev_output.reshape(
+                    (b_size, s_len, char_lstm_dim)
+                )
 
             inputs.append(char_for_output)
             if char_bidirect:
@@ -241,7 +270,9 @@ class Model(object):
             inputs.append(cap_layer.link(cap_ids))
 
         # Prepare final input
-        inputs = T.concatenate(inputs, axis=1) if len(inputs) != 1 else inputs[0]
+        feature_axis = 2 if batch else 1
+        inputs = T.concatenate(inputs, axis=feature_axis) \
+            if len(inputs) != 1 else inputs[0]
 
         #
         # Dropout on final input
@@ -257,14 +288,22 @@ class Model(object):
                              name='word_lstm_for')
         word_lstm_rev = LSTM(input_dim, word_lstm_dim, with_batch=False,
                              name='word_lstm_rev')
-        word_lstm_for.link(inputs)
-        word_lstm_rev.link(inputs[::-1, :])
-        word_for_output = word_lstm_for.h
-        word_rev_output = word_lstm_rev.h[::-1, :]
+        if batch:
+            # Padding is at the end of the sentences, so the reverse LSTM
+            # skips it at the beginning and starts from h_0 on the last word
+            word_lstm_for.link(inputs, mask=word_mask)
+            word_lstm_rev.link(inputs[:, ::-1, :], mask=word_mask[:, ::-1])
+            word_for_output = word_lstm_for.h.dimshuffle((1, 0, 2))
+            word_rev_output = word_lstm_rev.h[::-1].dimshuffle((1, 0, 2))
+        else:
+            word_lstm_for.link(inputs)
+            word_lstm_rev.link(inputs[::-1, :])
+            word_for_output = word_lstm_for.h
+            word_rev_output = word_lstm_rev.h[::-1, :]
         if word_bidirect:
             final_output = T.concatenate(
                 [word_for_output, word_rev_output],
-                axis=1
+                axis=feature_axis
             )
             tanh_layer = HiddenLayer(2 * word_lstm_dim, word_lstm_dim,
                                      name='tanh_layer', activation='tanh')
@@ -275,11 +314,25 @@ class Model(object):
         # Sentence to Named Entity tags - Score
         final_layer = HiddenLayer(word_lstm_dim, n_tags, name='final_layer',
                                   activation=(None if crf else 'softmax'))
-        tags_scores = final_layer.link(final_output)
+        if batch:
+            tags_scores = final_layer.link(
+                final_output.reshape((b_size * s_len, word_lstm_dim))
+            ).reshape((b_size, s_len, n_tags))
+        else:
+            tags_scores = final_layer.link(final_output)
 
         # No CRF
         if not crf:
-            cost = T.nnet.categorical_crossentropy(tags_scores, tag_ids).mean()
+            if batch:
+                # Mean over the words of each sentence, then over the batch
+                cost = T.nnet.categorical_crossentropy(
+                    tags_scores.reshape((b_size * s_len, n_tags)),
+                    tag_ids.flatten()
+                ).reshape((b_size, s_len))
+                cost = ((cost * word_mask).sum(axis=1) /
+                        word_mask.sum(axis=1)).mean()
+            else:
+                cost = T.nnet.categorical_crossentropy(tags_scores, tag_ids).mean()
         # CRF
         else:
             transitions = shared((n_tags + 2, n_tags + 2), 'transitions')
@@ -287,6 +340,40 @@ class Model(object):
             small = -1000
             b_s = np.array([[small] * n_tags + [0, small]]).astype(np.float32)
             e_s = np.array([[small] * n_tags + [small, 0]]).astype(np.float32)
+
+        if crf and batch:
+            observations = T.concatenate(
+                [tags_scores, small * T.ones((b_size, s_len, 2))],
+                axis=2
+            )
+            observations = T.concatenate(
+                [T.ones((b_size, 1, 1)) * b_s, observations,
+                 T.ones((b_size, 1, 1)) * e_s],
+                axis=1
+            )
+
+            if training:
+                # Score from tags (real words only)
+                real_path_score = (tags_scores.reshape(
+                    (b_size * s_len, n_tags)
+                )[T.arange(b_size * s_len), tag_ids.flatten()].reshape(
+                    (b_size, s_len)
+                ) * word_mask).sum(axis=1)
+
+                # Score from transitions: begin -> first word, between real
+                # words, and last real word -> end
+                lengths = T.cast(word_mask.sum(axis=1), 'int32')
+                last_tag_ids = tag_ids[T.arange(b_size), lengths - 1]
+                real_path_score += transitions[n_tags, tag_ids[:, 0]]
+                real_path_score += (transitions[
+                    tag_ids[:, :-1].flatten(), tag_ids[:, 1:].flatten()
+                ].reshape((b_size, s_len - 1)) * word_mask[:, 1:]).sum(axis=1)
+                real_path_score += transitions[last_tag_ids, n_tags + 1]
+
+                all_paths_scores = forward_batch(observations, transitions,
+                                                 word_mask)
+                cost = - (real_path_score - all_paths_scores).mean()
+        elif crf:
             observations = T.concatenate(
                 [tags_scores, small * T.ones((s_len, 2))],
                 axis=1
@@ -352,6 +439,8 @@ class Model(object):
             eval_inputs.append(char_pos_ids)
         if cap_dim:
             eval_inputs.append(cap_ids)
+        if batch:
+            eval_inputs.append(word_mask)
         train_inputs = eval_inputs + [tag_ids]
 
         # Parse optimization method parameters
@@ -380,7 +469,15 @@ class Model(object):
             f_train = None
 
         # Compile evaluation function
-        if not crf:
+        if batch:
+            f_eval = theano.function(
+                inputs=eval_inputs,
+                outputs=(forward_batch(observations, transitions, word_mask,
+                                       viterbi=True, return_best_sequence=True)
+                         if crf else tags_scores.argmax(axis=2)),
+                givens=({is_train: np.cast['int32'](0)} if dropout else {})
+            )
+        elif not crf:
             f_eval = theano.function(
                 inputs=eval_inputs,
                 outputs=tags_scores,
@@ -394,4 +491,30 @@ class Model(object):
                 givens=({is_train: np.cast['int32'](0)} if dropout else {})
             )
 
+        # Tag scores of the words, compiled on first use (see get_f_scores)
+        self.f_scores = None
+        self.scores_graph = (
+            eval_inputs, tags_scores,
+            {is_train: np.cast['int32'](0)} if dropout else {}
+        )
+
         return f_train, f_eval
+
+    def get_f_scores(self):
+        """
+        Return a function with the same inputs as the evaluation function
+        of the last build, which returns the tag scores of the words
+        (emission scores with a CRF, tag probabilities otherwise).
+        """
+        if self.f_scores is None:
+            inputs, tags_scores, givens = self.scores_graph
+            self.f_scores = theano.function(inputs=inputs,
+                                            outputs=tags_scores,
+                                            givens=givens)
+        return self.f_scores
+
+    def get_transitions(self):
+        """
+        Values of the CRF transitions, with the begin / end classes.
+        """
+        return self.components['transitions'].get_value()
@@ -170,11 +170,14 @@ class LSTM(object):
                        self.b_i, self.b_c, self.b_o,  # self.b_f,
                        self.c_0, self.h_0]
 
-    def link(self, input):
+    def link(self, input, mask=None):
         """
         Propagate the input through the network and return the last hidden
         vector. The whole sequence is also accessible via self.h, but
         where self.h of shape (sequence_length, batch_size, output_dim)
+        If a mask of shape (batch_size, sequence_length) is given, the input
+        is treated as a batch and padded steps (mask = 0) carry the previous
+        cell and hidden states over unchanged.
         """
         def recurrence(x_t, c_tm1, h_tm1):
             i_t = T.nnet.sigmoid(T.dot(x_t, self.w_xi) +
@@ -194,8 +197,28 @@ class LSTM(object):
             h_t = o_t * T.tanh(c_t)
             return [c_t, h_t]
 
+        def masked_recurrence(x_t, m_t, c_tm1, h_tm1):
+            c_t, h_t = recurrence(x_t, c_tm1, h_tm1)
+            m_t = m_t.dimshuffle(0, 'x')
+            c_t = m_t * c_t + (1 - m_t) * c_tm1
+            h_t = m_t * h_t + (1 - m_t) * h_tm1
+            return [c_t, h_t]
+
         # If we use batches, we have to permute the first and second dimension.
-        if self.with_batch:
+        if mask is not None:
+            self.input = input.dimshuffle(1, 0, 2)
+            outputs_info = [T.alloc(x, self.input.shape[1], self.hidden_dim)
+                            for x in [self.c_0, self.h_0]]
+            [_, h], _ = theano.scan(
+                fn=masked_recurrence,
+                sequences=[self.input, mask.dimshuffle(1, 0)],
+                outputs_info=outputs_info,
+                n_steps=self.input.shape[0]
+            )
+            self.h = h
+            self.output = h[-1]
+            return self.output
+        elif self.with_batch:
             self.input = input.dimshuffle(1, 0, 2)
             outputs_info = [T.alloc(x, self.input.shape[1], self.hidden_dim)
                             for x in [self.c_0, self.h_0]]
@@ -280,3 +303,69 @@ def forward(observations, transitions, viterbi=False,
             return alpha[-1].max(axis=0)
         else:
             return log_sum_exp(alpha[-1], axis=0)
+
+
+def forward_batch(observations, transitions, mask, viterbi=False,
+                  return_best_sequence=False):
+    """
+    Batched version of forward for padded sentences.
+    Takes as input:
+        - observations, tensor of shape (batch_size, n_steps, n_classes)
+          where the first and the last step hold the begin / end scores
+        - transitions, matrix of shape (n_classes, n_classes)
+        - mask, matrix of shape (batch_size, n_steps - 2) with 1 for real
+          words and 0 for padding
+    Padded steps keep the alpha of the last real word (and point back to
+    the same class), so the end transition is applied after the last word
+    of every sentence. Returns one of these 2 values:
+        - a vector of shape (batch_size,) with the final probability of
+          each sentence (sum of all paths, or best path with Viterbi)
+        - a matrix of shape (batch_size, n_steps - 2) with the best tag
+          sequence of each sentence (padded positions are garbage)
+    """
+    assert not return_best_sequence or viterbi
+    batch_range = T.arange(observations.shape[0])
+
+    def recurrence(obs, m, previous, transitions):
+        scores = (previous.dimshuffle(0, 1, 'x') + obs.dimshuffle(0, 'x', 1) +
+                  transitions.dimshuffle('x', 0, 1))
+        m = m.dimshuffle(0, 'x')
+        if viterbi:
+            out = m * scores.max(axis=1) + (1 - m) * previous
+            if return_best_sequence:
+                identity = T.arange(obs.shape[1]).dimshuffle('x', 0)
+                out2 = T.cast(scores.argmax(axis=1), 'int32')
+                out2 = T.cast(m * out2 + (1 - m) * identity, 'int32')
+                return out, out2
+            else:
+                return out
+        else:
+            return m * log_sum_exp(scores, axis=1) + (1 - m) * previous
+
+    # Inner steps (words) are masked, the end step is applied to everybody
+    observations = observations.dimshuffle(1, 0, 2)
+    steps_mask = T.concatenate(
+        [mask.dimshuffle(1, 0), T.ones((1, mask.shape[0]))], axis=0
+    )
+    alpha, _ = theano.scan(
+        fn=recurrence,
+        outputs_info=((observations[0], None) if return_best_sequence
+                      else observations[0]),
+        sequences=[observations[1:], steps_mask],
+        non_sequences=transitions
+    )
+
+    if return_best_sequence:
+        # Follow the backpointers from the end step down to the first word
+        alpha, backpointers = alpha
+        last = T.cast(T.argmax(alpha[-1], axis=1), 'int32')
+        sequence, _ = theano.scan(
+            fn=lambda beta_i, previous: beta_i[batch_range, previous],
+            outputs_info=last,
+            sequences=backpointers[::-1]
+        )
+        return sequence[::-1][1:].dimshuffle(1, 0)
+    elif viterbi:
+        return alpha[-1].max(axis=1)
+    else:
+        return log_sum_exp(alpha[-1], axis=1)
@@ -0,0 +1,512 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+import scipy.io
+from bundle import Bundle, is_bundle
+from decoding import viterbi
+from quantization import SCALE_SUFFIX, dequantize
+from loader import prepare_sentence
+from utils import pad_word_chars
+
+
+# Parameters that are vectors in the network but saved as (1, n) matrices
+VECTOR_PARAMS = ['b_i', 'b_c', 'b_o', 'c_0', 'h_0', 'bias']
+
+# Precomputed features of the vocabulary (see export_features.py)
+WORD_FEATURES_FILE = 'word_features.npy'
+
+
+def sigmoid(x):
+    """
+    Logistic function.
+    """
+    return 1. / (1. + np.exp(-x))
+
+
+def embedding_layer(params, input):
+    """
+    Return the embeddings of the given indexes (see nn.EmbeddingLayer).
+    Quantized embeddings are converted to float32 after the lookup.
+    """
+    embeddings = params['embeddings'][input]
+    if embeddings.dtype != np.float32:
+        scale = params.get('embeddings' + SCALE_SUFFIX)
+        embeddings = dequantize(embeddings,
+                                scale[input] if scale is not None else None)
+    return embeddings
+
+
+def hidden_layer(params, input, activation=None):
+    """
+    Affine transformation followed by an optional activation
+    (see nn.HiddenLayer). The right most dimension of the input
+    has to be equal to input_dim.
+    """
+    output = np.dot(input, params['weights']) + params['bias']
+    if activation == 'tanh':
+        output = np.tanh(output)
+    elif activation == 'sigmoid':
+        output = sigmoid(output)
+    elif activation == 'softmax':
+        output = np.exp(output - output.max(axis=-1, keepdims=True))
+        output /= output.sum(axis=-1, keepdims=True)
+    elif activation is not None:
+        raise Exception("Unknown activation function: %s" % activation)
+    return output
+
+
+def lstm(params, input, mask=None):
+    """
+    LSTM with coupled input and forget gates (see nn.LSTM).
+    Input: tensor3 of dimension (batch_size, sequence_length, input_dim)
+    Output: tensor3 of dimension (batch_size, sequence_length, hidden_dim)
+    with the hidden vectors of every step. If a mask of dimension
+    (batch_size, sequence_length) is given, padded steps carry the
+    previous cell and hidden states over unchanged.
+    """
+    batch_size, n_steps = input.shape[:2]
+    hidden_dim = params['h_0'].shape[0]
+    # Input projections do not depend on the previous step
+    x_i = np.dot(input, params['w_xi']) + params['b_i']
+    x_c = np.dot(input, params['w_xc']) + params['b_c']
+    x_o = np.dot(input, params['w_xo']) + params['b_o']
+    c_tm1 = np.tile(params['c_0'], (batch_size, 1))
+    h_tm1 = np.tile(params['h_0'], (batch_size, 1))
+    h = np.empty((batch_size, n_steps, hidden_dim), dtype=np.float32)
+    for t in range(n_steps):
+        i_t = sigmoid(x_i[:, t] + np.dot(h_tm1, params['w_hi']) +
+                      np.dot(c_tm1, params['w_ci']))
+        c_t = ((1 - i_t) * c_tm1 + i_t * np.tanh(
+            x_c[:, t] + np.dot(h_tm1, params['w_hc'])))
+        o_t = sigmoid(x_o[:, t] + np.dot(h_tm1, params['w_ho']) +
+                      np.dot(c_t, params['w_co']))
+        h_t = o_t * np.tanh(c_t)
+        if mask is not None:
+            m_t = mask[:, t, None]
+            c_t = m_t * c_t + (1 - m_t) * c_tm1
+            h_t = m_t * h_t + (1 - m_t) * h_tm1
+        h[:, t] = h_t
+        c_tm1, h_tm1 = c_t, h_t
+    return h
+
+
+class LRUCache(object):
+    """
+    Dictionary of at most max_size items, where the least recently used
+    items are removed first. It can be shared by several threads.
+    """
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        """
+        Return the value of a key, or None if it is not in the cache.
+        """
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        """
+        Add an item, and remove the least recently used items if the
+        cache is full.
+        """
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+class NumpyModel(object):
+    """
+    Network architecture for tagging, without Theano.
+    The component values are read from the same files as Model.reload,
+    and the forward pass mirrors the layers of nn.py.
+    """
+    def __init__(self, model_path, char_cache_size=0):
+        """
+        Initialize the model from the location of a trained model, or
+        from a model bundle (see bundle.py).
+        The character features of the last char_cache_size distinct words
+        are kept in memory (0 for no cache).
+        """
+        self.model_path = model_path
+        self.bundle = Bundle(model_path) if is_bundle(model_path) else None
+        if self.bundle is not None:
+            self.parameters = self.bundle.parameters
+        else:
+            self.parameters_path = os.path.join(model_path, 'parameters.pkl')
+            self.mappings_path = os.path.join(model_path, 'mappings.pkl')
+            # Load the parameters and the mappings from disk
+            with open(self.parameters_path, 'rb') as f:
+                self.parameters = pickle.load(f)
+        self.reload_mappings()
+        self.components = {}
+        self.char_cache = LRUCache(char_cache_size) if char_cache_size else None
+        self.word_features = None
+
+    def reload_mappings(self):
+        """
+        Load mappings from disk.
+        """
+        if self.bundle is not None:
+            mappings = self.bundle.mappings
+        else:
+            with open(self.mappings_path, 'rb') as f:
+                mappings = pickle.load(f)
+        self.id_to_word = mappings['id_to_word']
+        self.id_to_char = mappings['id_to_char']
+        self.id_to_tag = mappings['id_to_tag']
+
+    def component_names(self):
+        """
+        Names of the components used by the network, in the same
+        way as Model.build adds them.
+        """
+        p = self.parameters
+        names = []
+        if p['word_dim']:
+            names.append('word_layer')
+        if p['char_dim']:
+            names.extend(['char_layer', 'char_lstm_for'])
+            if p['char_bidirect']:
+                names.append('char_lstm_rev')
+        names.append('word_lstm_for')
+        if p['word_bidirect']:
+            names.extend(['word_lstm_rev', 'tanh_layer'])
+        if p['cap_dim']:
+            names.append('cap_layer')
+        names.append('final_layer')
+        if p['crf']:
+            names.append('transitions')
+        return names
+
+    def reload(self):
+        """
+        Load components values from disk. The values of a bundle are not
+        copied to memory. Quantized embeddings stay quantized, the other
+        quantized values are converted to float32.
+        """
+        for name in self.component_names():
+            if self.bundle is not None:
+                param_values = dict(
+                    (key, value) for key, value in self.bundle.arrays.items()
+                    if key == name or key.startswith(name + '__')
+                )
+            else:
+                param_path = os.path.join(self.model_path, "%s.mat" % name)
+                param_values = scipy.io.loadmat(param_path)
+            values = {}
+            for key, value in param_values.items():
+                if key.startswith('__') or key.endswith(SCALE_SUFFIX):
+                    continue
+                short_name = key[len(name) + 2:] if key != name else key
+                scale = param_values.get(key + SCALE_SUFFIX)
+                if short_name == 'embeddings' and value.dtype != np.float32:
+                    if scale is not None:
+                        values[short_name + SCALE_SUFFIX] = scale
+                elif scale is not None or value.dtype != np.float32:
+                    value = dequantize(value, scale)
+                else:
+                    value = value.astype(np.float32, copy=False)
+                if short_name in VECTOR_PARAMS:
+                    value = value.reshape(-1)
+                values[short_name] = value
+            self.components[name] = values
+        self.load_word_features()
+
+    def load_word_features(self):
+        """
+        Map the precomputed features of the vocabulary (see
+        export_word_features) if they were exported for this model.
+        """
+        self.word_features = None
+        if self.bundle is not None:
+            self.word_features = self.bundle.arrays.get('word_features')
+        else:
+            features_path = os.path.join(self.model_path, WORD_FEATURES_FILE)
+            if os.path.isfile(features_path):
+                self.word_features = np.load(features_path, mmap_mode='r')
+        if self.word_features is None:
+            return
+        # The features of a word depend on its characters and capitalization,
+        # which can differ from the ones of the vocabulary word (lowercasing)
+        vocabulary = self.prepare_vocabulary()
+        # Words without known characters have a fixed character feature
+        # (see compute_char_features), and are precomputed as the others
+        self.vocab_char_ids, _, self.vocab_char_pos = [
+            np.array(x, dtype=np.int32)
+            for x in pad_word_chars(vocabulary['chars'])
+        ]
+        self.vocab_cap_ids = np.array(vocabulary['caps'], dtype=np.int32)
+
+    def prepare_vocabulary(self):
+        """
+        Inputs of the words of the vocabulary, in the format of
+        loader.prepare_sentence.
+        """
+        char_to_id = dict((v, k) for k, v in self.id_to_char.items())
+        words = [self.id_to_word[i] for i in range(len(self.id_to_word))]
+        return prepare_sentence(words, dict((w, i) for i, w in
+                                            enumerate(words)),
+                                char_to_id, lower=self.parameters['lower'])
+
+    def export_word_features(self, chunk_size=1000):
+        """
+        Compute the features of all the words of the vocabulary, and store
+        them next to the mappings in a float32 matrix (.npy), which is
+        memory-mapped by the next reload.
+        """
+        assert self.parameters['word_dim']
+        assert self.bundle is None, "Export the features before bundling"
+        vocabulary = self.prepare_vocabulary()
+        features = []
+        for i in range(0, len(vocabulary['words']), chunk_size):
+            char_for, char_rev, char_pos = pad_word_chars(
+                vocabulary['chars'][i:i + chunk_size]
+            )
+            features.append(self.compute_features(
+                word_ids=np.array(vocabulary['words'][i:i + chunk_size]),
+                char_for_ids=np.array(char_for, dtype=np.int32),
+                char_rev_ids=np.array(char_rev, dtype=np.int32),
+                char_pos_ids=np.array(char_pos, dtype=np.int32),
+                cap_ids=np.array(vocabulary['caps'][i:i + chunk_size])
+            ))
+        features = np.concatenate(features).astype(np.float32)
+        features_path = os.path.join(self.model_path, WORD_FEATURES_FILE)
+        np.save(features_path, features)
+        return features_path
+
+    def is_precomputed(self, word_ids, char_for_ids=None, char_pos_ids=None,
+                       cap_ids=None):
+        """
+        Whether the precomputed features of the word ids can be used for
+        the given words, i.e. whether the words have the same characters
+        and capitalization as the words of the vocabulary.
+        """
+        p = self.parameters
+        known = np.ones(word_ids.shape, dtype=bool)
+        if p['char_dim']:
+            known &= self.vocab_char_pos[word_ids] == char_pos_ids
+            # Characters after the last one of both words are padding
+            width = min(char_for_ids.shape[1], self.vocab_char_ids.shape[1])
+            known &= (self.vocab_char_ids[word_ids, :width] ==
+                      char_for_ids[:, :width]).all(axis=1)
+        if p['cap_dim']:
+            known &= self.vocab_cap_ids[word_ids] == cap_ids
+        return known
+
+    def compute_features(self, word_ids=None, char_for_ids=None,
+                         char_rev_ids=None, char_pos_ids=None, cap_ids=None):
+        """
+        Final input of the word LSTMs (all word features) of a list of
+        words, of shape (n_words, input_dim).
+        """
+        p = self.parameters
+        c = self.components
+        inputs = []
+        if p['word_dim']:
+            inputs.append(embedding_layer(c['word_layer'], word_ids))
+        if p['char_dim']:
+            inputs.append(self.get_char_features(char_for_ids, char_rev_ids,
+                                                 char_pos_ids))
+        if p['cap_dim']:
+            inputs.append(embedding_layer(c['cap_layer'], cap_ids))
+        inputs = np.concatenate(inputs, axis=-1)
+        # Dropout on final input (test mode)
+        if p['dropout']:
+            inputs = (1 - p['dropout']) * inputs
+        return inputs
+
+    def get_features(self, shape, **kwargs):
+        """
+        Final input of the word LSTMs (all word features) for a batch of
+        sentences of shape (batch_size, max_length). The features of the
+        words of the vocabulary are read from the precomputed features if
+        they were exported, and only the other words are computed.
+        """
+        # All the features are computed word by word
+        for k in ['word_ids', 'cap_ids']:
+            if kwargs.get(k) is not None:
+                kwargs[k] = kwargs[k].reshape(-1)
+        if self.word_features is None:
+            return self.compute_features(**kwargs).reshape(shape + (-1,))
+        word_ids = kwargs['word_ids']
+        known = self.is_precomputed(word_ids, kwargs.get('char_for_ids'),
+                                    kwargs.get('char_pos_ids'),
+                                    kwargs.get('cap_ids'))
+        features = np.empty((len(word_ids), self.word_features.shape[1]),
+                            dtype=np.float32)
+        features[known] = self.word_features[word_ids[known]]
+        if not known.all():
+            unknown = ~known
+            features[unknown] = self.compute_features(**dict(
+                (k, v[unknown]) for k, v in kwargs.items() if v is not None
+            ))
+        return features.reshape(shape + (-1,))
+
+    def compute_char_features(self, char_for_ids, char_rev_ids,
+                              char_pos_ids):
+        """
+        Outputs of the character LSTMs at the last character of every word,
+        of shape (n_words, char_lstm_dim or 2 * char_lstm_dim). Words
+        without known characters (char_pos_ids -1) get the output after
+        zero steps (h_0), whatever the other words of the batch.
+        """
+        c = self.components
+        n_words = char_pos_ids.shape[0]
+        rows = np.flatnonzero(char_pos_ids >= 0)
+        # Padding after the last character of a word does not change its
+        # output, so the padding of the longest word is enough
+        n_chars = char_pos_ids.max() + 1
+        directions = [('char_lstm_for', char_for_ids)]
+        if self.parameters['char_bidirect']:
+            directions.append(('char_lstm_rev', char_rev_ids))
+        outputs = []
+        for name, char_ids in directions:
+            output = np.tile(c[name]['h_0'], (n_words, 1)).astype(np.float32)
+            if len(rows):
+                h = lstm(c[name], embedding_layer(c['char_layer'],
+                                                  char_ids[rows, :n_chars]))
+                output[rows] = h[np.arange(len(rows)), char_pos_ids[rows]]
+            outputs.append(output)
+        return np.concatenate(outputs, axis=1)
+
+    def get_char_features(self, char_for_ids, char_rev_ids, char_pos_ids):
+        """
+        Character features of every word (see compute_char_features).
+        With a cache, the character LSTMs only run once for every distinct
+        word that is not in the cache.
+        """
+        if self.char_cache is None:
+            return self.compute_char_features(char_for_ids, char_rev_ids,
+                                              char_pos_ids)
+        keys = [tuple(ids[:pos + 1])
+                for ids, pos in zip(char_for_ids, char_pos_ids)]
+        features = {}
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in features or key in missing:
+                continue
+            value = self.char_cache.get(key)
+            if value is None:
+                missing[key] = i
+            else:
+                features[key] = value
+        if missing:
+            rows = np.array(list(missing.values()))
+            new_features = self.compute_char_features(
+                char_for_ids[rows],
+                char_rev_ids[rows] if char_rev_ids is not None else None,
+                char_pos_ids[rows]
+            )
+            for key, value in zip(missing, new_features):
+                features[key] = value
+                self.char_cache.put(key, value)
+        return np.array([features[key] for key in keys])
+
+    def get_scores(self, inputs, mask):
+        """
+        Tag scores of shape (batch_size, max_length, n_tags) from the
+        final input of the word LSTMs.
+        """
+        p = self.parameters
+        c = self.components
+        word_for_output = lstm(c['word_lstm_for'], inputs, mask)
+        if p['word_bidirect']:
+            word_rev_output = lstm(c['word_lstm_rev'], inputs[:, ::-1],
+                                   mask[:, ::-1])[:, ::-1]
+            final_output = np.concatenate(
+                [word_for_output, word_rev_output], axis=-1
+            )
+            final_output = hidden_layer(c['tanh_layer'], final_output,
+                                        activation='tanh')
+        else:
+            final_output = word_for_output
+        return hidden_layer(c['final_layer'], final_output,
+                            activation=(None if p['crf'] else 'softmax'))
+
+    def split_input(self, input, batch):
+        """
+        Map the inputs of create_input / create_batch_input to keywords.
+        """
+        p = self.parameters
+        input = list(input)
+        kwargs = {}
+        if p['word_dim']:
+            kwargs['word_ids'] = input.pop(0)
+        if p['char_dim']:
+            kwargs['char_for_ids'] = input.pop(0)
+            if p['char_bidirect']:
+                kwargs['char_rev_ids'] = input.pop(0)
+            kwargs['char_pos_ids'] = input.pop(0)
+        if p['cap_dim']:
+            kwargs['cap_ids'] = input.pop(0)
+        mask = input.pop(0) if batch else None
+        kwargs = dict((k, np.asarray(v, dtype=np.int32))
+                      for k, v in kwargs.items())
+        if not batch:
+            # A single sentence is a batch of size 1
+            for k in ['word_ids', 'cap_ids']:
+                if k in kwargs:
+                    kwargs[k] = kwargs[k][None, :]
+            s_len = len(kwargs['word_ids'][0] if p['word_dim']
+                        else kwargs['char_pos_ids'])
+            mask = np.ones((1, s_len), dtype=np.float32)
+        return kwargs, np.asarray(mask, dtype=np.float32)
+
+    def build(self, crf, training=False, batch=False, **kwargs):
+        """
+        Return evaluation functions with the same inputs and outputs as the
+        ones compiled by Model.build. There is no training function.
+        """
+        assert not training
+
+        def forward(input):
+            kwargs, mask = self.split_input(input, batch)
+            inputs = self.get_features(mask.shape, **kwargs)
+            return self.get_scores(inputs, mask), mask
+
+        def f_scores(*input):
+            tags_scores = forward(input)[0]
+            return tags_scores if batch else tags_scores[0]
+
+        def f_eval(*input):
+            tags_scores, mask = forward(input)
+            if not crf:
+                return tags_scores.argmax(axis=2) if batch else tags_scores[0]
+            transitions = self.components['transitions']['transitions']
+            # All the sentences of the batch are decoded in one pass
+            y_batch, _ = viterbi(tags_scores, transitions, mask)
+            if batch:
+                return y_batch
+            # Single sentences include the begin and end steps (nn.forward)
+            n_tags = len(self.id_to_tag)
+            return np.concatenate([[n_tags], y_batch[0], [n_tags + 1]]) \
+                .astype(np.int32)
+
+        self.f_scores = f_scores
+        return None, f_eval
+
+    def get_f_scores(self):
+        """
+        Same as Model.get_f_scores.
+        """
+        return self.f_scores
+
+    def get_transitions(self):
+        """
+        Same as Model.get_transitions.
+        """
+        return self.components['transitions']['transitions']
@@ -0,0 +1,75 @@
+"""
+Post-training quantization of the model values, for model bundles
+(see bundle.py and quantize_model.py).
+
+Embeddings, LSTM weights and hidden layer weights are stored as:
+    - int8, with a float32 scale per row (the value of a row is its int8
+      values times its scale), stored as name + SCALE_SUFFIX
+    - or float16
+Biases, initial states and CRF transitions stay in float32. The exported
+word features (see NumpyModel.export_word_features) are computed from the
+float32 values, and are not kept: the quantized model computes the
+features of all the words from its own values.
+"""
+import re
+import numpy as np
+
+
+QUANTIZATION_TYPES = ['int8', 'float16']
+SCALE_SUFFIX = ':scale'
+# Short names of the quantized values (see nn.py)
+QUANTIZED_PARAMS = re.compile(r'^(embeddings|weights|w_\w+)$')
+# Values computed from the float32 values, dropped by quantize_arrays
+PRECOMPUTED_ARRAYS = ['word_features']
+
+
+def is_quantized_param(name):
+    """
+    Whether a value of a bundle (component__param) is quantized.
+    """
+    return bool(QUANTIZED_PARAMS.match(name.split('__')[-1]))
+
+
+def quantize(value, quantization_type):
+    """
+    Quantize a matrix. Return the quantized values and the scales of
+    the rows (None for float16).
+    """
+    value = np.asarray(value, dtype=np.float32)
+    if quantization_type == 'float16':
+        return value.astype(np.float16), None
+    assert quantization_type == 'int8' and value.ndim == 2
+    scale = np.abs(value).max(axis=1) / 127.
+    scale[scale == 0] = 1.
+    quantized = np.clip(np.round(value / scale[:, None]), -127, 127)
+    return quantized.astype(np.int8), scale.astype(np.float32)
+
+
+def dequantize(value, scale=None):
+    """
+    Float32 values of quantized rows (of any shape, the scales have the
+    same shape without the last dimension).
+    """
+    value = np.asarray(value, dtype=np.float32)
+    if scale is not None:
+        value = value * scale[..., None]
+    return value
+
+
+def quantize_arrays(arrays, quantization_type):
+    """
+    Quantize the values of a model (see bundle.read_model). The values
+    precomputed with the float32 values are dropped.
+    """
+    assert quantization_type in QUANTIZATION_TYPES
+    quantized = type(arrays)()
+    for name, value in arrays.items():
+        if name in PRECOMPUTED_ARRAYS:
+            continue
+        if not is_quantized_param(name):
+            quantized[name] = value
+            continue
+        quantized[name], scale = quantize(value, quantization_type)
+        if scale is not None:
+            quantized[name + SCALE_SUFFIX] = scale
+    return quantized
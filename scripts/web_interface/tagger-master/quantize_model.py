@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import time
+import optparse
+from bundle import read_model, write_bundle
+from loader import load_sentences, update_tag_scheme
+from quantization import (QUANTIZATION_TYPES, PRECOMPUTED_ARRAYS,
+                          quantize_arrays)
+from tagging import Tagger
+from utils import iob_ranges
+
+optparser = optparse.OptionParser()
+optparser.add_option(
+    "-m", "--model", default="",
+    help="Model location"
+)
+optparser.add_option(
+    "-o", "--output", default="",
+    help="Bundle location (model_dir.TYPE.bundle by default)"
+)
+optparser.add_option(
+    "-t", "--type", default="int8",
+    help="Quantization type (int8 or float16)"
+)
+optparser.add_option(
+    "--test", default="",
+    help="Test set location: report the F1 of both models"
+)
+optparser.add_option(
+    "-b", "--batch_size", default="16",
+    type='int', help="Number of sentences tagged at once (test set)"
+)
+opts = optparser.parse_args()[0]
+
+# Check parameters validity
+assert os.path.isdir(opts.model)
+assert opts.type in QUANTIZATION_TYPES
+assert not opts.test or os.path.isfile(opts.test)
+assert opts.batch_size > 0
+
+
+def entity_counts(tagger, sentences):
+    """
+    Number of correct, predicted and gold entities per type, where an
+    entity is correct if it has the same words and type as a gold entity.
+    """
+    counts = {}
+    all_words = [[w[0] for w in s] for s in sentences]
+    for s, tags in zip(sentences, tagger.tag(all_words)):
+        gold = set(iob_ranges([w[-1] for w in s]))
+        predicted = set(iob_ranges(tags))
+        for entities, i in [(gold & predicted, 0), (predicted, 1),
+                            (gold, 2)]:
+            for entity in entities:
+                for entity_type in [entity[2], 'ALL']:
+                    counts.setdefault(entity_type, [0, 0, 0])[i] += 1
+    return counts
+
+
+def f1(correct, predicted, gold):
+    precision = 100. * correct / predicted if predicted else 0.
+    recall = 100. * correct / gold if gold else 0.
+    if not precision + recall:
+        return 0.
+    return 2 * precision * recall / (precision + recall)
+
+
+bundle_path = opts.output or '%s.%s.bundle' % (opts.model.rstrip('/\\'),
+                                               opts.type)
+start = time.time()
+parameters, mappings, arrays = read_model(opts.model)
+write_bundle(bundle_path, parameters, mappings,
+             quantize_arrays(arrays, opts.type))
+size = sum(value.nbytes for name, value in arrays.items()
+           if name not in PRECOMPUTED_ARRAYS)
+print('%s -> %s (%s) in %.4fs' % (opts.model, bundle_path, opts.type,
+                                  time.time() - start))
+print('Size: %.1f MB (float32) -> %.1f MB' % (size / 1e6,
+                                      (os.path.getsize(bundle_path)) / 1e6))
+dropped = [name for name in PRECOMPUTED_ARRAYS if name in arrays]
+if dropped:
+    print('Not quantized (computed from the float32 values): %s' %
+          ', '.join(dropped))
+
+if opts.test:
+    sentences = load_sentences(opts.test, False, False)
+    update_tag_scheme(sentences, 'iob')
+    print('Evaluating on %i sentences of %s...' % (len(sentences),
+                                                    opts.test))
+    all_counts = [
+        entity_counts(Tagger(path, engine='numpy',
+                             batch_size=opts.batch_size), sentences)
+        for path in [opts.model, bundle_path]
+    ]
+    print('%-20s %8s %8s %8s' % ('type', 'float32', opts.type, 'delta'))
+    for entity_type in sorted(all_counts[0], key=lambda x: (x == 'ALL', x)):
+        scores = [f1(*counts.get(entity_type, [0, 0, 0]))
+                  for counts in all_counts]
+        print('%-20s %8.2f %8.2f %+8.2f' % (entity_type, scores[0],
+                                            scores[1], scores[1] - scores[0]))
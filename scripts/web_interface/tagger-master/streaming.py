@@ -0,0 +1,172 @@
+import sys
+import threading
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from utils import bucket_batches
+
+
+# Marks the end of the items in a queue
+END = None
+
+
+class Stopped(Exception):
+    """
+    Raised in a stage when another stage of the pipeline failed.
+    """
+    pass
+
+
+class Pipeline(object):
+    """
+    Stages running in threads, connected by bounded queues.
+    If a stage fails, the other stages stop and the error is raised by join.
+    """
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.threads = []
+        self.errors = []
+
+    def put(self, q, item):
+        """
+        Put an item in a queue, waiting while the queue is full.
+        """
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise Stopped()
+
+    def iterate(self, q):
+        """
+        Iterate over the items of a queue until END.
+        """
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    raise Stopped()
+                continue
+            if item is END:
+                return
+            yield item
+
+    def start(self, target, *args):
+        """
+        Run a stage in a new thread.
+        """
+        def run():
+            try:
+                target(*args)
+            except Stopped:
+                pass
+            except BaseException:
+                self.errors.append(sys.exc_info())
+                self.stopped.set()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def join(self):
+        """
+        Wait for all stages, and raise the error of a failed stage.
+        """
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(0.1)
+        if self.errors:
+            error = self.errors[0][1]
+            raise error
+
+
+def read_stage(pipeline, lines, out_queue):
+    """
+    Split the input lines into words: (index, words) items.
+    """
+    for index, line in enumerate(lines):
+        pipeline.put(out_queue, (index, line.rstrip().split()))
+    pipeline.put(out_queue, END)
+
+
+def batch_stage(pipeline, in_queue, out_queue, batch_size, window_size,
+                bucket_width):
+    """
+    Group sentences of similar length into batches. The sentences of a
+    window of window_size consecutive lines are bucketed by number of words
+    and longest word (see utils.bucket_batches), so that batches need
+    little padding, and the output order only depends on the lines of
+    one window.
+    """
+    def flush(window):
+        lengths = [(len(words), max([len(w) for w in words] or [0]))
+                   for _, words in window]
+        for batch in bucket_batches(lengths, batch_size, bucket_width):
+            pipeline.put(out_queue, [window[i] for i in batch])
+
+    window = []
+    for item in pipeline.iterate(in_queue):
+        window.append(item)
+        if len(window) == window_size:
+            flush(window)
+            window = []
+    flush(window)
+    pipeline.put(out_queue, END)
+
+
+def decode_stage(pipeline, tag, in_queue, out_queue):
+    """
+    Tag batches of sentences: (index, words, tags) items.
+    """
+    for batch in pipeline.iterate(in_queue):
+        indexes, all_words = zip(*batch)
+        all_tags = tag(list(all_words))
+        pipeline.put(out_queue, list(zip(indexes, all_words, all_tags)))
+    pipeline.put(out_queue, END)
+
+
+def write_stage(pipeline, in_queue, write, report, report_every):
+    """
+    Write the tagged sentences in input order.
+    """
+    pending = {}
+    count = 0
+    for tagged in pipeline.iterate(in_queue):
+        for index, words, tags in tagged:
+            pending[index] = (words, tags)
+        while count in pending:
+            write(*pending.pop(count))
+            count += 1
+            if report is not None and count % report_every == 0:
+                report(count)
+
+
+def tag_stream(tag, lines, write, batch_size=1, window_size=1000,
+               bucket_width=1, queue_size=16, report=None, report_every=100):
+    """
+    Tag an iterable of lines (one tokenized sentence per line) with a
+    pipeline of reader, batcher, decoder and writer stages, so that
+    reading and writing overlap with decoding. The memory only depends
+    on window_size and queue_size, not on the length of the input.
+    tag(sentences) tags a list of tokenized sentences (e.g. Tagger.tag).
+    write(words, tags) is called for every line, in input order, with the
+    output of tag for this line (empty lines have no words).
+    report(count) is called every report_every lines.
+    """
+    assert batch_size > 0 and window_size > 0 and queue_size > 0
+    pipeline = Pipeline()
+    lines_queue = queue.Queue(maxsize=window_size)
+    batches_queue = queue.Queue(maxsize=queue_size)
+    tagged_queue = queue.Queue(maxsize=queue_size)
+    pipeline.start(read_stage, pipeline, lines, lines_queue)
+    pipeline.start(batch_stage, pipeline, lines_queue, batches_queue,
+                   batch_size, window_size, bucket_width)
+    pipeline.start(decode_stage, pipeline, tag, batches_queue,
+                   tagged_queue)
+    pipeline.start(write_stage, pipeline, tagged_queue, write, report,
+                   report_every)
+    pipeline.join()
@@ -1,27 +1,28 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
 import os
+import sys
 import time
 import codecs
 import optparse
 import json
-import numpy as np
-from loader import prepare_sentence
-from utils import create_input, iobes_iob, iob_ranges, zero_digits
-from model import Model
+import functools
+from tagging import Tagger
+from streaming import tag_stream
 
 optparser = optparse.OptionParser()
 optparser.add_option(
     "-m", "--model", default="",
-    help="Model location"
+    help="Model location (directory or bundle)"
 )
 optparser.add_option(
     "-i", "--input", default="",
-    help="Input file location"
+    help="Input file location (- for stdin)"
 )
 optparser.add_option(
     "-o", "--output", default="",
-    help="Output file location"
+    help="Output file location (- for stdout)"
 )
 optparser.add_option(
     "-d", "--delimiter", default="__",
@@ -31,76 +32,111 @@ optparser.add_option(
     "--outputFormat", default="",
     help="Output file format"
 )
+optparser.add_option(
+    "-b", "--batch_size", default="1",
+    type='int', help="Number of sentences tagged at once"
+)
+optparser.add_option(
+    "-w", "--window_size", default="1000",
+    type='int', help="Number of lines sorted by length to form batches"
+)
+optparser.add_option(
+    "--bucket_width", default="1",
+    type='int', help="Width of the sentence / word length buckets of a batch"
+)
+optparser.add_option(
+    "-e", "--engine", default="theano",
+    help="Inference engine (theano or numpy)"
+)
+optparser.add_option(
+    "--char_cache_size", default="10000",
+    type='int', help="Distinct words with cached character features (numpy)"
+)
+optparser.add_option(
+    "--min_confidence", default="0",
+    type='float', help="Tag entities with a lower confidence as O (0 to 1)"
+)
 opts = optparser.parse_args()[0]
 
 # Check parameters validity
 assert opts.delimiter
-assert os.path.isdir(opts.model)
-assert os.path.isfile(opts.input)
+assert opts.batch_size > 0
+assert opts.window_size > 0
+assert opts.bucket_width > 0
+assert opts.engine in ['theano', 'numpy']
+assert opts.char_cache_size >= 0
+assert 0 <= opts.min_confidence <= 1
+assert os.path.isdir(opts.model) or os.path.isfile(opts.model)
+assert opts.input == '-' or os.path.isfile(opts.input)
+
+
+def open_stream(path, mode):
+    """
+    Open a file in utf-8, or stdin / stdout if the path is "-".
+    """
+    if path != '-':
+        return codecs.open(path, mode, 'utf-8')
+    stream = sys.stdin if mode == 'r' else sys.stdout
+    stream = getattr(stream, 'buffer', stream)
+    return (codecs.getreader if mode == 'r' else codecs.getwriter)('utf-8')(stream)
+
 
 # Load existing model
-print("Loading model...")
+print("Loading model...", file=sys.stderr)
 tic = time.time()
-model = Model(model_path=opts.model)
-parameters = model.parameters
+tagger = Tagger(opts.model, engine=opts.engine, batch_size=opts.batch_size,
+                char_cache_size=opts.char_cache_size)
+print('Model built and compiled in %.4fs' % (time.time() - tic),
+      file=sys.stderr)
 
-# Load reverse mappings
-word_to_id, char_to_id, tag_to_id = [
-    {v: k for k, v in list(x.items())}
-    for x in [model.id_to_word, model.id_to_char, model.id_to_tag]
-]
 
-# Load the model
-_, f_eval = model.build(training=False, **parameters)
-model.reload()
+def write_sentence(words_ini, y_preds):
+    """
+    Write a tagged sentence to the output file.
+    Empty lines are written back as they are.
+    In the json format, y_preds contains the tags, the confidences of the
+    words and the entities (see Tagger.tag_with_confidence).
+    """
+    global count
+    count += 1
+    if not words_ini:
+        f_output.write('\n')
+    elif opts.outputFormat == 'json':
+        words = tagger.normalize(words_ini)
+        _, token_confidences, entities = y_preds
+        f_output.write(json.dumps({
+            "text": ' '.join(words),
+            "ranges": [(begin, end, type) for begin, end, type, _ in entities],
+            "confidences": [confidence for _, _, _, confidence in entities],
+            "token_confidences": token_confidences
+        }) + '\n')
+    else:
+        f_output.write('%s\n' % ' '.join('%s%s%s' % (w, opts.delimiter, y)
+                                         for w, y in zip(words_ini, y_preds)))
 
-f_output = codecs.open(opts.output, 'w', 'utf-8')
-toc = time.time()
-elapsed = tic-toc
-print('time needed for model building and compilation... ')
-print(elapsed)
-start = time.time()
 
-print('Tagging...')
-with codecs.open(opts.input, 'r', 'utf-8') as f_input:
-    count = 0
-    for line in f_input:
-        words_ini = line.rstrip().split()
-        if line:
-            # Lowercase sentence
-            if parameters['lower']:
-                line = line.lower()
-            # Replace all digits with zeros
-            if parameters['zeros']:
-                line = zero_digits(line)
-            words = line.rstrip().split()
-            # Prepare input
-            sentence = prepare_sentence(words, word_to_id, char_to_id,
-                                        lower=parameters['lower'])
+def report(n_lines):
+    print('%i lines tagged' % n_lines, file=sys.stderr)
 
-            input = create_input(sentence, parameters, False)
-            # Decoding
-            if parameters['crf']:
-                y_preds = np.array(f_eval(*input))[1:-1]
-            else:
-                y_preds = f_eval(*input).argmax(axis=1)
-            y_preds = [model.id_to_tag[y_pred] for y_pred in y_preds]
-            # Output tags in the IOB2 format
-            if parameters['tag_scheme'] == 'iobes':
-                y_preds = iobes_iob(y_preds)
-            # Write tags
-            assert len(y_preds) == len(words)
-            
-            if opts.outputFormat == 'json':
-                f_output.write(json.dumps({ "text": ' '.join(words), "ranges": iob_ranges(y_preds) }))
-            else:
-                f_output.write('%s\n' % ' '.join('%s%s%s' % (w, opts.delimiter, y)
-                                                 for w, y in zip(words_ini, y_preds)))
-        else:
-            f_output.write('\n')
-        count += 1
-        if count % 100 == 0:
-            print(count)
 
-print(('---- %i lines tagged in %.4fs ----' % (count, time.time() - start)))
-f_output.close()
+print('Tagging...', file=sys.stderr)
+start = time.time()
+count = 0
+f_input = open_stream(opts.input, 'r')
+f_output = open_stream(opts.output, 'w')
+if opts.outputFormat == 'json':
+    tag = tagger.tag_with_confidence
+else:
+    tag = tagger.tag
+tag = functools.partial(tag, min_confidence=opts.min_confidence)
+tag_stream(tag, f_input, write_sentence, batch_size=opts.batch_size,
+           window_size=opts.window_size, bucket_width=opts.bucket_width,
+           report=report)
+f_output.flush()
+if opts.input != '-':
+    f_input.close()
+if opts.output != '-':
+    f_output.close()
+
+print(('---- %i lines tagged in %.4fs ----' % (count, time.time() - start)),
+      file=sys.stderr)
@@ -0,0 +1,207 @@
+import numpy as np
+from decoding import viterbi, marginals, segment_probabilities
+from loader import prepare_sentence
+from utils import create_input, create_batch_input, predict_batches
+from utils import iobes_iob, iob_ranges, zero_digits
+
+
+class Tagger(object):
+    """
+    Trained model kept in memory to tag tokenized sentences.
+    The model is loaded and compiled once, and can then be used for
+    any number of calls without temporary files.
+    """
+    def __init__(self, model_path, engine='numpy', batch_size=1,
+                 char_cache_size=0):
+        """
+        Load the model stored at model_path with the given inference
+        engine (theano or numpy). The numpy engine can keep the character
+        features of the last char_cache_size distinct words in memory.
+        """
+        assert engine in ['theano', 'numpy']
+        assert batch_size > 0
+        if engine == 'numpy':
+            from numpy_model import NumpyModel
+            self.model = NumpyModel(model_path=model_path,
+                                    char_cache_size=char_cache_size)
+        else:
+            from model import Model
+            self.model = Model(model_path=model_path)
+        self.parameters = self.model.parameters
+        self.batch_size = batch_size
+
+        # Load reverse mappings
+        self.word_to_id, self.char_to_id, self.tag_to_id = [
+            {v: k for k, v in list(x.items())}
+            for x in [self.model.id_to_word, self.model.id_to_char,
+                      self.model.id_to_tag]
+        ]
+
+        # Load the model
+        _, self.f_eval = self.model.build(training=False,
+                                          batch=batch_size > 1,
+                                          **self.parameters)
+        self.model.reload()
+
+    def normalize(self, words):
+        """
+        Apply the lowercasing / zeros preprocessing of the model.
+        """
+        line = ' '.join(words)
+        # Lowercase sentence
+        if self.parameters['lower']:
+            line = line.lower()
+        # Replace all digits with zeros
+        if self.parameters['zeros']:
+            line = zero_digits(line)
+        return line.split()
+
+    def prepare(self, words):
+        """
+        Prepare a tokenized sentence for the network.
+        """
+        return prepare_sentence(self.normalize(words), self.word_to_id,
+                                self.char_to_id,
+                                lower=self.parameters['lower'])
+
+    def decode(self, sentences):
+        """
+        Return the predicted tag indexes of a list of prepared sentences.
+        """
+        return predict_batches(self.parameters, self.f_eval, sentences,
+                               self.batch_size)
+
+    def get_scores(self, sentences):
+        """
+        Return the tag scores of every word of a list of prepared sentences
+        (emission scores with a CRF, tag probabilities otherwise).
+        """
+        f_scores = self.model.get_f_scores()
+        if self.batch_size == 1:
+            return [np.asarray(f_scores(*create_input(sentence,
+                                                      self.parameters,
+                                                      False)))
+                    for sentence in sentences]
+        all_scores = []
+        for i in range(0, len(sentences), self.batch_size):
+            batch = sentences[i:i + self.batch_size]
+            scores = f_scores(*create_batch_input(batch, self.parameters))
+            all_scores.extend(np.asarray(s[:len(data['words'])])
+                              for s, data in zip(scores, batch))
+        return all_scores
+
+    def decode_with_confidence(self, sentences):
+        """
+        Return the predicted tag indexes of a list of prepared sentences,
+        the probability of the predicted tag of every word (CRF marginals),
+        and a function giving the probability of the predicted tags of
+        (start, end) word spans of every sentence.
+        """
+        all_scores = self.get_scores(sentences)
+        lengths = [len(scores) for scores in all_scores]
+        scores = np.zeros((len(all_scores), max(lengths),
+                           all_scores[0].shape[1]), dtype=np.float32)
+        mask = np.zeros(scores.shape[:2], dtype=np.float32)
+        for i, (s, length) in enumerate(zip(all_scores, lengths)):
+            scores[i, :length] = s
+            mask[i, :length] = 1
+        if self.parameters['crf']:
+            transitions = self.model.get_transitions()
+            paths = viterbi(scores, transitions, mask)[0]
+            probabilities = marginals(scores, transitions, mask)
+        else:
+            paths = scores.argmax(axis=2)
+            probabilities = scores
+        all_y_preds = [paths[i, :length] for i, length in enumerate(lengths)]
+        all_token_probabilities = [
+            probabilities[i, np.arange(length), paths[i, :length]]
+            for i, length in enumerate(lengths)
+        ]
+
+        def span_probabilities(spans):
+            if self.parameters['crf']:
+                return segment_probabilities(scores, transitions, paths,
+                                             spans, mask)
+            # Without a CRF, the tags of the words are independent
+            return [[float(np.prod(token_probabilities[i:j + 1]))
+                     for i, j in sentence_spans]
+                    for token_probabilities, sentence_spans
+                    in zip(all_token_probabilities, spans)]
+
+        return all_y_preds, all_token_probabilities, span_probabilities
+
+    def get_tags(self, y_preds):
+        """
+        Convert predicted tag indexes to IOB2 tags.
+        """
+        tags = [self.model.id_to_tag[y_pred] for y_pred in y_preds]
+        if self.parameters['tag_scheme'] == 'iobes':
+            tags = iobes_iob(tags)
+        return tags
+
+    def tag(self, sentences, min_confidence=0.):
+        """
+        Tag a list of tokenized sentences (lists of words).
+        Return a list with the IOB2 tags of each sentence.
+        Empty sentences get an empty list of tags.
+        Entities with a confidence below min_confidence are tagged O
+        (see tag_with_confidence).
+        """
+        if min_confidence > 0:
+            return [tags for tags, _, _ in
+                    self.tag_with_confidence(sentences, min_confidence)]
+        prepared = [self.prepare(words) for words in sentences if words]
+        all_y_preds = iter(self.decode(prepared) if prepared else [])
+        all_tags = []
+        for words in sentences:
+            if not words:
+                all_tags.append([])
+                continue
+            y_preds = self.get_tags(next(all_y_preds))
+            assert len(y_preds) == len(words)
+            all_tags.append(y_preds)
+        return all_tags
+
+    def tag_with_confidence(self, sentences, min_confidence=0.):
+        """
+        Tag a list of tokenized sentences (lists of words) with confidence
+        scores. Return a list with, for each sentence:
+            - the IOB2 tags
+            - the probability of the predicted tag of every word
+            - the entities, as (begin, end, type, confidence) tuples
+              (end included), the confidence being the probability that
+              all the words of the entity have their predicted tags
+        Entities with a confidence below min_confidence are tagged O and
+        are not returned. The tags can differ from the ones of tag with
+        the Theano engine by rounding errors.
+        """
+        prepared = [self.prepare(words) for words in sentences if words]
+        if prepared:
+            all_y_preds, all_token_probabilities, span_probabilities = \
+                self.decode_with_confidence(prepared)
+        else:
+            all_y_preds, all_token_probabilities = [], []
+        all_tags = [self.get_tags(y_preds) for y_preds in all_y_preds]
+        all_ranges = [iob_ranges(tags) for tags in all_tags]
+        all_confidences = iter(span_probabilities(
+            [[(begin, end) for begin, end, _ in ranges]
+             for ranges in all_ranges]
+        ) if prepared else [])
+        tagged = iter(zip(all_tags, all_token_probabilities, all_ranges))
+        results = []
+        for words in sentences:
+            if not words:
+                results.append(([], [], []))
+                continue
+            tags, token_probabilities, ranges = next(tagged)
+            entities = []
+            for (begin, end, type), confidence in zip(ranges,
+                                                      next(all_confidences)):
+                if confidence < min_confidence:
+                    tags[begin:end + 1] = ['O'] * (end + 1 - begin)
+                else:
+                    entities.append((begin, end, type, confidence))
+            assert len(tags) == len(words)
+            results.append((tags, [float(p) for p in token_probabilities],
+                            entities))
+        return results
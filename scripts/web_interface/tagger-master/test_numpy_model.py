@@ -0,0 +1,110 @@
+"""
+Tests of the NumPy engine on words without known characters (cached and
+precomputed features), with the German botlit model of resources/models.
+
+    python -m unittest test_numpy_model
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from numpy_model import NumpyModel
+from tagging import Tagger
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', '..', '..', 'resources', 'models', 'de',
+                          'model_botlit_dropout0.3_de')
+# Characters that are not in the character mapping of the model
+UNKNOWN = u'\u72ac\u69c7'
+SENTENCE = [u'Die', UNKNOWN, u'Rose']
+OTHER = [u'Bellis', u'perennis', u'und', u'Taraxacum', UNKNOWN,
+         u'officinale', u'G\xe4nsebl\xfcmchen']
+
+
+@unittest.skipUnless(os.path.isdir(MODEL_PATH), 'no model')
+class UnknownCharactersTest(unittest.TestCase):
+
+    def assertSameConfidences(self, first, second):
+        self.assertEqual([tags for tags, _, _ in first],
+                         [tags for tags, _, _ in second])
+        for (_, a, _), (_, b, _) in zip(first, second):
+            np.testing.assert_allclose(a, b, rtol=1e-6)
+
+    def test_only_unknown_characters(self):
+        expected = Tagger(MODEL_PATH).tag_with_confidence([[UNKNOWN]])
+        self.assertEqual(len(expected[0][0]), 1)
+        batch = Tagger(MODEL_PATH, batch_size=4).tag_with_confidence(
+            [[UNKNOWN], SENTENCE, OTHER]
+        )
+        self.assertSameConfidences(expected, batch[:1])
+        tagger = Tagger(MODEL_PATH, char_cache_size=1000)
+        for _ in range(2):
+            self.assertSameConfidences(
+                expected, tagger.tag_with_confidence([[UNKNOWN]])
+            )
+
+    def test_independent_of_previous_sentences(self):
+        expected = Tagger(MODEL_PATH).tag_with_confidence([SENTENCE])
+        for batch_size in [1, 4]:
+            tagger = Tagger(MODEL_PATH, batch_size=batch_size,
+                            char_cache_size=1000)
+            tagger.tag([OTHER])
+            self.assertSameConfidences(
+                expected, tagger.tag_with_confidence([SENTENCE])
+            )
+
+
+@unittest.skipUnless(os.path.isdir(MODEL_PATH), 'no model')
+class PrecomputedFeaturesTest(unittest.TestCase):
+
+    def setUp(self):
+        # Copy of the model with a vocabulary word without known characters,
+        # as the words added from pretrained embeddings can be
+        self.model_path = tempfile.mkdtemp()
+        for file_name in os.listdir(MODEL_PATH):
+            shutil.copy(os.path.join(MODEL_PATH, file_name), self.model_path)
+        mappings_path = os.path.join(self.model_path, 'mappings.pkl')
+        with open(mappings_path, 'rb') as f:
+            mappings = pickle.load(f)
+        self.word_id = len(mappings['id_to_word']) - 1
+        mappings['id_to_word'][self.word_id] = UNKNOWN
+        with open(mappings_path, 'wb') as f:
+            pickle.dump(mappings, f)
+        model = NumpyModel(self.model_path)
+        model.reload()
+        model.export_word_features()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_path)
+
+    def test_unknown_characters(self):
+        tagger = Tagger(self.model_path, batch_size=4)
+        self.assertIsNotNone(tagger.model.word_features)
+        self.assertEqual(tagger.word_to_id[UNKNOWN], self.word_id)
+        sentences = [tagger.prepare(s) for s in [SENTENCE, OTHER, [UNKNOWN]]]
+        model = tagger.model
+        # Precomputed features and features of the word alone
+        cap_ids = np.array(model.prepare_vocabulary()['caps'])[[self.word_id]]
+        kwargs = dict(word_ids=np.array([self.word_id]),
+                      char_for_ids=np.zeros((1, 1), dtype=np.int32),
+                      char_rev_ids=np.zeros((1, 1), dtype=np.int32),
+                      char_pos_ids=np.array([-1]), cap_ids=cap_ids)
+        self.assertTrue(model.is_precomputed(
+            kwargs['word_ids'], kwargs['char_for_ids'],
+            kwargs['char_pos_ids'], cap_ids
+        )[0])
+        np.testing.assert_allclose(model.word_features[self.word_id],
+                                   model.compute_features(**kwargs)[0],
+                                   rtol=1e-5, atol=1e-6)
+        precomputed = tagger.get_scores(sentences)
+        model.word_features = None
+        computed = tagger.get_scores(sentences)
+        # Scores of sentences where the word is batched with other words
+        for a, b in zip(precomputed, computed):
+            np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,10 +6,10 @@ from collections import defaultdict
 import optparse
 import itertools
 from collections import OrderedDict
-from utils import create_input
+from utils import create_input, create_eval_batches
 import loader
 
-from utils import models_path, evaluate, eval_script, eval_temp
+from utils import models_path, evaluate, eval_temp
 from loader import word_mapping, char_mapping, tag_mapping
 from loader import update_tag_scheme, prepare_dataset
 from loader import augment_with_pretrained
@@ -93,6 +93,10 @@ optparser.add_option(
     "-r", "--reload", default="0",
     type='int', help="Reload the last saved model"
 )
+optparser.add_option(
+    "--save_eval", default="0",
+    type='int', help="Write the predictions and scores of every evaluation to the evaluation folder"
+)
 opts = optparser.parse_args()[0]
 
 # Parse parameters
@@ -124,10 +128,8 @@ assert not parameters['all_emb'] or parameters['pre_emb']
 assert not parameters['pre_emb'] or parameters['word_dim'] > 0
 assert not parameters['pre_emb'] or os.path.isfile(parameters['pre_emb'])
 
-# Check evaluation script / folders
-if not os.path.isfile(eval_script):
-    raise Exception('CoNLL evaluation script not found at "%s"' % eval_script)
-if not os.path.exists(eval_temp):
+# Check evaluation folders
+if opts.save_eval and not os.path.exists(eval_temp):
     os.makedirs(eval_temp)
 if not os.path.exists(models_path):
     os.makedirs(models_path)
@@ -206,6 +208,8 @@ freq_eval = 1000  # evaluate on dev every freq_eval steps
 best_dev = -np.inf
 best_test = -np.inf
 all_test_scores_over_epochs = defaultdict(float)
+# inputs of the test set, prepared once for all the evaluations
+test_batches = create_eval_batches(parameters, test_data)
 
 count = 0
 for epoch in range(n_epochs):
@@ -222,7 +226,9 @@ for epoch in range(n_epochs):
             # dev_score = evaluate(parameters, f_eval, dev_sentences,
             #                      dev_data, id_to_tag, dico_tags)
             test_score = evaluate(parameters, f_eval, test_sentences,
-                                  test_data, id_to_tag, dico_tags, epoch)
+                                  test_data, id_to_tag, dico_tags, epoch,
+                                  save_output=opts.save_eval == 1,
+                                  eval_batches=test_batches)
             # print "Score on dev: %.5f" % dev_score
             print("Score on test: %.5f" % test_score)
             # if dev_score > best_dev:
@@ -10,19 +10,84 @@ Web-application to input text and highlight NER-tagged plant names.
 Pipeline:
     1. input text
     2. tokenize input
-    3. run tagger.py (from Lample et al. (2016))
-    4. run entity_linker.py to link the detected entities to reference database (Catalogue of Life)
+    3. tag with the NER model of the input language (tagger from Lample et al. (2016))
+    4. link the detected entities to reference database (Catalogue of Life), see entity_linker.py
     5. highlight found entities and display link to database entry
+
+The NER model can be chosen per request (GET /models lists the available models), by default the model of the
+input language is used. Models are loaded on first use and the least recently used models are unloaded under a
+memory budget (see model_registry.py). The lookup tables are loaded once per language and stay in memory.
+Each request works on its own in-memory data (no shared output files), so the server can
+handle several requests in parallel threads.
 """
-from flask import Flask, render_template, request
-from nltk import word_tokenize
-from nltk.tokenize import sent_tokenize
-import subprocess
+from collections import defaultdict
+from flask import Flask, jsonify, render_template, request
 import json
-import spacy
+import os
 import sys
+import threading
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagger-master"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "entity_linking"))
+from model_registry import ModelRegistry
+from col_cache import ColCache
+from col_client import ColClient
+from tokenizer_registry import TokenizerRegistry
+from entity_linker import process_file, create_json, store_reference_db
+
+PATH_MODELS = ["./models/", "./../../resources/models/"]
+DEFAULT_MODELS = {"de": "model_wiki_de", "en": "model_wiki_en"}
+# maximum memory of the loaded models
+MEMORY_BUDGET = 1024 * 1024 ** 2
+PATH_CACHE = "./col_cache.sqlite"
+# character features of the most frequent words are kept in memory by every model
+CHAR_CACHE_SIZE = 50000
+# entity candidates with a lower confidence (CRF probability of their tags) are not linked
+MIN_CONFIDENCE = 0.
+
+lookup_tables = {}
+loading_lock = threading.Lock()
+tokenizers = TokenizerRegistry()
+models = ModelRegistry(PATH_MODELS, MEMORY_BUDGET, char_cache_size=CHAR_CACHE_SIZE)
+# Catalogue of Life API responses, shared by all requests and kept between server restarts
+col_cache = ColCache(PATH_CACHE, ttl=30 * 24 * 3600, max_size=100000)
+# keep-alive connections to the webservice, at most 8 concurrent API requests over all requests
+col_client = ColClient(concurrency=8)
+
+
+def get_lookup_table(language):
+    """
+    Load the vernacular -> scientific name lookup table of a language on first use.
+    An empty table is used if there is no lookup table for the language.
+    :param language: (str) language to process, "de" or "en"
+    :return: lookup_table (dictionary)
+    """
+    with loading_lock:
+        if language not in lookup_tables:
+            try:
+                lookup_tables[language] = store_reference_db(language)
+            except FileNotFoundError:
+                print(">> no lookup table found for language '{}'".format(language), file=sys.stderr, flush=True)
+                lookup_tables[language] = defaultdict(list)
+    return lookup_tables[language]
+
+
+def tag_sentences(tokenized_response, model_name):
+    """
+    Tag the tokenized input and return it in the (token, iob) format used for linking.
+    :param tokenized_response: (str) one tokenized sentence per line
+    :param model_name: (str) name of the NER model (see model_registry.py)
+    :return: list_tagged containing token, iob-tag pairs
+    """
+    sentences = [line.split() for line in tokenized_response.split("\n") if line.strip()]
+    list_tagged = []
+    for words, tags in zip(sentences, models.get(model_name).tag(sentences, MIN_CONFIDENCE)):
+        list_tagged.extend(zip(words, tags))
+        list_tagged.append(("EOS", "EOS"))
+    return list_tagged
+
 
 
 def tokenize_input(inputText, language):
@@ -31,15 +96,12 @@ def tokenize_input(inputText, language):
     Check for the presence of botanical abbreviations and re-merge sentences.
     :param inputText: (str) user input text from web-interface.
     :param language: (str) language to process, "de" or "en"
+    :return: tokenized_response: (str) one tokenized sentence per line
     """
 
-    if language == 'de':
-        sent_tokenize_list = sent_tokenize(inputText, 'german')
-    elif language == 'en':
-        nlp = spacy.load('en')
-        sent_tokenize_list = sent_tokenize(inputText)
-    else:
-        raise NotImplementedError("Please choose one of the following languages (de, en).", file=sys.stderr, flush=True)
+    if language not in ['de', 'en']:
+        raise NotImplementedError("Please choose one of the following languages (de, en).")
+    sent_tokenize_list = tokenizers.sent_tokenize(inputText, language)
 
     # fix erroneous sentence segmentation
     fixed_sentences = []
@@ -56,10 +118,7 @@ def tokenize_input(inputText, language):
     tokenized_input = []
     counter_abbreviations = 0
     for sent in fixed_sentences:
-        if language == 'de':
-            tokens = word_tokenize(sent, 'german')
-        elif language == 'en':
-            tokens = list(nlp(sent))
+        tokens = tokenizers.word_tokenize(sent, language)
 
         fixed_tokens = []
         for i, token in enumerate(tokens):
@@ -78,8 +137,7 @@ def tokenize_input(inputText, language):
     tokenized_response = tokenized_response.replace("\n ", "\n")
     print(">> Done! Remerged {} sentence(s) at botanical abbreviations".format(counter_abbreviations), file=sys.stderr, flush=True)
 
-    with open("./output/input_tokenized.txt", "w", encoding="utf-8") as tok_file:
-        tok_file.write(tokenized_response)
+    return tokenized_response
 
 
 app = Flask(__name__)
@@ -88,41 +146,45 @@ app = Flask(__name__)
 def home():
     return render_template("index.html")
 
+@app.route("/models")
+def get_models():
+    language = request.args.get('lang')
+    return jsonify({"default_models": DEFAULT_MODELS, "models": models.describe(language)})
+
 @app.route("/ask", methods=['POST'])
 def get_response():
     inputText = request.form.get('data')
     language = request.form.get('lang')
+    model_name = request.form.get('model')
     print(">> RECEIVED USER INPUT:\n {}".format(inputText), file=sys.stderr, flush=True)
     print(">> INPUT LANGUAGE: '{}'".format(language), file=sys.stderr, flush=True)
 
     # TOKENIZE
     if language == 'de':
         print("\n>> tokenizing German input text...")
-        tokenize_input(inputText, language)
-        model = "model_wiki_de"
     else:
         print("\n>> tokenizing English input text...")
-        tokenize_input(inputText, language)
-        model = "model_wiki_en"
+        language = 'en'
+    if not model_name:
+        model_name = DEFAULT_MODELS[language]
+    elif model_name not in models:
+        return "Unknown model '{}' (see /models)".format(model_name), 400
+    tokenized_response = tokenize_input(inputText, language)
 
     # TAGGING
-    print("\n>> tagging tokenized input text...", file=sys.stderr, flush=True)
-    subprocess.call(
-        "python2.7 ./tagger-master/tagger.py -m ./models/{} -i ./output/input_tokenized.txt -o ./output/output_tagged.txt -d __".format(
-            model), shell=True)
+    print("\n>> tagging tokenized input text with {}...".format(model_name), file=sys.stderr, flush=True)
+    list_tagged = tag_sentences(tokenized_response, model_name)
 
     # LINKING: entity_linker.py
     print("\n>> linking entity candidates to reference database", file=sys.stderr, flush=True)
-    subprocess.call(
-        "python3 ./entity_linker.py -i ./output/output_tagged.txt -o ./static/output_linked.json --language {}".format(
-            language), shell=True)
+    no_total_sentences, no_total_entities, index_dict, query_atts, name_occurrence_dict = process_file(list_tagged)
+    data, no_linked_entities = create_json(index_dict, query_atts, name_occurrence_dict, get_lookup_table(language),
+                                           col_cache, col_client)
 
-    # JSON FILE CREATION
+    # JSON CREATION (the download link is created from the response by the browser)
     print("\n>> creating json-file...", file=sys.stderr, flush=True)
-    with open("./static/output_linked.json", "r") as linked_output:
-        data = json.load(linked_output)
-        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
 
 
 if __name__ == "__main__":
-    app.run()
+    app.run(threaded=True)